@@ -0,0 +1,360 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+
+try:
+	import resource
+except ImportError:
+	resource = None  # windows, no peak rss
+
+
+SIZES = (1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024, 256 * 1024 * 1024, 1024 * 1024 * 1024)  # bytes of the generated files
+CASES = ('open', 'save', 'keystroke', 'find', 'shortcut')
+BENCH_FOLDER = os.path.join(tempfile.gettempdir(), 'pyeditor-bench')  # generated files are kept here between runs
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+TOLERANCE = 0.25  # slower than the baseline by more than this share is a regression
+NOISE_MS = 0.05  # differences below this are never regressions
+MIN_TIME = 0.5  # seconds a case keeps sampling after its minimum runs
+MAX_RUNS = 200
+OPEN_TIMEOUT = 60.0  # seconds an open may take, a path that never opens (binary, already open) fails the case
+CASE_TIMEOUT = 900.0  # seconds a case process may run before it is killed and reported as failed
+KEYSTROKES = 200
+SHORTCUT_EVENTS = 10000
+NEEDLE = 'needle'  # one line in NEEDLE_EVERY has it, find looks for it
+NEEDLE_EVERY = 100
+BLOCK_SIZE = 1024 * 1024  # generated text is this block repeated
+
+
+class StubPage:
+	# what the editor touches of flet.Page, updates are only counted
+	platform = 'linux'
+
+	def __init__(self):
+		self.overlay = []
+		self.controls = []
+		self.dialog = None
+		self.updates = 0
+
+	def update(self, *controls):
+		self.updates += 1
+
+
+def parse_size(text: str):
+	units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+	text = text.strip().upper().rstrip('B').rstrip('I')
+	if text and text[-1] in units:
+		return int(float(text[:-1]) * units[text[-1]])
+	return int(text)
+
+
+def size_name(size: int):
+	for unit, scale in (('G', 1024 ** 3), ('M', 1024 ** 2), ('K', 1024)):
+		if size >= scale and size % scale == 0:
+			return f'{size // scale}{unit}'
+	return str(size)
+
+
+def _block():
+	# about BLOCK_SIZE of lines of words, the same for every run
+	generator = random.Random(1)
+	words = [''.join(generator.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(generator.randint(2, 9))) for _ in range(500)]
+	lines = []
+	size = 0
+	while size < BLOCK_SIZE:
+		line = ' '.join(generator.choice(words) for _ in range(generator.randint(4, 14)))
+		if len(lines) % NEEDLE_EVERY == 0:
+			line += f' {NEEDLE}'
+		lines.append(line)
+		size += len(line) + 1
+	return ('\n'.join(lines) + '\n').encode('ascii')
+
+
+def generate(folder: str, size: int):
+	# text file of exactly size bytes, reused when it is already there
+	path = os.path.join(folder, f'text-{size_name(size)}.txt')
+	if os.path.exists(path) and os.path.getsize(path) == size:
+		return path
+	os.makedirs(folder, exist_ok=True)
+	block = _block()
+	with open(path, 'wb') as file:
+		left = size
+		while left > 0:
+			file.write(block[:left])
+			left -= min(left, len(block))
+	return path
+
+
+def peak_rss():
+	# MiB, ru_maxrss is KiB on linux and bytes on macos
+	if resource is None:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def percentile(samples: list, share: float):
+	ordered = sorted(samples)
+	return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def summarize(samples: list, size: int=0):
+	# samples are seconds per operation
+	mean = sum(samples) / len(samples)
+	result = {
+		'runs': len(samples),
+		'mean_ms': round(mean * 1000, 4),
+		'p50_ms': round(percentile(samples, 0.5) * 1000, 4),
+		'p90_ms': round(percentile(samples, 0.9) * 1000, 4),
+		'p99_ms': round(percentile(samples, 0.99) * 1000, 4),
+		'max_ms': round(max(samples) * 1000, 4),
+		'ops_per_s': round(1 / mean, 1) if mean > 0 else None,
+	}
+	if size:
+		result['mb_per_s'] = round(size / 1e6 / percentile(samples, 0.5), 1)
+	return result
+
+
+def measure(sample: callable, size: int=0):
+	# sample() -> seconds of one operation, setup and teardown stay outside of what it returns
+	min_runs = 1 if size >= 64 * 1024 * 1024 else 3
+	samples = []
+	start = time.perf_counter()
+	while len(samples) < min_runs or (time.perf_counter() - start < MIN_TIME and len(samples) < MAX_RUNS):
+		samples.append(sample())
+	return samples
+
+
+class Bench:
+	# one editor on a stub page, every case runs in its own process so peak rss is its own
+	def __init__(self, folder: str):
+		import main
+		self.main = main
+		self.folder = folder
+		self.page = StubPage()
+		self.editor = main.Editor(session=None, watch=False)
+		self.editor.page = self.page
+		self.editor.did_mount()
+		self._opened = threading.Event()
+		main.EVENTS.subscribe('tab_opened', lambda tab: self._opened.set())
+
+	def close(self):
+		self.editor.close()
+		self.main.EVENTS.shutdown()
+
+	def open(self, path: str):
+		# seconds until the tab exists and the read job is over
+		self._opened.clear()
+		start = time.perf_counter()
+		self.editor.open_file(path)
+		deadline = start + OPEN_TIMEOUT
+		if not self._opened.wait(OPEN_TIMEOUT):
+			raise TimeoutError(f'{os.path.basename(path)} did not open in {OPEN_TIMEOUT:g}s')
+		while path in self.editor._opening:
+			if time.perf_counter() > deadline:
+				raise TimeoutError(f'{os.path.basename(path)} did not finish reading in {OPEN_TIMEOUT:g}s')
+			time.sleep(0)
+		return time.perf_counter() - start, self.editor.active_tab()
+
+	def close_tabs(self):
+		while self.editor.active_tab() is not None:
+			self.editor._del_tab()
+
+	def editable(self, size: int):
+		return size < self.editor._large_file_threshold
+
+	def case_open(self, size: int):
+		path = generate(self.folder, size)
+
+		def sample():
+			elapsed, tab = self.open(path)
+			self.close_tabs()
+			return elapsed
+		return {f'open/{size_name(size)}': summarize(measure(sample, size), size)}
+
+	def case_save(self, size: int):
+		if not self.editable(size):
+			return {}
+		source = generate(self.folder, size)
+		work = os.path.join(self.folder, f'save-{size_name(size)}.txt')
+		with open(source, 'rb') as file, open(work, 'wb') as copy:
+			copy.write(file.read())
+		_, tab = self.open(work)
+		target = os.path.join(self.folder, f'save-as-{size_name(size)}.txt')
+
+		def full():
+			start = time.perf_counter()
+			self.editor._write_to_file(tab, target).future.result()
+			return time.perf_counter() - start
+
+		def tail():
+			# one edit near the end, only the tail is written when the file on disk is unchanged
+			tab.replace(len(tab._buffer) - 2, 1, random.choice('xyz'))
+			start = time.perf_counter()
+			self.editor._write_to_file(tab, work).future.result()
+			return time.perf_counter() - start
+
+		results = {f'save/{size_name(size)}': summarize(measure(full, size), size)}
+		results[f'save_tail/{size_name(size)}'] = summarize(measure(tail, size), size)
+		self.close_tabs()
+		for path in (work, target):
+			os.unlink(path)
+		return results
+
+	def case_keystroke(self, size: int):
+		if not self.editable(size):
+			return {}
+		_, tab = self.open(generate(self.folder, size))
+		text = tab._buffer.get_data()
+		generator = random.Random(2)
+		position = len(text) // 2
+		samples = []
+
+		class Event:
+			data = None
+
+		for _ in range(KEYSTROKES):
+			# flet sends the whole value, building it is not part of the keystroke
+			text = text[:position] + generator.choice('abc \n') + text[position:]
+			position += 1
+			Event.data = text
+			start = time.perf_counter()
+			tab._on_textfield_change(Event)
+			samples.append(time.perf_counter() - start)
+		self.close_tabs()
+		return {f'keystroke/{size_name(size)}': summarize(samples)}
+
+	def case_find(self, size: int):
+		_, tab = self.open(generate(self.folder, size))
+		searcher = self.main.Searcher(NEEDLE)
+
+		def sample():
+			start = time.perf_counter()
+			tab.find(searcher)
+			return time.perf_counter() - start
+		results = {f'find/{size_name(size)}': summarize(measure(sample, size), size)}
+		self.close_tabs()
+		return results
+
+	def case_shortcut(self, size: int=0):
+		# the shortcut table of the app, a mix of typing, modifiers, unbound combos and tab switches
+		main = self.main
+		app = main.App()
+		app._editor = self.editor
+		app._register_shortcuts()
+		main.EVENTS.subscribe('next_tab', self.editor.next_tab)
+		for _ in range(3):
+			self.editor.new_tab(title='tab', data='text')
+		events = [
+			main.flet.KeyboardEvent('a', False, False, False, False),
+			main.flet.KeyboardEvent('Shift Left', True, False, False, False),
+			main.flet.KeyboardEvent('Q', False, True, False, False),
+			main.flet.KeyboardEvent('Arrow Right', False, False, True, False),
+		]
+		samples = []
+		for index in range(SHORTCUT_EVENTS):
+			event = events[index % len(events)]
+			start = time.perf_counter()
+			main.Shortcut.on_keyboard_event(event)
+			samples.append(time.perf_counter() - start)
+		self.close_tabs()
+		return {'shortcut': summarize(samples)}
+
+	def run(self, case: str, size: int):
+		results = getattr(self, f'case_{case}')(size)
+		rss = peak_rss()
+		for result in results.values():
+			result['peak_rss_mb'] = rss
+		return results
+
+
+def run_case(case: str, size: int, folder: str):
+	# a child process per case, its stdout is the json of the results
+	command = [sys.executable, os.path.abspath(__file__), '--case', case, '--size', str(size), '--folder', folder]
+	try:
+		process = subprocess.run(command, capture_output=True, text=True, timeout=CASE_TIMEOUT)
+	except subprocess.TimeoutExpired:
+		return {f'{case}/{size_name(size)}': {'error': [f'timed out after {CASE_TIMEOUT:g}s']}}
+	if process.returncode != 0:
+		print(process.stderr, file=sys.stderr)
+		return {f'{case}/{size_name(size)}': {'error': process.stderr.strip().splitlines()[-1:] or ['failed']}}
+	return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def compare(results: dict, baseline: dict, tolerance: float=TOLERANCE):
+	# [message] of every case slower or bigger than the baseline
+	regressions = []
+	for name, result in results.items():
+		old = baseline.get(name)
+		if old is None or 'error' in result or 'error' in old:
+			continue
+		for key in ('p50_ms', 'p99_ms'):
+			if result[key] > old[key] * (1 + tolerance) and result[key] - old[key] > NOISE_MS:
+				regressions.append(f'{name} {key} {old[key]} -> {result[key]}')
+		if result.get('peak_rss_mb') and old.get('peak_rss_mb') and result['peak_rss_mb'] > old['peak_rss_mb'] * (1 + tolerance):
+			regressions.append(f'{name} peak_rss_mb {old["peak_rss_mb"]} -> {result["peak_rss_mb"]}')
+	return regressions
+
+
+def main(argv: list=None):
+	parser = argparse.ArgumentParser(description='headless benchmarks of the editor hot paths')
+	parser.add_argument('--sizes', default=','.join(map(size_name, SIZES)), help='file sizes, e.g. 1K,1M,1G')
+	parser.add_argument('--cases', default=','.join(CASES))
+	parser.add_argument('--folder', default=BENCH_FOLDER, help='where the generated files are kept')
+	parser.add_argument('--output', help='json file, stdout when missing')
+	parser.add_argument('--baseline', default=BASELINE_PATH)
+	parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+	parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+	parser.add_argument('--case', help=argparse.SUPPRESS)
+	parser.add_argument('--size', type=int, default=0, help=argparse.SUPPRESS)
+	args = parser.parse_args(argv)
+
+	if args.case:
+		bench = Bench(args.folder)
+		try:
+			print(json.dumps(bench.run(args.case, args.size)))
+		finally:
+			bench.close()
+		return 0
+
+	sizes = [parse_size(size) for size in args.sizes.split(',') if size]
+	results = {}
+	for case in args.cases.split(','):
+		for size in ([0] if case == 'shortcut' else sizes):
+			print(f'{case} {size_name(size) if size else ""}'.strip(), file=sys.stderr)
+			results.update(run_case(case, size, args.folder))
+
+	report = {
+		'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+		'results': results,
+	}
+	baseline = None
+	if not args.save_baseline and os.path.exists(args.baseline):
+		with open(args.baseline) as file:
+			baseline = json.load(file)['results']
+		report['regressions'] = compare(results, baseline, args.tolerance)
+	text = json.dumps(report, indent='\t')
+	if args.output:
+		with open(args.output, 'w') as file:
+			file.write(text + '\n')
+	else:
+		print(text)
+	if args.save_baseline:
+		with open(args.baseline, 'w') as file:
+			file.write(text + '\n')
+	failed = [name for name, result in results.items() if 'error' in result]
+	for name in failed:
+		print(f'failed: {name} {" ".join(results[name]["error"])}', file=sys.stderr)
+	for regression in report.get('regressions', ()):
+		print(f'regression: {regression}', file=sys.stderr)
+	return 1 if failed or report.get('regressions') else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,320 @@
+import bisect
+import threading
+from array import array
+from itertools import accumulate
+
+
+_CHUNK = 4096
+_SCAN_CHUNK = 1024 * 1024
+
+
+def _common_prefix(a: str, b: str, limit: int):
+	start = 0
+	while start < limit:
+		end = min(start + _CHUNK, limit)
+		if a[start:end] != b[start:end]:
+			while a[start] == b[start]:
+				start += 1
+			return start
+		start = end
+	return limit
+
+
+def _common_suffix(a: str, b: str, limit: int):
+	count = 0
+	la, lb = len(a), len(b)
+	while count < limit:
+		step = min(_CHUNK, limit - count)
+		if a[la - count - step:la - count] != b[lb - count - step:lb - count]:
+			while a[la - count - 1] == b[lb - count - 1]:
+				count += 1
+			return count
+		count += step
+	return limit
+
+
+def text_delta(old: str, new: str):
+	# (offset, removed chars, inserted text) turning old into new, None when equal
+	if old is new or old == new:
+		return None
+	start = _common_prefix(old, new, min(len(old), len(new)))
+	end = _common_suffix(old, new, min(len(old), len(new)) - start)
+	return start, len(old) - start - end, new[start:len(new) - end]
+
+
+def _line_starts(text: str, base: int=0):
+	# offsets just after every '\n', split chunk by chunk so lengths are counted in C
+	for position in range(0, len(text), _SCAN_CHUNK):
+		parts = text[position:position + _SCAN_CHUNK].split('\n')
+		yield from accumulate(map(len, parts[1:-1]), lambda total, length: total + length + 1, initial=base + position + len(parts[0]) + 1) if len(parts) > 1 else ()
+
+
+class LineIndex:
+	def __init__(self, text: str=''):
+		self._starts = array('q', [0])
+		self._starts.extend(_line_starts(text))
+		# starts from _shift_from on are stored without the pending _shift
+		self._shift_from = len(self._starts)
+		self._shift = 0
+
+	def __len__(self):
+		return len(self._starts)
+
+	def _settle(self, start: int, end: int, delta: int):
+		# add delta to the stored starts in [start, end)
+		if delta and end > start:
+			self._starts[start:end] = array('q', [value + delta for value in self._starts[start:end]])
+
+	def start(self, line: int):
+		line = max(0, min(line, len(self._starts) - 1))
+		return self._starts[line] + (self._shift if line >= self._shift_from else 0)
+
+	def line_of(self, offset: int):
+		starts = self._starts
+		if self._shift_from < len(starts) and offset >= starts[self._shift_from] + self._shift:
+			return bisect.bisect_right(starts, offset - self._shift, self._shift_from) - 1
+		return bisect.bisect_right(starts, offset, 0, self._shift_from) - 1
+
+	def position(self, offset: int):
+		line = self.line_of(offset)
+		return line, offset - self.start(line)
+
+	def edit(self, offset: int, removed: int, inserted: str):
+		# starts inside the removed text go away, the inserted newlines come in, later starts move by delta
+		delta = len(inserted) - removed
+		first = self.line_of(offset) + 1
+		last = self.line_of(offset + removed) + 1
+		new = array('q', _line_starts(inserted, offset))
+		# only the lines between the pending shift and this edit are touched
+		if first >= self._shift_from:
+			self._settle(self._shift_from, first, self._shift)
+		else:
+			self._settle(first, self._shift_from, -self._shift)
+		self._starts[first:last] = new
+		self._shift_from = first + len(new)
+		self._shift += delta
+		if self._shift_from >= len(self._starts):
+			self._shift = 0
+		elif self._shift == 0:
+			self._shift_from = len(self._starts)
+
+
+def _slices(parts: list, chunk_size: int):
+	for text, start, end in parts:
+		for position in range(start, end, chunk_size):
+			yield text[position:min(position + chunk_size, end)]
+
+
+def _reversed_slices(parts: list, chunk_size: int):
+	for text, start, end in reversed(parts):
+		for position in range(end, start, -chunk_size):
+			yield text[max(start, position - chunk_size):position]
+
+
+class Piece:
+	__slots__ = ('source', 'start', 'length')
+
+	def __init__(self, source: int, start: int, length: int):
+		self.source = source
+		self.start = start
+		self.length = length
+
+
+class PieceTable:
+	def __init__(self, text: str=''):
+		# buffers[0] is the original text, every insert appends its own buffer
+		self._buffers = [text]
+		self._pieces = [Piece(0, 0, len(text))] if text else []
+		self._lines = LineIndex(text)
+		self._length = len(text)
+		self._data = text
+		self._lock = threading.Lock()  # edits come from the ui thread, snapshots from workers
+
+	def __len__(self):
+		return self._length
+
+	def memory(self):
+		# chars held by the buffers and the joined text cache
+		held = sum(map(len, self._buffers))
+		if self._data is not None and self._data is not self._buffers[0]:
+			held += len(self._data)
+		return held
+
+	def _text(self, piece: Piece, start: int=0, end: int=None):
+		end = piece.length if end is None else end
+		return self._buffers[piece.source][piece.start + start:piece.start + end]
+
+	def _locate(self, offset: int):
+		# index of the piece holding offset and the offset inside it
+		position = 0
+		for index, piece in enumerate(self._pieces):
+			if offset < position + piece.length:
+				return index, offset - position
+			position += piece.length
+		return len(self._pieces), 0
+
+	def _split(self, offset: int):
+		# make offset fall on a piece boundary, return the index of the piece starting there
+		index, inner = self._locate(offset)
+		if inner == 0:
+			return index
+		piece = self._pieces[index]
+		head = Piece(piece.source, piece.start, inner)
+		tail = Piece(piece.source, piece.start + inner, piece.length - inner)
+		self._pieces[index:index + 1] = [head, tail]
+		return index + 1
+
+	def _extend(self, index: int, text: str):
+		# typing appends to the previous insert instead of creating a piece per keystroke
+		if index == 0:
+			return False
+		piece = self._pieces[index - 1]
+		source = len(self._buffers) - 1
+		buffer = self._buffers[source]
+		if piece.source != source or source == 0 or piece.start + piece.length != len(buffer) or len(buffer) >= _CHUNK:
+			return False
+		self._buffers[source] = buffer + text
+		piece.length += len(text)
+		return True
+
+	def insert(self, offset: int, text: str):
+		self.replace(offset, 0, text)
+
+	def delete(self, offset: int, length: int):
+		self.replace(offset, length, '')
+
+	def replace(self, offset: int, length: int, text: str):
+		offset = max(0, min(offset, self._length))
+		length = max(0, min(length, self._length - offset))
+		if length == 0 and not text:
+			return
+		with self._lock:
+			self._lines.edit(offset, length, text)
+			first = self._split(offset)
+			last = self._split(offset + length) if length else first
+			new = []
+			if text and not self._extend(first, text):
+				self._buffers.append(text)
+				new.append(Piece(len(self._buffers) - 1, 0, len(text)))
+			self._pieces[first:last] = new
+			self._length += len(text) - length
+			self._data = None
+
+	def diff(self, text: str):
+		# text_delta against the document, compared slice by slice so the pieces are never joined
+		if self._data is not None:
+			return text_delta(self._data, text)
+		limit = min(self._length, len(text))
+		start = 0
+		for chunk in _slices(self._parts(), _SCAN_CHUNK):
+			size = min(len(chunk), limit - start)
+			common = _common_prefix(chunk, text[start:start + size], size)
+			start += common
+			if common < len(chunk):
+				break
+		if start == self._length == len(text):
+			return None
+		limit -= start
+		end = 0
+		for chunk in _reversed_slices(self._parts(), _SCAN_CHUNK):
+			size = min(len(chunk), limit - end)
+			common = _common_suffix(chunk, text[len(text) - end - size:len(text) - end], size)
+			end += common
+			if common < len(chunk):
+				break
+		return start, self._length - start - end, text[start:len(text) - end]
+
+	def sync(self, text: str):
+		# apply the difference between the current document and text as one edit
+		delta = self.diff(text)
+		if delta is not None:
+			self.replace(*delta)
+		return delta
+
+	def chunks(self, start: int=0, end: int=None):
+		end = self._length if end is None else min(end, self._length)
+		position = 0
+		for piece in self._pieces:
+			if position >= end:
+				break
+			if position + piece.length > start:
+				yield self._text(piece, max(0, start - position), min(piece.length, end - position))
+			position += piece.length
+
+	def get_text(self, start: int=0, end: int=None):
+		return ''.join(self.chunks(start, end))
+
+	def snapshot(self, chunk_size: int=_SCAN_CHUNK):
+		# chunks of the document as it is now, later edits do not change what the iterator yields
+		return _slices(self._parts(), chunk_size)
+
+	def _parts(self):
+		with self._lock:
+			if self._data is not None:
+				return [(self._data, 0, self._length)]
+			return [(self._buffers[piece.source], piece.start, piece.start + piece.length) for piece in self._pieces]
+
+	def get_data(self):
+		if self._data is None:
+			self._data = ''.join(self.chunks())
+		return self._data
+
+	def line_count(self):
+		return len(self._lines)
+
+	def line_of(self, offset: int):
+		return self._lines.line_of(offset)
+
+	def position(self, offset: int):
+		# (line, column) of offset
+		return self._lines.position(offset)
+
+	def line_start(self, line: int):
+		# offset of the first char of line
+		if line >= len(self._lines):
+			return self._length
+		return self._lines.start(line)
+
+	def get_lines(self, first: int, count: int):
+		if first >= self.line_count():
+			return []
+		start = self.line_start(first)  # the empty line after a trailing \n gives ['']
+		return self.get_text(start, self.line_start(first + count)).split('\n')[:count]
+
+
+class DirtyRanges:
+	def __init__(self):
+		self._ranges = []  # sorted, non overlapping (start, end) in current document offsets
+
+	def __bool__(self):
+		return len(self._ranges) > 0
+
+	def __iter__(self):
+		return iter(self._ranges)
+
+	def first(self):
+		return self._ranges[0][0] if self._ranges else None
+
+	def add(self, start: int, end: int):
+		self.edit(start, end - start, end - start)
+
+	def edit(self, offset: int, removed: int, inserted):
+		# inserted: text or its length, ranges after the edit are shifted
+		inserted = inserted if isinstance(inserted, int) else len(inserted)
+		delta = inserted - removed
+		start, end = offset, offset + inserted
+		ranges = []
+		for _start, _end in self._ranges:
+			if _end < offset:
+				ranges.append((_start, _end))
+			elif _start > offset + removed:
+				ranges.append((_start + delta, _end + delta))
+			else:
+				start = min(start, _start)
+				end = max(end, _end + delta if _end > offset + removed else offset + inserted)
+		ranges.append((start, end))
+		ranges.sort()
+		self._ranges = ranges
+
+	def clear(self):
+		self._ranges = []
@@ -0,0 +1,107 @@
+import asyncio
+import inspect
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Subscription:
+	__slots__ = ('event', 'handler', 'priority', 'background', 'coalesce', 'pending', 'timer')
+
+	def __init__(self, event: str, handler: callable, priority: int, background: bool, coalesce: float):
+		self.event = event
+		self.handler = handler
+		self.priority = priority
+		self.background = background or inspect.iscoroutinefunction(handler)
+		self.coalesce = coalesce
+		self.pending = None  # latest (w, kw) waiting for the coalesce timer
+		self.timer = None
+
+
+class EventBus:
+	def __init__(self, *w, workers: int=2, **kw):
+		self._lock = threading.Lock()
+		self._subscriptions = {}  # event -> [Subscription], highest priority first
+		self._workers = workers
+		self._pool = None  # started with the first background handler
+
+	def subscribe(self, event: str, handler: callable, *w, priority: int=0, background: bool=False, coalesce: float=0, **kw):
+		# background: runs on a worker thread (coroutine functions always do)
+		# coalesce: seconds, the handler gets only the latest publish of that window
+		subscription = Subscription(event, handler, priority, background, coalesce)
+		with self._lock:
+			subscriptions = list(self._subscriptions.get(event, ()))
+			index = 0
+			while index < len(subscriptions) and subscriptions[index].priority >= priority:
+				index += 1
+			subscriptions.insert(index, subscription)
+			self._subscriptions[event] = subscriptions  # copy on write, publish never holds the lock
+		return lambda: self._unsubscribe(subscription)
+
+	def _unsubscribe(self, subscription: Subscription):
+		with self._lock:
+			subscriptions = [other for other in self._subscriptions.get(subscription.event, ()) if other is not subscription]
+			if subscriptions:
+				self._subscriptions[subscription.event] = subscriptions
+			else:
+				self._subscriptions.pop(subscription.event, None)
+			if subscription.timer is not None:
+				subscription.timer.cancel()
+				subscription.timer = None
+
+	def has(self, event: str):
+		return event in self._subscriptions
+
+	def publish(self, event: str, *w, **kw):
+		# arguments are passed as they are, publishers send references (a tab, a delta) and never the document
+		for subscription in self._subscriptions.get(event, ()):
+			if subscription.coalesce > 0:
+				self._coalesce(subscription, w, kw)
+			else:
+				self._dispatch(subscription, w, kw)
+
+	def _coalesce(self, subscription: Subscription, w: tuple, kw: dict):
+		with self._lock:
+			subscription.pending = (w, kw)
+			if subscription.timer is None:
+				subscription.timer = threading.Timer(subscription.coalesce, self._flush, args=(subscription,))
+				subscription.timer.daemon = True
+				subscription.timer.start()
+
+	def _flush(self, subscription: Subscription):
+		with self._lock:
+			pending, subscription.pending = subscription.pending, None
+			subscription.timer = None
+		if pending is not None:
+			self._dispatch(subscription, *pending)
+
+	def _dispatch(self, subscription: Subscription, w: tuple, kw: dict):
+		if subscription.background:
+			if self._pool is None:
+				with self._lock:
+					if self._pool is None:
+						self._pool = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='events')
+			self._pool.submit(self._run, subscription.handler, w, kw)
+		else:
+			self._run(subscription.handler, w, kw)
+
+	@staticmethod
+	def _run(handler: callable, w: tuple, kw: dict):
+		# a failing handler is reported and the others still run
+		try:
+			result = handler(*w, **kw)
+			if inspect.iscoroutine(result):
+				asyncio.run(result)
+		except Exception:
+			traceback.print_exc()
+
+	def shutdown(self):
+		with self._lock:
+			for subscriptions in self._subscriptions.values():
+				for subscription in subscriptions:
+					if subscription.timer is not None:
+						subscription.timer.cancel()
+						subscription.timer = None
+			pool, self._pool = self._pool, None
+		if pool is not None:
+			pool.shutdown(wait=False)
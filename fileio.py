@@ -0,0 +1,594 @@
+import os
+import mmap
+import bisect
+import codecs
+import locale
+import tempfile
+import threading
+from array import array
+from itertools import accumulate, islice
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import METRICS
+
+
+CHUNK_SIZE = 1024 * 1024
+ENCODING = locale.getpreferredencoding(False)  # what open() uses in text mode
+SNIFF_SIZE = 8 * 1024  # bytes at the start of a file that decide its format
+BINARY_RATIO = 0.1  # share of control bytes above which a file is binary
+# utf-32 first, its little endian bom starts with the utf-16 one
+BOMS = ((codecs.BOM_UTF32_LE, 'utf-32-le'), (codecs.BOM_UTF32_BE, 'utf-32-be'), (codecs.BOM_UTF8, 'utf-8'),
+	(codecs.BOM_UTF16_LE, 'utf-16-le'), (codecs.BOM_UTF16_BE, 'utf-16-be'))
+CONTROL_BYTES = bytes(set(range(32)) - set(b'\t\n\r\f\b\x1b'))
+NEWLINES = {'\n': 'LF', '\r\n': 'CRLF', '\r': 'CR'}
+HEX_WIDTH = 16  # bytes per hex row
+HEX_PAGE_ROWS = 256  # rows formatted together and cached as one page
+HEX_CACHE_PAGES = 32  # formatted pages kept, about 2.5 MB of text whatever the file size
+HEX_PRINTABLE = bytes(byte if 0x20 <= byte < 0x7f else 0x2e for byte in range(256))  # the ascii column, . for the rest
+
+
+class Cancelled(Exception):
+	pass
+
+
+class BinaryFile(Exception):
+	pass
+
+
+class Format:
+	__slots__ = ('encoding', 'bom', 'newline', 'binary', 'exact')
+
+	def __init__(self, encoding: str=ENCODING, *w, bom: bytes=b'', newline: str=None, binary: bool=False, exact: bool=True, **kw):
+		# encoding never writes the bom itself, newline None is the platform one
+		# exact is False when encoding the text read does not give the file back: mixed line endings or undecodable bytes
+		self.encoding = encoding
+		self.bom = bom
+		self.newline = newline
+		self.binary = binary
+		self.exact = exact
+
+	@property
+	def line_ending(self):
+		return self.newline or os.linesep
+
+	@property
+	def wide(self):
+		# line starts can not be found by looking for single \n bytes
+		return codecs.lookup(self.encoding).name.startswith(('utf-16', 'utf-32'))
+
+	def describe(self):
+		if self.binary:
+			return 'binary'
+		bom = ' BOM' if self.bom and self.encoding == 'utf-8' else ''
+		return f'{codecs.lookup(self.encoding).name.upper()}{bom} {NEWLINES[self.line_ending]}'
+
+	def encode(self, chunks):
+		# bytes for the text chunks with \n turned back into the line ending the file had
+		newline = self.line_ending
+		encoder = codecs.getincrementalencoder(self.encoding)()
+		if self.bom:
+			yield self.bom
+		for chunk in chunks:
+			yield encoder.encode(_translate(chunk, newline))
+		tail = encoder.encode('', True)
+		if tail:
+			yield tail
+
+
+def _translate(text: str, newline: str):
+	return text if newline == '\n' else text.replace('\n', newline)
+
+
+def newlines(text: str):
+	# what text mode reading does to line endings
+	return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+def _newline(text: str):
+	crlf = text.count('\r\n')
+	counts = ((text.count('\n') - crlf, '\n'), (crlf, '\r\n'), (text.count('\r') - crlf, '\r'))
+	count, newline = max(counts, key=lambda pair: pair[0])
+	return newline if count > 0 else None
+
+
+def _utf16(data: bytes):
+	# utf-16 without a bom, mostly ascii text has a null in every other byte
+	half = len(data) // 2
+	even, odd = data[0::2].count(0), data[1::2].count(0)
+	if odd > half * 0.3 and even < half * 0.05:
+		return 'utf-16-le'
+	if even > half * 0.3 and odd < half * 0.05:
+		return 'utf-16-be'
+	return None
+
+
+def _fallback():
+	# a single byte encoding, latin-1 when the locale one is utf-8 since that is what failed
+	return ENCODING if codecs.lookup(ENCODING).name != 'utf-8' else 'latin-1'
+
+
+def sniff(data: bytes, complete: bool=True):
+	# Format of a file from its first bytes, complete when data is the whole file
+	for bom, encoding in BOMS:
+		if data.startswith(bom):
+			return Format(encoding, bom=bom, newline=_newline(data[len(bom):].decode(encoding, errors='replace')))
+	if b'\0' in data:
+		encoding = _utf16(data)
+		if encoding is None:
+			return Format(binary=True)
+		return Format(encoding, newline=_newline(data.decode(encoding, errors='replace')))
+	if len(data) - len(data.translate(None, CONTROL_BYTES)) > len(data) * BINARY_RATIO:
+		return Format(binary=True)
+	try:
+		text = codecs.getincrementaldecoder('utf-8')().decode(data, complete)
+		encoding = 'utf-8'
+	except UnicodeDecodeError:
+		encoding = _fallback()
+		text = data.decode(encoding, errors='replace')
+	return Format(encoding, newline=_newline(text))
+
+
+class LargeFile:
+	def __init__(self, path: str, encoding: str='utf-8', chunk_size: int=CHUNK_SIZE, progress: callable=None):
+		self._path = path
+		self._progress = progress
+		self._encoding = encoding
+		self._chunk_size = chunk_size
+		self._file = open(path, 'rb')
+		self._size = os.fstat(self._file.fileno()).st_size
+		self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._size > 0 else b''
+		self._starts = array('Q', [0])  # byte offset where each line starts
+		try:
+			self._index()
+		except BaseException:
+			self.close()
+			raise
+
+	def _index(self, position: int=0):
+		# one pass over the mapping, chunk by chunk, recording every line start
+		while position < self._size:
+			end = min(position + self._chunk_size, self._size)
+			if end < self._size and self._map[end - 1] == 0x0d and self._map[end] == 0x0a:
+				end += 1  # keep \r\n in the same chunk
+			lines = self._map[position:end].splitlines(True)
+			starts = islice(accumulate(map(len, lines), initial=position), 1, None)
+			if lines and not lines[-1].endswith((b'\n', b'\r')):
+				lines.pop()
+				starts = islice(starts, len(lines))
+			self._starts.extend(starts)
+			METRICS.count('read', end - position)
+			position = end
+			if self._progress is not None:
+				self._progress(position, self._size)
+
+	def extend(self):
+		# map what was appended since the file was indexed, only the new bytes are scanned
+		# returns the old size, or None when the file did not grow
+		size = os.fstat(self._file.fileno()).st_size
+		if size <= self._size:
+			return None
+		old = self._size
+		# the old mapping is left to the garbage collector, a viewport may still be reading it
+		mapping = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+		self._map = mapping
+		self._size = size
+		if old > 0 and self._starts[-1] == old and mapping[old - 1] == 0x0d and mapping[old] == 0x0a:
+			self._starts.pop()  # the \r ending the old data was the first half of a \r\n
+		self._index(old)
+		return old
+
+	@property
+	def size(self):
+		return self._size
+
+	@property
+	def path(self):
+		return self._path
+
+	@property
+	def mapping(self):
+		return self._map
+
+	def line_count(self):
+		return len(self._starts)
+
+	def memory(self):
+		return len(self._starts) * self._starts.itemsize
+
+	def line_of(self, offset: int):
+		return bisect.bisect_right(self._starts, offset) - 1
+
+	def get_lines(self, first: int, count: int):
+		first = max(0, min(first, len(self._starts) - 1))
+		last = min(first + count, len(self._starts))
+		start = self._starts[first]
+		end = self._starts[last] if last < len(self._starts) else self._size
+		# only \r and \n end lines in the index, str.splitlines() would also split on \f, \x1c or \u2028
+		text = newlines(self._map[start:end].decode(self._encoding, errors='replace'))
+		if start == 0 and text.startswith('\ufeff'):
+			text = text[1:]  # the bom is not part of the first line
+		lines = text.split('\n')
+		if last < len(self._starts):
+			lines.pop()  # the region ends at the start of the next line, not on a line of its own
+		return lines
+
+	def iter_bytes(self, chunk_size: int=None):
+		chunk_size = chunk_size or self._chunk_size
+		mapping = self._map  # extend() may map the file again meanwhile
+		for position in range(0, len(mapping), chunk_size):
+			yield mapping[position:position + chunk_size]
+
+	def iter_text(self, chunk_size: int=None):
+		# the text as FileIO.load() gives it: no bom and \n line endings, so Format.encode() writes the file back
+		decoder = codecs.getincrementaldecoder(self._encoding)(errors='replace')
+		chunk_size = chunk_size or self._chunk_size
+		held = ''  # a \r at the end of a chunk may be half of a \r\n
+		first = True
+		for position in range(0, self._size, chunk_size):
+			text = held + decoder.decode(self._map[position:position + chunk_size])
+			if first and text:
+				first = False
+				if text.startswith('\ufeff'):
+					text = text[1:]  # the bom
+			held = '\r' if text.endswith('\r') else ''
+			yield newlines(text[:len(text) - len(held)])
+		yield newlines(held + decoder.decode(b'', final=True))
+
+	def close(self):
+		if isinstance(self._map, mmap.mmap):
+			self._map.close()
+		self._file.close()
+
+
+class HexFile(LargeFile):
+	# read only hex dump of a file, rows are formatted from the mapping a page at a time
+	def __init__(self, path: str, width: int=HEX_WIDTH, page_rows: int=HEX_PAGE_ROWS, cache_pages: int=HEX_CACHE_PAGES, progress: callable=None):
+		self._path = path
+		self._progress = progress
+		self._encoding = 'latin-1'
+		self._chunk_size = CHUNK_SIZE
+		self._width = width
+		self._page_rows = page_rows
+		self._cache_pages = cache_pages
+		self._pages = OrderedDict()  # page -> [row], least recently used first
+		self._lock = threading.Lock()
+		self._file = open(path, 'rb')
+		self._size = os.fstat(self._file.fileno()).st_size
+		self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._size > 0 else b''
+		self._digits = max(8, len(f'{self._size:x}'))
+
+	def extend(self):
+		# only the page holding the old last row is formatted again
+		size = os.fstat(self._file.fileno()).st_size
+		if size <= self._size:
+			return None
+		old = self._size
+		self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+		self._size = size
+		digits = max(8, len(f'{size:x}'))
+		with self._lock:
+			if digits != self._digits:
+				self._pages.clear()  # every offset got wider
+			else:
+				last = old // self._width // self._page_rows
+				for page in [page for page in self._pages if page >= last]:
+					del self._pages[page]
+			self._digits = digits
+		return old
+
+	@property
+	def width(self):
+		return self._width
+
+	def line_count(self):
+		return max(1, -(-self._size // self._width))
+
+	def line_of(self, offset: int):
+		return offset // self._width
+
+	def memory(self):
+		row = self._digits + 4 * self._width + 3
+		return len(self._pages) * self._page_rows * row
+
+	def _format(self, page: int):
+		width = self._width
+		start = page * self._page_rows * width
+		data = self._map[start:start + self._page_rows * width]
+		printable = data.translate(HEX_PRINTABLE).decode('ascii')
+		pad = width * 3 - 1
+		rows = []
+		for position in range(0, len(data), width):
+			row = data[position:position + width]
+			rows.append(f'{start + position:0{self._digits}x}  {row.hex(" "):<{pad}}  {printable[position:position + width]}')
+		return rows
+
+	def _page(self, page: int):
+		with self._lock:
+			rows = self._pages.get(page)
+			if rows is not None:
+				self._pages.move_to_end(page)
+				return rows
+		rows = self._format(page)
+		with self._lock:
+			self._pages[page] = rows
+			while len(self._pages) > self._cache_pages:
+				self._pages.popitem(last=False)
+		return rows
+
+	def get_lines(self, first: int, count: int):
+		if self._size == 0:
+			return ['']
+		first = max(0, min(first, self.line_count() - 1))
+		end = min(first + count, self.line_count())
+		lines = []
+		row = first
+		while row < end:
+			page, index = divmod(row, self._page_rows)
+			rows = self._page(page)[index:index + end - row]
+			lines.extend(rows)
+			row += len(rows)
+		return lines
+
+	def iter_text(self, chunk_size: int=None):
+		# the whole dump, formatted without going through the page cache
+		for page in range(-(-self._size // (self._width * self._page_rows))):
+			yield '\n'.join(self._format(page)) + '\n'
+
+
+def encoded_length(text: str, end: int, encoding: str=ENCODING, chunk_size: int=CHUNK_SIZE, newline: str='\n'):
+	encoder = codecs.getincrementalencoder(encoding)()
+	return sum(len(encoder.encode(_translate(text[position:min(position + chunk_size, end)], newline))) for position in range(0, end, chunk_size))
+
+
+def _fsync_folder(folder: str):
+	# make the rename durable, not every platform can open a directory
+	try:
+		fd = os.open(folder, os.O_RDONLY)
+	except OSError:
+		return
+	try:
+		os.fsync(fd)
+	except OSError:
+		pass
+	finally:
+		os.close(fd)
+
+
+def atomic_write(path: str, chunks, progress: callable=None, binary: bool=False):
+	# write a sibling temp file, fsync it and rename it over path
+	folder = os.path.dirname(os.path.abspath(path))
+	fd, temp = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', suffix='.tmp', dir=folder)
+	try:
+		with os.fdopen(fd, 'wb' if binary else 'w') as file:
+			done = 0
+			for chunk in chunks:
+				file.write(chunk)
+				done += len(chunk)
+				METRICS.count('write', len(chunk))
+				if progress is not None:
+					progress(done)
+			file.flush()
+			os.fsync(file.fileno())
+		if os.path.exists(path):
+			os.chmod(temp, os.stat(path).st_mode & 0o7777)
+		os.replace(temp, path)
+	except BaseException:
+		os.unlink(temp)
+		raise
+	_fsync_folder(folder)
+
+
+def write_tail(path: str, text: str, start: int, encoding: str=ENCODING, progress: callable=None, chunk_size: int=CHUNK_SIZE, newline: str='\n', bom: bytes=b''):
+	# rewrite path from character start to the end, the bytes before start are kept as they are
+	# the whole tail is encoded before the file is opened, a char the encoding lacks must not leave half a file
+	offset = len(bom) + encoded_length(text, start, encoding, chunk_size, newline)
+	encoder = codecs.getincrementalencoder(encoding)()
+	chunks = [encoder.encode(_translate(text[position:position + chunk_size], newline)) for position in range(start, len(text), chunk_size)]
+	chunks.append(encoder.encode('', True))
+	with open(path, 'r+b') as file:
+		file.seek(offset)
+		for index, chunk in enumerate(chunks):
+			METRICS.count('write', file.write(chunk))
+			if progress is not None:
+				progress(min(len(text) - start, index * chunk_size))
+		# the new tail is on disk before the old one is cut off
+		file.flush()
+		os.fsync(file.fileno())
+		file.truncate()
+		os.fsync(file.fileno())
+
+
+class FileJob:
+	def __init__(self, kind: str, path: str):
+		self.kind = kind
+		self.path = path
+		self.name = os.path.basename(path)
+		self.done = 0
+		self.total = 0
+		self.future = None
+		self._cancel = threading.Event()
+
+	@property
+	def cancelled(self):
+		return self._cancel.is_set()
+
+	def cancel(self):
+		self._cancel.set()
+		if self.future is not None:
+			self.future.cancel()
+
+	def advance(self, done: int, total: int=None):
+		# called from the worker, raises to unwind a cancelled job
+		if self._cancel.is_set():
+			raise Cancelled(self.path)
+		self.done = done
+		if total is not None:
+			self.total = total
+
+	def percent(self):
+		return min(100, int(self.done * 100 / self.total)) if self.total > 0 else 0
+
+
+class FileIO:
+	def __init__(self, *w, workers: int=4, on_progress: callable=None, **kw):
+		self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fileio')
+		self._lock = threading.Lock()
+		self._jobs = []
+		self._on_progress = on_progress
+
+	def jobs(self):
+		with self._lock:
+			return list(self._jobs)
+
+	def cancel_all(self, kinds: tuple=None):
+		# kinds limits which jobs are cancelled, None is all but the saves, a save cut short leaves half a file
+		for job in self.jobs():
+			if (job.kind != 'save') if kinds is None else (job.kind in kinds):
+				job.cancel()
+
+	def _notify(self):
+		if self._on_progress is not None:
+			self._on_progress(self.jobs())
+
+	def submit(self, kind: str, path: str, func: callable, on_done: callable=None, on_error: callable=None):
+		# func(job) runs on a worker, on_done(result) / on_error(exception) run there too
+		job = FileJob(kind, path)
+
+		def progress(done: int, total: int=None):
+			job.advance(done, total)
+			self._notify()
+
+		def run():
+			try:
+				result = func(progress)
+			except Cancelled:
+				return
+			except Exception as exception:
+				if on_error is not None:
+					on_error(exception)
+			else:
+				if on_done is not None:
+					on_done(result)
+			finally:
+				with self._lock:
+					self._jobs.remove(job)
+				self._notify()
+
+		with self._lock:
+			self._jobs.append(job)
+		job.future = self._pool.submit(run)
+		self._notify()
+		return job
+
+	@staticmethod
+	def _read_text(file, total: int, progress: callable, chunk_size: int):
+		parts = []
+		progress(0, total)
+		while True:
+			part = file.read(chunk_size)
+			if not part:
+				break
+			parts.append(part)
+			progress(min(total, file.buffer.tell()))
+		METRICS.count('read', total)
+		return ''.join(parts)
+
+	@staticmethod
+	def _decode(file, file_format: Format, total: int, progress: callable, chunk_size: int):
+		# the text after the bom with \n line endings, file_format learns whether it encodes back to the same bytes
+		# the sniffed start decoded but bytes further on may not, then a single byte encoding reads the file again
+		# utf-16 and utf-32 have no such fallback, their undecodable units become U+FFFD
+		fallbacks = [] if file_format.wide else [_fallback(), 'latin-1']
+		for encoding in dict.fromkeys([file_format.encoding] + fallbacks):
+			decoder = codecs.getincrementaldecoder(encoding)(errors='replace' if file_format.wide else 'strict')
+			file.seek(len(file_format.bom))
+			progress(0, total)
+			parts = []
+			held = ''  # a \r at the end of a chunk may be half of a \r\n
+			counts = dict.fromkeys(NEWLINES, 0)
+			try:
+				while True:
+					data = file.read(chunk_size)
+					text = held + decoder.decode(data, not data)
+					held = '\r' if data and text.endswith('\r') else ''
+					text = text[:len(text) - len(held)]
+					crlf = text.count('\r\n')
+					counts['\r\n'] += crlf
+					counts['\n'] += text.count('\n') - crlf
+					counts['\r'] += text.count('\r') - crlf
+					parts.append(newlines(text))
+					progress(min(total, file.tell()))
+					if not data:
+						break
+			except UnicodeDecodeError:
+				continue
+			METRICS.count('read', total)
+			used = [newline for newline, count in counts.items() if count]
+			if file_format.newline is None and len(used) == 1:
+				file_format.newline = used[0]  # no line ended in the sniffed start
+			file_format.encoding = encoding
+			file_format.exact = used in ([], [file_format.line_ending]) and not (file_format.wide and any('\ufffd' in part for part in parts))
+			return ''.join(parts)
+
+	def read(self, path: str, on_done: callable=None, on_error: callable=None, chunk_size: int=CHUNK_SIZE, encoding: str=None, newline: str=None):
+		def read(progress):
+			with open(path, 'r', encoding=encoding, newline=newline) as file:
+				return self._read_text(file, os.fstat(file.fileno()).st_size, progress, chunk_size)
+		return self.submit('open', path, read, on_done=on_done, on_error=on_error)
+
+	def load(self, path: str, large: bool=False, on_done: callable=None, on_error: callable=None, chunk_size: int=CHUNK_SIZE, hex_view: bool=True):
+		# on_done((Format, text or LargeFile)), the first bytes pick the decoder
+		# binary files are never read as text, they open as a HexFile or fail with BinaryFile
+		def load(progress):
+			with open(path, 'rb') as file:
+				total = os.fstat(file.fileno()).st_size
+				head = file.read(SNIFF_SIZE)
+				file_format = sniff(head, len(head) == total)
+				if file_format.binary:
+					if not hex_view:
+						raise BinaryFile(path)
+					return file_format, HexFile(path)
+				if large and file_format.wide:
+					# utf-16 and utf-32 get no line index, decoding them whole would freeze like any large file
+					if not hex_view:
+						raise BinaryFile(path)
+					return file_format, HexFile(path)
+				if large:
+					# read mostly: mmap + line index, only the visible lines are decoded
+					return file_format, LargeFile(path, encoding=file_format.encoding, progress=progress)
+				return file_format, self._decode(file, file_format, total, progress, chunk_size)
+		return self.submit('open', path, load, on_done=on_done, on_error=on_error)
+
+	def write(self, path: str, chunks, on_done: callable=None, on_error: callable=None, total: int=0, file_format: Format=None, binary: bool=False):
+		# with a format the text is encoded as the file was read, otherwise as open() would, binary chunks are written as they are
+		def write(progress):
+			progress(0, total)
+			if binary:
+				atomic_write(path, chunks, progress=progress, binary=True)
+			elif file_format is not None:
+				atomic_write(path, file_format.encode(chunks), progress=progress, binary=True)
+			else:
+				atomic_write(path, chunks, progress=progress)
+			return path
+		return self.submit('save', path, write, on_done=on_done, on_error=on_error)
+
+	def write_tail(self, path: str, text: str, start: int, on_done: callable=None, on_error: callable=None, file_format: Format=None):
+		file_format = file_format or Format(newline='\n')
+		def write(progress):
+			progress(0, len(text) - start)
+
+			def advance(done: int):
+				# the file is rewritten in place, stopping halfway would leave it broken
+				try:
+					progress(done)
+				except Cancelled:
+					pass
+
+			write_tail(path, text, start, encoding=file_format.encoding, progress=advance, newline=file_format.line_ending, bom=file_format.bom)
+			return path
+		return self.submit('save', path, write, on_done=on_done, on_error=on_error)
+
+	def shutdown(self):
+		self.cancel_all()
+		self._pool.shutdown(wait=False)
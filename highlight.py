@@ -0,0 +1,190 @@
+import os
+import re
+import bisect
+import keyword
+import builtins
+from collections import OrderedDict
+
+
+CHECKPOINT = 64  # a lexer state is kept every this many lines
+MAX_CACHED_LINES = 4096  # spans kept for recently shown lines
+LEX_CHUNK = 1024  # lines read at a time when walking forward from a checkpoint
+THEME = {
+	'keyword': 'purple',
+	'builtin': 'teal',
+	'definition': 'blue',
+	'string': 'green',
+	'comment': 'grey',
+	'number': 'orange',
+	'decorator': 'brown',
+}
+
+
+class PythonLexer:
+	KEYWORDS = set(keyword.kwlist) | set(getattr(keyword, 'softkwlist', []))
+	BUILTINS = set(dir(builtins))
+	TOKEN = re.compile(r'''(?P<comment>\#.*)'''
+		r'''|(?P<string>[rRbBfFuU]{0,2}(?:"""|\'\'\'|"(?:\\.|[^"\\])*"?|'(?:\\.|[^'\\])*'?))'''
+		r'''|(?P<number>\b(?:0[xXoObB][0-9a-fA-F_]+|\d[\d_]*(?:\.\d*)?(?:[eE][+-]?\d+)?j?)\b)'''
+		r'''|(?P<decorator>@[A-Za-z_][\w.]*)'''
+		r'''|(?P<name>\b[A-Za-z_]\w*\b)''')
+
+	@staticmethod
+	def _close(line: str, quote: str, position: int):
+		# end of the triple quoted string opened before position, -1 when it goes on
+		while True:
+			end = line.find(quote, position)
+			if end == -1:
+				return -1
+			slashes = 0
+			while end - slashes - 1 >= position and line[end - slashes - 1] == '\\':
+				slashes += 1
+			if slashes % 2 == 0:
+				return end + 3
+			position = end + 1
+
+	def lex(self, line: str, state):
+		# state: None or the quote of a triple quoted string still open at the start of the line
+		spans = []
+		position = 0
+		if state is not None:
+			end = self._close(line, state, 0)
+			if end == -1:
+				return [(0, len(line), 'string')], state
+			spans.append((0, end, 'string'))
+			position = end
+			state = None
+		previous = None
+		while True:
+			match = self.TOKEN.search(line, position)
+			if match is None:
+				break
+			kind = match.lastgroup
+			start, end = match.span()
+			text = match.group()
+			if kind == 'string':
+				quote = text.lstrip('rRbBfFuU')[:3]
+				if quote in ('"""', "'''"):
+					end = self._close(line, quote, end)
+					if end == -1:
+						spans.append((start, len(line), 'string'))
+						return spans, quote
+			elif kind == 'name':
+				if text in self.KEYWORDS:
+					kind = 'keyword'
+				elif previous in ('def', 'class'):
+					kind = 'definition'
+				elif text in self.BUILTINS:
+					kind = 'builtin'
+				else:
+					kind = None
+				previous = text
+			if kind is not None:
+				spans.append((start, end, kind))
+			position = max(end, start + 1)
+		return spans, state
+
+
+LEXERS = {
+	'.py': PythonLexer,
+	'.pyw': PythonLexer,
+}
+
+
+def lexer_for(filename: str):
+	lexer = LEXERS.get(os.path.splitext(filename)[1].lower())
+	return lexer() if lexer is not None else None
+
+
+class Highlighter:
+	def __init__(self, source, lexer, *w, max_cached_lines: int=MAX_CACHED_LINES, **kw):
+		# source: any object with get_lines(first, count) and line_count()
+		self._source = source
+		self._lexer = lexer
+		self._max_cached_lines = max_cached_lines
+		self._lines = [0]  # sorted checkpoint lines
+		self._states = [None]  # lexer state at the start of each checkpoint line
+		self._cache = OrderedDict()  # line -> (text, state in, spans, state out)
+
+	def set_source(self, source):
+		self._source = source
+		self._lines = [0]
+		self._states = [None]
+		self._cache.clear()
+
+	def _checkpoint(self, line: int, state):
+		index = bisect.bisect_left(self._lines, line)
+		if index < len(self._lines) and self._lines[index] == line:
+			self._states[index] = state
+		elif line - self._lines[index - 1] >= CHECKPOINT:
+			self._lines.insert(index, line)
+			self._states.insert(index, state)
+
+	def _state_at(self, line: int):
+		# lex forward from the closest checkpoint, lines are read but not cached
+		index = bisect.bisect_right(self._lines, line) - 1
+		current, state = self._lines[index], self._states[index]
+		while current < line:
+			texts = self._source.get_lines(current, min(line - current, LEX_CHUNK))
+			if not texts:
+				break
+			for text in texts:
+				spans, state = self._lexer.lex(text, state)
+				current += 1
+				self._checkpoint(current, state)
+		return state
+
+	def _lex(self, line: int, text: str, state):
+		cached = self._cache.get(line)
+		if cached is not None and cached[0] == text and cached[1] == state:
+			self._cache.move_to_end(line)
+			return cached[2], cached[3]
+		spans, out = self._lexer.lex(text, state)
+		self._cache[line] = (text, state, spans, out)
+		if len(self._cache) > self._max_cached_lines:
+			self._cache.popitem(last=False)
+		return spans, out
+
+	def highlight(self, first: int, texts: list):
+		# spans of the visible lines texts, starting at line first
+		state = self._state_at(first)
+		result = []
+		for index, text in enumerate(texts):
+			spans, state = self._lex(first + index, text, state)
+			self._checkpoint(first + index + 1, state)
+			result.append(spans)
+		return result
+
+	def edit(self, line: int, removed: int, inserted: int):
+		# lines [line, line + removed] became [line, line + inserted]
+		delta = inserted - removed
+		if delta != 0:
+			self._cache = OrderedDict((key + delta if key > line + removed else key, value)
+				for key, value in self._cache.items() if not line < key <= line + removed)
+		index = bisect.bisect_right(self._lines, line)
+		end = bisect.bisect_right(self._lines, line + removed)
+		self._lines[index:] = [checkpoint + delta for checkpoint in self._lines[end:]]
+		self._states[index:] = self._states[end:]
+		# re-lex from the edited line until the state matches the next checkpoint again
+		state = self._state_at(line)
+		index = bisect.bisect_right(self._lines, line)
+		current = line
+		while index < len(self._lines):
+			target = self._lines[index]
+			texts = self._source.get_lines(current, min(target - current, LEX_CHUNK))
+			if not texts:
+				break
+			for text in texts:
+				spans, state = self._lexer.lex(text, state)
+				current += 1
+			if current < target:
+				continue
+			if self._states[index] == state:
+				return
+			if current > line + inserted + CHECKPOINT:
+				# state changed further down, forget it and let the viewport lex it lazily
+				del self._lines[index:]
+				del self._states[index:]
+				return
+			self._states[index] = state
+			index += 1
@@ -0,0 +1,216 @@
+import os
+import time
+import struct
+import tempfile
+import threading
+from array import array
+from collections import deque
+
+
+HISTORY_BUDGET = 16 * 1024 * 1024  # chars of removed and inserted text kept in memory
+SPILL_BUDGET = 256 * 1024 * 1024  # bytes of older history kept on disk when spilling
+GROUP_TIMEOUT = 1.0  # seconds, typing after a pause starts a new transaction
+EDIT_OVERHEAD = 64  # rough bytes of an Edit besides its text, counted against the budget
+# spilled transaction: edit count, then per edit offset, removed bytes, inserted bytes (followed by both texts)
+SPILL_TRANSACTION = struct.Struct('<I')
+SPILL_EDIT = struct.Struct('<qII')
+
+
+class Edit:
+	__slots__ = ('offset', 'removed', 'inserted')
+
+	def __init__(self, offset: int, removed: str, inserted: str):
+		self.offset = offset
+		self.removed = removed
+		self.inserted = inserted
+
+	def size(self):
+		return len(self.removed) + len(self.inserted) + EDIT_OVERHEAD
+
+	def merge(self, offset: int, removed: str, inserted: str):
+		# extend a run of typing or of backspaces, False when the edit is somewhere else
+		if not removed and offset == self.offset + len(self.inserted):
+			self.inserted += inserted
+			return True
+		if not inserted and not self.inserted and offset + len(removed) == self.offset:
+			self.offset = offset
+			self.removed = removed + self.removed
+			return True
+		if not inserted and removed and self.inserted.endswith(removed) and offset + len(removed) == self.offset + len(self.inserted):
+			self.inserted = self.inserted[:-len(removed)]  # backspace over what was just typed
+			return True
+		return False
+
+
+class Transaction:
+	__slots__ = ('edits', 'time', 'size')
+
+	def __init__(self, edits: list=None, when: float=0):
+		self.edits = edits or []
+		self.time = when
+		self.size = sum(edit.size() for edit in self.edits)
+
+
+class History:
+	def __init__(self, *w, budget: int=HISTORY_BUDGET, group_timeout: float=GROUP_TIMEOUT, spill: bool=False, spill_budget: int=SPILL_BUDGET, spill_folder: str=None, **kw):
+		# spill: evicted transactions go to a temp file instead of being forgotten
+		self._budget = budget
+		self._group_timeout = group_timeout
+		self._lock = threading.Lock()
+		self._undo = deque()
+		self._redo = []
+		self._size = 0
+		self._open = 0  # depth of begin() / end()
+		self._sealed = True  # the next edit starts a new transaction
+		self._spill = spill
+		self._spill_budget = spill_budget
+		self._spill_folder = spill_folder
+		self._spill_file = None
+		self._spilled = array('Q')  # start of every spilled transaction, oldest first
+
+	def __len__(self):
+		return len(self._undo) + len(self._spilled)
+
+	@property
+	def size(self):
+		return self._size
+
+	def can_undo(self):
+		return bool(self._undo or self._spilled)
+
+	def can_redo(self):
+		return bool(self._redo)
+
+	def begin(self):
+		# everything recorded until the matching end() is undone in one step
+		with self._lock:
+			if self._open == 0:
+				self._sealed = True
+			self._open += 1
+
+	def end(self):
+		with self._lock:
+			self._open = max(0, self._open - 1)
+			if self._open == 0:
+				self._sealed = True
+
+	def seal(self):
+		# e.g. after a save or a cursor jump, the next keystroke is a new transaction
+		with self._lock:
+			self._sealed = True
+
+	def record(self, offset: int, removed: str, inserted: str, when: float=None):
+		if not removed and not inserted:
+			return
+		when = time.monotonic() if when is None else when
+		with self._lock:
+			self._redo.clear()
+			last = self._undo[-1] if self._undo and not self._sealed else None
+			if last is not None and self._open == 0 and when - last.time > self._group_timeout:
+				last = None
+			if last is None:
+				last = Transaction(when=when)
+				self._undo.append(last)
+				self._sealed = False
+			edit = last.edits[-1] if last.edits else None
+			before = edit.size() if edit is not None else 0
+			if edit is not None and edit.merge(offset, removed, inserted):
+				grown = edit.size() - before
+			else:
+				edit = Edit(offset, removed, inserted)
+				last.edits.append(edit)
+				grown = edit.size()
+			last.size += grown
+			last.time = when
+			self._size += grown
+			self._evict()
+
+	def undo(self):
+		# edits (offset, removed length, inserted text) that take the document one transaction back
+		with self._lock:
+			if not self._undo:
+				self._unspill()
+				self._evict()
+			if not self._undo:
+				return []
+			transaction = self._undo.pop()
+			self._redo.append(transaction)
+			self._sealed = True
+			return [(edit.offset, len(edit.inserted), edit.removed) for edit in reversed(transaction.edits)]
+
+	def redo(self):
+		with self._lock:
+			if not self._redo:
+				return []
+			transaction = self._redo.pop()
+			self._undo.append(transaction)
+			self._sealed = True
+			return [(edit.offset, len(edit.removed), edit.inserted) for edit in transaction.edits]
+
+	def clear(self):
+		with self._lock:
+			self._undo.clear()
+			self._redo.clear()
+			self._size = 0
+			self._sealed = True
+			self._drop_spill()
+
+	def close(self):
+		self.clear()
+		if self._spill_file is not None:
+			self._spill_file.close()
+			self._spill_file = None
+
+	def _evict(self):
+		# oldest undo steps go first, then the redo steps furthest away, the open transaction stays
+		while self._size > self._budget and len(self._undo) > 1:
+			transaction = self._undo.popleft()
+			self._size -= transaction.size
+			if not self._spill_out(transaction):
+				self._drop_spill()
+		while self._size > self._budget and self._redo:
+			self._size -= self._redo.pop(0).size
+
+	def _spill_out(self, transaction: Transaction):
+		if not self._spill:
+			return False
+		if self._spill_file is None:
+			self._spill_file = tempfile.TemporaryFile(prefix='pyeditor-history-', dir=self._spill_folder)
+		file = self._spill_file
+		file.seek(0, os.SEEK_END)
+		start = file.tell()
+		if start + transaction.size * 4 > self._spill_budget:
+			return False
+		parts = [SPILL_TRANSACTION.pack(len(transaction.edits))]
+		for edit in transaction.edits:
+			removed = edit.removed.encode('utf-8', 'surrogatepass')
+			inserted = edit.inserted.encode('utf-8', 'surrogatepass')
+			parts.append(SPILL_EDIT.pack(edit.offset, len(removed), len(inserted)))
+			parts.append(removed)
+			parts.append(inserted)
+		file.write(b''.join(parts))
+		self._spilled.append(start)
+		return True
+
+	def _unspill(self):
+		# the spill file is a stack, the newest spilled transaction is read back and cut off
+		if not self._spilled:
+			return
+		start = self._spilled.pop()
+		file = self._spill_file
+		file.seek(start)
+		count, = SPILL_TRANSACTION.unpack(file.read(SPILL_TRANSACTION.size))
+		edits = []
+		for _ in range(count):
+			offset, removed, inserted = SPILL_EDIT.unpack(file.read(SPILL_EDIT.size))
+			edits.append(Edit(offset, file.read(removed).decode('utf-8', 'surrogatepass'), file.read(inserted).decode('utf-8', 'surrogatepass')))
+		file.truncate(start)
+		transaction = Transaction(edits)
+		self._undo.appendleft(transaction)
+		self._size += transaction.size
+
+	def _drop_spill(self):
+		# older history is useless once a step in between is lost
+		del self._spilled[:]
+		if self._spill_file is not None:
+			self._spill_file.truncate(0)
@@ -0,0 +1,319 @@
+import os
+import re
+import mmap
+import struct
+import hashlib
+import tempfile
+import threading
+from array import array
+
+from search import walk, is_binary
+
+
+INDEX_FOLDER = os.path.join(os.path.expanduser('~'), '.pyeditor', 'index')
+MAX_INDEXED_SIZE = 8 * 1024 * 1024  # bigger files are not indexed, they are always candidates
+MAGIC = b'PYTI'
+VERSION = 1
+# header: magic, version, files, trigrams
+HEADER = struct.Struct('<4sIII')
+# file: mtime_ns, size, flags, path length (followed by the utf-8 path)
+FILE = struct.Struct('<qqBH')
+# trigram: trigram, postings offset (in ids), postings count
+TRIGRAM = struct.Struct('<III')
+FLAG_ALWAYS = 1
+REGEX_META = set('.^$*+?{}[]\\|()')
+
+
+def trigrams(data: bytes):
+	data = data.lower()
+	return {a << 16 | b << 8 | c for a, b, c in set(zip(data, data[1:], data[2:]))}
+
+
+def _class_end(pattern: str, position: int):
+	# index just past the ] closing the character class that starts at position
+	if pattern.startswith('^', position):
+		position += 1
+	if pattern.startswith(']', position):
+		position += 1  # a ] first in the class is a literal
+	while position < len(pattern):
+		char = pattern[position]
+		position += 1
+		if char == '\\':
+			position += 1
+		elif char == ']':
+			break
+	return position
+
+
+def _literal_runs(pattern: str):
+	# stretches of literal text every match contains, classes, repeats and optional groups break them
+	runs = []
+	run = ''
+	groups = []  # (first run of the group, whole group optional) of the open groups
+	closed = None  # first run of the group that just closed, a quantifier after it drops the group
+	position = 0
+	while position < len(pattern):
+		char = pattern[position]
+		position += 1
+		group, closed = closed, None
+		if char in '*?{':
+			if group is not None:
+				del runs[group:]
+			else:
+				runs.append(run[:-1])
+			run = ''
+			if char == '{':
+				end = pattern.find('}', position)
+				position = len(pattern) if end < 0 else end + 1
+			continue
+		if char not in REGEX_META:
+			run += char
+			continue
+		runs.append(run)
+		run = ''
+		if char == '\\':
+			position += 1
+		elif char == '[':
+			position = _class_end(pattern, position)
+		elif char == '(':
+			# (?: only groups, lookarounds, named groups and flags are dropped with their content
+			special = pattern.startswith('?', position)
+			groups.append((len(runs), special and not pattern.startswith('?:', position)))
+			position += 2 if pattern.startswith('?:', position) else special
+		elif char == ')':
+			if groups:
+				closed, optional = groups.pop()
+				if optional:
+					del runs[closed:]
+	runs.append(run)
+	return runs
+
+
+def query_trigrams(query: str, *w, case: bool=True, regex: bool=False, **kw):
+	# trigrams every match has to contain, None when nothing can be required
+	if regex:
+		if '|' in query:
+			return None
+		if re.search(r'\(\?[aiLmsux-]*i', query):
+			case = False  # an inline flag turns case off for the pattern
+		runs = _literal_runs(query)
+	else:
+		runs = [query]
+	required = set()
+	for run in runs:
+		data = run.encode('utf-8')
+		for trigram in trigrams(data) if len(data) >= 3 else ():
+			# bytes.lower() only folds ascii, other bytes can not be trusted without case
+			if case or all(byte < 0x80 for byte in trigram.to_bytes(3, 'big')):
+				required.add(trigram)
+	return required or None
+
+
+class TrigramIndex:
+	def __init__(self, root: str, *w, folder: str=INDEX_FOLDER, **kw):
+		self._root = os.path.abspath(root)
+		name = hashlib.sha1(self._root.encode('utf-8')).hexdigest()[:16]
+		self._path = os.path.join(folder, f'{name}.idx')
+		self._lock = threading.Lock()
+		self._updating = threading.Lock()  # held by the running update, another one is skipped
+		self._files = []  # (relative path, mtime_ns, size, flags)
+		self._ids = {}  # relative path -> id
+		self._map = None
+		self._trigram_count = 0
+		self._postings_start = 0
+		self.load()
+
+	@property
+	def root(self):
+		return self._root
+
+	@property
+	def ready(self):
+		return self._map is not None
+
+	def load(self):
+		try:
+			file = open(self._path, 'rb')
+		except OSError:
+			return False
+		with file:
+			try:
+				data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+			except ValueError:
+				return False
+		try:
+			magic, version, file_count, trigram_count = HEADER.unpack_from(data, 0)
+			if magic != MAGIC or version != VERSION:
+				data.close()
+				return False
+			files = []
+			position = HEADER.size
+			for _ in range(file_count):
+				mtime, size, flags, length = FILE.unpack_from(data, position)
+				position += FILE.size
+				files.append((data[position:position + length].decode('utf-8'), mtime, size, flags))
+				position += length
+			end = position + trigram_count * TRIGRAM.size
+			if trigram_count:
+				value, offset, count = TRIGRAM.unpack_from(data, end - TRIGRAM.size)
+				end += (offset + count) * 4  # postings are stored in trigram order, the last ones end the file
+			if len(data) < end:
+				raise struct.error('index file is truncated')
+		except (struct.error, UnicodeDecodeError):
+			# a torn or foreign file, update() builds it again
+			data.close()
+			return False
+		with self._lock:
+			if self._map is not None:
+				self._map.close()
+			self._map = data
+			self._files = files
+			self._ids = {file[0]: index for index, file in enumerate(files)}
+			self._trigram_count = trigram_count
+			self._trigrams_start = position
+			self._postings_start = position + trigram_count * TRIGRAM.size
+		return True
+
+	def _postings(self, trigram: int):
+		# binary search in the fixed width trigram table of the mapping
+		low, high = 0, self._trigram_count
+		while low < high:
+			middle = (low + high) // 2
+			value, offset, count = TRIGRAM.unpack_from(self._map, self._trigrams_start + middle * TRIGRAM.size)
+			if value < trigram:
+				low = middle + 1
+			elif value > trigram:
+				high = middle
+			else:
+				start = self._postings_start + offset * 4
+				ids = array('I')
+				ids.frombytes(self._map[start:start + count * 4])
+				return ids
+		return array('I')
+
+	def _items(self):
+		for index in range(self._trigram_count):
+			value, offset, count = TRIGRAM.unpack_from(self._map, self._trigrams_start + index * TRIGRAM.size)
+			start = self._postings_start + offset * 4
+			ids = array('I')
+			ids.frombytes(self._map[start:start + count * 4])
+			yield value, ids
+
+	def candidates(self, query: str, *w, case: bool=True, regex: bool=False, **kw):
+		# paths worth verifying: index hits, big files, and anything changed since the index was written
+		with self._lock:
+			ready = self._map is not None
+			required = query_trigrams(query, case=case, regex=regex) if ready else None
+			hits = None
+			if required is not None:
+				for trigram in sorted(required):
+					ids = set(self._postings(trigram))
+					hits = ids if hits is None else hits & ids
+					if not hits:
+						break
+			files = self._files
+			ids = self._ids
+		if not ready:
+			yield from walk(self._root)
+			return
+		for path in walk(self._root):
+			relative = os.path.relpath(path, self._root)
+			index = ids.get(relative)
+			if index is None or hits is None or index in hits:
+				yield path
+				continue
+			name, mtime, size, flags = files[index]
+			if flags & FLAG_ALWAYS:
+				yield path
+				continue
+			try:
+				stat = os.stat(path)
+			except OSError:
+				continue
+			if (stat.st_mtime_ns, stat.st_size) != (mtime, size):
+				yield path
+
+	def update(self, progress: callable=None):
+		# reuse the postings of unchanged files, only read the files whose mtime or size moved
+		# returns the number of files read, None when an update was already running
+		if not self._updating.acquire(blocking=False):
+			return None
+		try:
+			return self._update(progress)
+		finally:
+			self._updating.release()
+
+	def _update(self, progress: callable):
+		with self._lock:
+			old_files = self._files
+			old_ids = self._ids
+		files = []
+		remap = {}
+		scan = []
+		for path in walk(self._root):
+			try:
+				stat = os.stat(path)
+			except OSError:
+				continue
+			relative = os.path.relpath(path, self._root)
+			index = len(files)
+			old = old_ids.get(relative)
+			if old is not None and old_files[old][1:3] == (stat.st_mtime_ns, stat.st_size):
+				remap[old] = index
+				files.append(old_files[old])
+				continue
+			flags = FLAG_ALWAYS if stat.st_size > MAX_INDEXED_SIZE else 0
+			files.append((relative, stat.st_mtime_ns, stat.st_size, flags))
+			if not flags:
+				scan.append(index)
+		postings = {}
+		if self._map is not None and remap:
+			for trigram, ids in self._items():
+				kept = array('I', (remap[old] for old in ids if old in remap))
+				if kept:
+					postings[trigram] = kept
+		for done, index in enumerate(scan):
+			path = os.path.join(self._root, files[index][0])
+			if progress is not None:
+				progress(done, len(scan))
+			if is_binary(path):
+				continue
+			try:
+				with open(path, 'rb') as file:
+					data = file.read(MAX_INDEXED_SIZE + 1)
+			except OSError:
+				continue
+			for trigram in trigrams(data):
+				postings.setdefault(trigram, array('I')).append(index)
+		self._write(files, postings)
+		self.load()
+		return len(scan)
+
+	def _write(self, files: list, postings: dict):
+		folder = os.path.dirname(self._path)
+		os.makedirs(folder, exist_ok=True)
+		fd, temp = tempfile.mkstemp(dir=folder, prefix=os.path.basename(self._path), suffix='.tmp')
+		try:
+			self._write_to(fd, files, postings)
+			os.replace(temp, self._path)
+		except BaseException:
+			os.unlink(temp)
+			raise
+
+	@staticmethod
+	def _write_to(fd: int, files: list, postings: dict):
+		with os.fdopen(fd, 'wb') as file:
+			file.write(HEADER.pack(MAGIC, VERSION, len(files), len(postings)))
+			for relative, mtime, size, flags in files:
+				path = relative.encode('utf-8')
+				file.write(FILE.pack(mtime, size, flags, len(path)))
+				file.write(path)
+			offset = 0
+			keys = sorted(postings)
+			for trigram in keys:
+				file.write(TRIGRAM.pack(trigram, offset, len(postings[trigram])))
+				offset += len(postings[trigram])
+			for trigram in keys:
+				file.write(array('I', sorted(postings[trigram])).tobytes())
+			file.flush()
+			os.fsync(file.fileno())
@@ -1,6 +1,43 @@
+import time
+_STARTED = time.perf_counter()
+
 import os
+import re
+import sys
+import codecs
+import threading
+from collections import OrderedDict
 import flet
 
+from buffer import PieceTable, DirtyRanges
+from fileio import LargeFile, HexFile, FileIO, Format, BinaryFile, atomic_write, newlines
+from search import Searcher, MatchSet, chunked, find_in_folder
+from index import TrigramIndex
+from highlight import Highlighter, lexer_for, THEME
+from history import History
+from session import Session, TabState
+from pluggin import PlugginManager
+from events import EventBus
+from watch import FileWatcher
+from metrics import METRICS
+
+
+CANCELLABLE_JOBS = ('open', 'find', 'reload')  # what the cancel command stops
+LARGE_FILE_THRESHOLD = 16 * 1024 * 1024  # bytes, files this big open read only, editable tabs send their whole text to the field
+INCREMENTAL_SAVE_SIZE = 1024 * 1024  # chars, smaller documents are always rewritten atomically
+INCREMENTAL_SAVE_RATIO = 0.25  # rewrite only the tail when it is at most this part of the document
+MAX_FOLDER_HITS = 1000  # find in folder keeps scanning but only lists this many hits
+UPDATE_INTERVAL = 1 / 30  # seconds, scheduled refreshes are sent together at most this often
+TAB_MEMORY_BUDGET = 128 * 1024 * 1024  # chars held by loaded tabs before unmodified background tabs are unloaded
+APPEND_SAMPLE = 256  # bytes before an append compared with the end of the buffer
+PERFORMANCE_INTERVAL = 1.0  # seconds between refreshes of the performance summary in the status bar
+EDIT_TEXT_SIZE = 16  # what flutter uses for a TextField without a text size
+EDIT_LINE_HEIGHT = 1.5  # line height of editable tabs in text sizes, what is drawn beside or under the field follows it
+EDIT_VISIBLE_LINES = 60  # assumed until the edit view reports its height
+EDIT_OVERSCAN = 30  # lines drawn above and below the visible ones of an editable tab
+EDIT_SCROLL_INTERVAL = 50  # milliseconds between scroll events of the edit view
+GUTTER_DIGIT_WIDTH = 0.6  # width of a monospace digit in text sizes, the gutter is as wide as the last line number
+
 
 def size_fmt(num, suffix="B"):
 	# num: bits
@@ -11,15 +48,53 @@ def size_fmt(num, suffix="B"):
 	return f"{num:.1f}Yi{suffix}"
 
 
+def _stat(path: str):
+	try:
+		stat = os.stat(path)
+	except OSError:
+		return None
+	return stat.st_size, stat.st_mtime_ns
+
+
+class StartupTrace:
+	def __init__(self, start: float):
+		self._start = start
+		self._marks = []  # (label, perf_counter)
+
+	def mark(self, label: str):
+		self._marks.append((label, time.perf_counter()))
+
+	def report(self):
+		lines = []
+		previous = self._start
+		for label, when in self._marks:
+			lines.append(f'{label:<16}{(when - self._start) * 1000:9.1f} ms  (+{(when - previous) * 1000:.1f})')
+			previous = when
+		return '\n'.join(lines)
+
+
+STARTUP = StartupTrace(_STARTED)
+STARTUP.mark('import')
+
+
 class App:
-	def __init__(self, *w, width: int=None, height: int=None, **kw):
+	def __init__(self, *w, width: int=None, height: int=None, trace: bool=False, **kw):
 		self._page = None
 		self._width = width
 		self._height = height
+		self._trace = trace
+		self._editor = None
+		self._pluggins = None
+		self._events = EventBus()  # commands and editor events of this session only, other sessions have their own
+		self._closed = False
 
 	def target(self, page: flet.Page):
+		# the editor surface goes out first, menus and shortcuts are built after that frame
+		STARTUP.mark('target')
 		self._page = page
-		self._page.on_keyboard_event = Shortcut.on_keyboard_event
+		self._page.on_keyboard_event = lambda event: Shortcut.on_keyboard_event(event, events=self._events)
+		# every control update goes through page.update, timing it here covers them all
+		self._page.update = METRICS.timed('update', self._page.update)
 		
 		if not self._page.platform=='android':
 			self._page.window_max_width = self._width
@@ -27,103 +102,189 @@ class App:
 		else:
 			self._page.window_full_screen = True
 
-		# top menu
-		menu_file = MenuFile()
-		menu_edit = MenuEdit()
-		menu_view = MenuView()
-		menu_preference = MenuPreference()
-
-		menus = [menu_file,menu_edit,menu_view,menu_preference]
-		self._top_menu = flet.MenuBar(expand=True,controls=menus)
-		self._page.controls.append(flet.Row([self._top_menu],alignment=flet.MainAxisAlignment.CENTER))
 		# tabs
-		self._editor = Editor()
+		self._editor = Editor(session=Session(), events=self._events)
+		self._editor.restore_session()
 		self._page.controls.append(self._editor)
-		
-		# Menu Callbacks (action events)
-		on_file_new = Callback(self._editor.new_tab)
-		on_file_open = Callback(self._editor.file_open)
-		on_file_save = Callback(self._editor.file_save)
-		on_file_save_as = Callback(self._editor.file_save_as)
-		on_file_close = Callback(self._editor.del_tab)
-
-		on_edit_copy = Callback(self._editor.edit_copy)
-		on_edit_cut = Callback(self._editor.edit_cut)
-		on_edit_paste = Callback(self._editor.edit_paste)
-		on_edit_find = Callback(self._editor.edit_find)
-		on_edit_replace = Callback(self._editor.edit_replace)
-
-		on_view_zoom_in = Callback(self._editor.view_zoom_in)
-		on_view_zoom_out = Callback(self._editor.view_zoom_out)
-		on_view_zoom_reset = Callback(self._editor.view_zoom_reset)
-
-		on_view_word_wrap = Callback(self._editor.view_word_wrap)
-		on_view_line_number = Callback(self._editor.view_line_number)
-		on_view_go_to = Callback(self._editor.view_go_to)
-		
-		on_preference_setting = Callback(self._editor.preference_setting)
-		on_preference_shortcut = Callback(self._editor.preference_shortcut)
-		on_preference_theme = Callback(self._editor.preference_theme)
-		on_preference_syntax_highlight = Callback(self._editor.preference_syntax_highlight)
-		on_preference_font = Callback(self._editor.preference_font)
-		on_preference_pluggin = Callback(self._editor.preference_pluggin)
-
-		# menu set on_click button event
-		menu_file._on_new.bind(on_file_new)
-		menu_file._on_open.bind(on_file_open)
-		menu_file._on_save.bind(on_file_save)
-		menu_file._on_save_as.bind(on_file_save_as)
-		menu_file._on_close.bind(on_file_close)
-
-		menu_edit._on_copy.bind(on_edit_copy)
-		menu_edit._on_cut.bind(on_edit_cut)
-		menu_edit._on_paste.bind(on_edit_paste)
-		menu_edit._on_find.bind(on_edit_find)
-		menu_edit._on_replace.bind(on_edit_replace)
-
-		menu_view._on_zoom_in.bind(on_view_zoom_in)
-		menu_view._on_zoom_out.bind(on_view_zoom_out)
-		menu_view._on_zoom_reset.bind(on_view_zoom_reset)
-		menu_view._on_word_wrap.bind(on_view_word_wrap)
-		menu_view._on_line_number.bind(on_view_line_number)
-		menu_view._on_go_to.bind(on_view_go_to)
-
-		menu_preference._on_settings.bind(on_preference_setting)
-		menu_preference._on_shortcuts.bind(on_preference_shortcut)
-		menu_preference._on_themes.bind(on_preference_theme)
-		menu_preference._on_syntax_hightlight.bind(on_preference_syntax_highlight)
-		menu_preference._on_fonts.bind(on_preference_font)
-		menu_preference._on_pluggins.bind(on_preference_pluggin)
-
-		# keyboard shortcuts
+		self._page.on_close = self._on_close
+		if not self._page.platform=='android':
+			self._page.window_prevent_close = True
+			self._page.on_window_event = self._on_window_event
+
+		# status bar
+		status_text = flet.Text('status bar:', expand=True)
+		self._status_bar = flet.Row([flet.Container(content=status_text,expand=True, bgcolor='grey')])
+		self._page.controls.append(self._status_bar)
+		self._editor.bind_status(status_text)
+		STARTUP.mark('construction')
+
+		# first paint
+		self._page.update()
+		STARTUP.mark('first paint')
+
+		self._build_menus()
+		STARTUP.mark('menus')
+		self._register_shortcuts()
+		STARTUP.mark('shortcuts')
+		self._page.update()
+		STARTUP.mark('ready')
+		# pluggins only import when their activation event fires, startup ones now that the ui is up
+		self._pluggins = PlugginManager(isolate=self._page.platform != 'android')
+		self._editor.bind_pluggins(self._pluggins)
+		self._pluggins.trigger('startup', editor=self._editor)
+		STARTUP.mark('pluggins')
+		if self._trace:
+			print(STARTUP.report())
+
+	def _build_menus(self):
+		# top menu, every button publishes its command on the bus of this session
+		events = self._events
+		menus = [MenuFile(events), MenuEdit(events), MenuView(events), MenuPreference(events)]
+		self._top_menu = flet.MenuBar(expand=True,controls=menus)
+		self._page.controls.insert(0, flet.Row([self._top_menu],alignment=flet.MainAxisAlignment.CENTER))
+
+		# commands (action events)
+		editor = self._editor
+		actions = {
+			'file_new': editor.new_tab,
+			'file_open': editor.file_open,
+			'file_save': editor.file_save,
+			'file_save_as': editor.file_save_as,
+			'file_close': editor.del_tab,
+			'edit_copy': editor.edit_copy,
+			'edit_cut': editor.edit_cut,
+			'edit_paste': editor.edit_paste,
+			'edit_undo': editor.edit_undo,
+			'edit_redo': editor.edit_redo,
+			'edit_find': editor.edit_find,
+			'edit_replace': editor.edit_replace,
+			'edit_find_in_folder': editor.edit_find_in_folder,
+			'view_zoom_in': editor.view_zoom_in,
+			'view_zoom_out': editor.view_zoom_out,
+			'view_zoom_reset': editor.view_zoom_reset,
+			'view_word_wrap': editor.view_word_wrap,
+			'view_line_number': editor.view_line_number,
+			'view_go_to': editor.view_go_to,
+			'view_performance': editor.view_performance,
+			'view_trace': editor.view_trace,
+			'preference_setting': editor.preference_setting,
+			'preference_shortcut': editor.preference_shortcut,
+			'preference_theme': editor.preference_theme,
+			'preference_syntax_highlight': editor.preference_syntax_highlight,
+			'preference_font': editor.preference_font,
+			'preference_pluggin': editor.preference_pluggin,
+			'cancel_io': editor.cancel_io,
+			'next_tab': editor.next_tab,
+			'prev_tab': editor.prev_tab,
+			'first_tab': editor.go_first_tab,
+			'last_tab': editor.go_last_tab,
+			'go_tab': editor.go_tab,
+		}
+		for command, action in actions.items():
+			events.subscribe(command, action)
+
+	def _register_shortcuts(self):
+		# keyboard shortcuts, the table is shared by every session and a command goes to the bus of the page that got the key
 		# File Menu
-		Shortcut.register('N', callback=on_file_new)
-		Shortcut.register('O', callback=on_file_open)
-		Shortcut.register('S', ctrl=True, shift=False, callback=on_file_save)
-		Shortcut.register('S', ctrl=True, shift=True, callback=on_file_save_as)
-		Shortcut.register('W', callback=on_file_close)
+		Shortcut.register('N', callback=Command('file_new'))
+		Shortcut.register('O', callback=Command('file_open'))
+		Shortcut.register('S', ctrl=True, shift=False, callback=Command('file_save'))
+		Shortcut.register('S', ctrl=True, shift=True, callback=Command('file_save_as'))
+		Shortcut.register('W', callback=Command('file_close'))
+		# Edit Menu
+		# the focused field undoes ctrl+z and ctrl+shift+z itself, its change reaches the buffer like typing
+		Shortcut.register('Z', callback=Command('edit_undo', native=True))
+		Shortcut.register('Y', callback=Command('edit_redo'))
+		Shortcut.register('Z', ctrl=True, shift=True, callback=Command('edit_redo', native=True))
+		Shortcut.register('F', callback=Command('edit_find'))
+		Shortcut.register('H', callback=Command('edit_replace'))
+		Shortcut.register('F', ctrl=True, shift=True, callback=Command('edit_find_in_folder'))
 		# View Menu
-		Shortcut.register(']', callback=on_view_zoom_in)
-		Shortcut.register('[', callback=on_view_zoom_out)
-		Shortcut.register('=', callback=on_view_zoom_reset)
-		Shortcut.register('G', callback=on_view_go_to)
+		Shortcut.register(']', callback=Command('view_zoom_in'))
+		Shortcut.register('[', callback=Command('view_zoom_out'))
+		Shortcut.register('=', callback=Command('view_zoom_reset'))
+		Shortcut.register('G', callback=Command('view_go_to'))
+		Shortcut.register('Escape', ctrl=False, callback=Command('cancel_io'))
 
 		# Tab Navegation
-		Shortcut.register('Arrow Right', ctrl=False,alt=True,callback=Callback(self._editor.next_tab))
-		Shortcut.register('Arrow Left', ctrl=False,alt=True,callback=Callback(self._editor.prev_tab))
-		Shortcut.register('Arrow Up', ctrl=False,alt=True,callback=Callback(self._editor.go_first_tab))  # first
-		Shortcut.register('Arrow Down', ctrl=False,alt=True,callback=Callback(self._editor.go_last_tab))  # last
+		Shortcut.register('Arrow Right', ctrl=False,alt=True,callback=Command('next_tab'))
+		Shortcut.register('Arrow Left', ctrl=False,alt=True,callback=Command('prev_tab'))
+		Shortcut.register('Arrow Up', ctrl=False,alt=True,callback=Command('first_tab'))  # first
+		Shortcut.register('Arrow Down', ctrl=False,alt=True,callback=Command('last_tab'))  # last
 		for digit in range(1,11):
 			if digit==10:
 				digit =0
-			Shortcut.register(str(digit),ctrl=False, alt=True,callback=Callback(self._editor.go_tab, index=digit - 1 if digit != 0 else 9))
+			Shortcut.register(str(digit),ctrl=False, alt=True,callback=Command('go_tab', index=digit - 1 if digit != 0 else 9))
 
-		# status bar
-		self._status_bar = flet.Row([flet.Container(content=flet.Text('status bar:', expand=True),expand=True, bgcolor='grey')])
-		self._page.controls.append(self._status_bar)
+	def _on_window_event(self, e):
+		if e.data == 'close':
+			self._close()
+			EVENTS.shutdown()  # the last window of the process
+			self._page.window_destroy()
 
-		# update
-		self._page.update()
+	def _on_close(self, e):
+		# the session went away (a closed browser tab), other sessions keep their own bus
+		self._close()
+
+	def _close(self):
+		# a closed window also ends its session, this runs once
+		if self._closed:
+			return
+		self._closed = True
+		self._editor.close()
+		if self._pluggins is not None:
+			self._pluggins.close()
+		self._events.shutdown()
+
+
+class UpdateScheduler:
+	def __init__(self, *w, interval: float=UPDATE_INTERVAL, **kw):
+		# coalesces refreshes of the same control and sends them in one page.update() per interval
+		self._interval = interval
+		self._lock = threading.Lock()
+		self._pending = {}  # id(control) -> (control, refresh)
+		self._timer = None
+		self.suppressed = 0  # refreshes merged into one already pending
+		self.flushes = 0  # page.update() round trips sent
+
+	def schedule(self, control: flet.Control, refresh: callable=None):
+		# refresh() runs right before the flush, so formatting happens once per batch too
+		with self._lock:
+			key = id(control)
+			if key in self._pending:
+				self.suppressed += 1
+			self._pending[key] = (control, refresh)
+			if self._interval > 0 and self._timer is None:
+				self._timer = threading.Timer(self._interval, self.flush)
+				self._timer.daemon = True
+				self._timer.start()
+		if self._interval <= 0:
+			self.flush()
+
+	def flush(self):
+		with self._lock:
+			pending, self._pending = self._pending, {}
+			if self._timer is not None:
+				self._timer.cancel()
+				self._timer = None
+		controls = []
+		for control, refresh in pending.values():
+			if refresh is not None:
+				refresh()
+			if control.page is not None:
+				controls.append(control)
+		if controls:
+			controls[0].page.update(*controls)
+			self.flushes += 1
+
+
+UPDATES = UpdateScheduler()
+
+
+# commands are published by menus and shortcuts, the editor publishes
+# tab_opened(tab), tab_shown(tab), tab_unloaded(tab), tab_closed(tab), buffer_changed(tab, delta), saved(tab, path) and key(event)
+# every App has its own bus for them, EVENTS is the one of an editor or a shortcut without an app (scripts, the bench)
+EVENTS = EventBus()
 
 
 class Callback:
@@ -131,69 +292,155 @@ class Callback:
 		self._func = func
 		self._w = w
 		self._kw = kw
-		self._bind = None
 	
 	def call(self, *w, **kw):
 		if self._func is not None:
 			self._func(*self._w, **self._kw)
-		if self._bind is not None:
-			self._bind.call()
 
-	def bind(self, callback):
-		self._bind = callback
+
+class Command(Callback):
+	def __init__(self, name: str, *w, **kw):
+		super(Command, self).__init__(None, *w, **kw)
+		self.name = name
+
+	def call(self, *w, events: EventBus=None, **kw):
+		# published on the bus of the page that got the key
+		(EVENTS if events is None else events).publish(self.name, *self._w, **self._kw)
 	
 
+class ShortcutNode:
+	__slots__ = ('callback', 'children')
+
+	def __init__(self):
+		self.callback = None
+		self.children = {}  # chords: next combo -> ShortcutNode
+
+
 class Shortcut:
-	__SHORTCUTS = []
-	__CALLBACKS = []
+	__SHORTCUTS = {}  # (key, shift, ctrl, alt, meta) -> ShortcutNode
+	__PENDING = None  # children of the chord prefix typed so far
+	__TYPING = False  # is any plain (unmodified) character bound?
+	__MODIFIERS = {'Shift Left', 'Shift Right', 'Control Left', 'Control Right', 'Alt Left', 'Alt Right', 'Meta Left', 'Meta Right'}
+
+	@staticmethod
+	def combo(key: str, *w, shift: bool=False, ctrl: bool=True, alt: bool=False, meta: bool=False, **kw):
+		return (key,shift,ctrl,alt,meta)
+
+	@staticmethod
+	def _is_typing(key: str, ctrl: bool, alt: bool, meta: bool):
+		return len(key)==1 and not (ctrl or alt or meta)
+
+	@staticmethod
+	def _path(key: str, shift: bool, ctrl: bool, alt: bool, meta: bool, prefix: tuple):
+		return tuple(prefix) + ((key,shift,ctrl,alt,meta),)
 
 	@classmethod
-	def register(cls, key: str, *w, shift: bool=False, ctrl: bool=True, alt: bool=False, meta: bool=False, callback: Callback, **kw):
-		if not cls.has(key, shift, ctrl, alt,meta):
-			cls.__SHORTCUTS.append((key,shift,ctrl,alt,meta))
-			cls.__CALLBACKS.append(callback)
-	
+	def register(cls, key: str, *w, shift: bool=False, ctrl: bool=True, alt: bool=False, meta: bool=False, prefix: tuple=(), callback: Callback, **kw):
+		# prefix: combos typed before this one, e.g. (Shortcut.combo('K'),) for Ctrl+K Ctrl+C
+		nodes = cls.__SHORTCUTS
+		node = None
+		for combo in cls._path(key, shift, ctrl, alt, meta, prefix):
+			node = nodes.get(combo)
+			if node is None:
+				node = nodes[combo] = ShortcutNode()
+			nodes = node.children
+		if node.callback is None:
+			node.callback = callback
+		if cls._is_typing(key, ctrl, alt, meta):
+			cls.__TYPING = True
+
 	@classmethod
-	def unregister(cls, key: str, *w, shift: bool=False, ctrl: bool=True, alt: bool=False, meta: bool=False, **kw):
-		try:
-			index = cls.__SHORTCUTS.index((key,shift,ctrl,alt,meta))
-		except ValueError:
+	def unregister(cls, key: str, *w, shift: bool=False, ctrl: bool=True, alt: bool=False, meta: bool=False, prefix: tuple=(), **kw):
+		path = cls._path(key, shift, ctrl, alt, meta, prefix)
+		trail = []
+		nodes = cls.__SHORTCUTS
+		for combo in path:
+			node = nodes.get(combo)
+			if node is None:
+				return False
+			trail.append((nodes, combo, node))
+			nodes = node.children
+		if node.callback is None:
 			return False
-		else:
-			self.__SHORTCUTS.pop(index)
-			self.__CALLBACKS.pop(index)
-			return True
-	
+		node.callback = None
+		# prune the branch back to the last node still in use
+		for nodes, combo, node in reversed(trail):
+			if node.callback is not None or node.children:
+				break
+			del nodes[combo]
+		cls.__PENDING = None
+		return True
+
 	@classmethod
-	def has(cls, key: str, shift: bool, ctrl: bool, alt: bool, meta: bool):
-		try:
-			cls.__SHORTCUTS.index((key,shift,ctrl,alt,meta))
-		except ValueError:
-			return False
-		else:
-			return True
+	def has(cls, key: str, shift: bool, ctrl: bool, alt: bool, meta: bool, prefix: tuple=()):
+		nodes = cls.__SHORTCUTS
+		node = None
+		for combo in cls._path(key, shift, ctrl, alt, meta, prefix):
+			node = nodes.get(combo)
+			if node is None:
+				return False
+			nodes = node.children
+		return node.callback is not None
+
+	@classmethod
+	def on_keyboard_event(cls, event: flet.KeyboardEvent, *w, events: EventBus=None, **kw):
+		start = time.perf_counter()
+		cls._dispatch(event, EVENTS if events is None else events)
+		METRICS.record('key', start)
 
 	@classmethod
-	def on_keyboard_event(cls, event: flet.KeyboardEvent):
+	def _dispatch(cls, event: flet.KeyboardEvent, events: EventBus):
+		if events.has('key'):
+			events.publish('key', event)
 		key = event.key
 		ctrl = event.ctrl
-		shift = event.shift
 		alt = event.alt
 		meta = event.meta
-		for index in range(0,len(cls.__SHORTCUTS)):
-			_key, _shift,_ctrl,_alt,_meta = cls.__SHORTCUTS[index]
-			_callback = cls.__CALLBACKS[index]
-			if _callback is not None:
-				if key==_key and shift==_shift and ctrl==_ctrl and alt==_alt and meta==_meta:
-					_callback.call(key,shift,ctrl,alt,meta)
+		# plain text entry never reaches the table
+		if cls.__PENDING is None and not cls.__TYPING and cls._is_typing(key, ctrl, alt, meta):
+			return
+		if key in cls.__MODIFIERS:
+			return
+		shift = event.shift
+		nodes = cls.__SHORTCUTS if cls.__PENDING is None else cls.__PENDING
+		node = nodes.get((key,shift,ctrl,alt,meta))
+		if node is None:
+			cls.__PENDING = None
+			return
+		if node.children:
+			cls.__PENDING = node.children
+			return
+		cls.__PENDING = None
+		if node.callback is not None:
+			node.callback.call(key,shift,ctrl,alt,meta, events=events)
 
 
 class Editor(flet.UserControl):
-	def __init__(self, *w, **kw):
+	def __init__(self, *w, large_file_threshold: int=LARGE_FILE_THRESHOLD, memory_budget: int=TAB_MEMORY_BUDGET, session: Session=None, watch: bool=True, events: EventBus=None, **kw):
 		super(Editor, self).__init__(*w, **kw)
+		self._events = EVENTS if events is None else events  # bus of the session the editor belongs to
 		self._area = flet.Ref[flet.SafeArea]()
-		self._tabs = flet.Tabs()
+		self._tabs = flet.Tabs(on_change=self._on_tab_change)
 		self.expand=True
+		self._shown = None  # only the selected tab keeps its view in the page
+		self._large_file_threshold = large_file_threshold
+		self._lock = threading.RLock()  # tabs arrive from io workers
+		self._io = FileIO(on_progress=self._on_io_progress)
+		self._opening = set()
+		self._indexes = {}  # folder -> TrigramIndex
+		self._recent = OrderedDict()  # loaded tabs, least recently shown first
+		self._memory_budget = memory_budget
+		self._session = session
+		self._pluggins = None
+		self._subscriptions = []  # unsubscribe callables of the pluggin handlers
+		self._watcher = FileWatcher(self._on_file_changed) if watch else None
+		self._line_numbers = False
+		self._status = None
+		self._status_message = ''
+		self._performance = False
+		self._performance_timer = None
+		self._performance_chain = 0  # bumped by every toggle of the summary
+		METRICS.gauge('buffers', self.memory)
 		
 		self._is_mounted = False
 		self._wait_to_mount = []
@@ -202,31 +449,48 @@ class Editor(flet.UserControl):
 		return flet.SafeArea(expand=True, ref=self._area,content=self._tabs)
 
 	def did_mount(self):
+		# queued tabs go in with a single update, only the selected one gets loaded
 		self._is_mounted = True
-		for tab in self._wait_to_mount:
-			self._insert_tab(tab)
-		self._wait_to_mount.clear()
-
-	def new_tab(self, *w, title:str='',data:str='',filename:str='',path:str='',size:int=0, **kw):
+		with self._lock:
+			self._tabs.tabs.extend(self._wait_to_mount)
+			self._wait_to_mount.clear()
+			self._show_active()
+			self.update()
+
+	def new_tab(self, *w, title:str='',data:str='',filename:str='',path:str='',size:int=0, large_file: LargeFile=None, lazy: bool=False, **kw):
+		# lazy tabs are added in the background and read from path when first shown
 		shortcut_opening = title==''
 		if title=='':
 			title = f'untitled {len(self._tabs.tabs)}'
-		tab = Tab(title=title, data=data, filename=filename, path=path, size=size)
+		tab = Tab(title=title, data=data, filename=filename, path=path, size=size, large_file=large_file, lazy=lazy)
+		tab.on_edit = self._on_tab_edit
+		tab.on_delta = self._on_tab_delta
+		if self._line_numbers:
+			tab.set_line_numbers(True)
+		self._events.publish('tab_opened', tab)
 		if self._is_mounted:
-			self._insert_tab(tab)
+			self._insert_tab(tab, select=not lazy)
 			if shortcut_opening:
-				tab._textfield.focus()
+				tab.focus()
 		else:
 			self._wait_to_mount.append(tab)
 		return tab
 
-	def _insert_tab(self, tab):
-		index = self._tabs.selected_index
-		count = len(self._tabs.tabs)
-		self._tabs.tabs.insert(index + 1, tab)
-		self._tabs.selected_index = index + 1 if index != count else index
-		self.update()
-		tab._textfield.focus()
+	def _insert_tab(self, tab, select: bool=True):
+		with self._lock:
+			index = self._tabs.selected_index
+			count = len(self._tabs.tabs)
+			if not select:
+				self._tabs.tabs.append(tab)
+				if count == 0:
+					self._show_active()
+				self.update()
+				return
+			self._tabs.tabs.insert(index + 1, tab)
+			self._tabs.selected_index = index + 1 if index != count else index
+			self._show_active()
+			self.update()
+		tab.focus()
 
 	def del_tab(self):
 		self.file_save(after_save=self._del_tab)
@@ -258,14 +522,266 @@ class Editor(flet.UserControl):
 		self.page.update()
 
 	def _del_tab(self):
-		count = len(self._tabs.tabs)
-		if count<=0:
+		with self._lock:
+			count = len(self._tabs.tabs)
+			if count<=0:
+				return
+			index = self._tabs.selected_index
+			self._tabs.selected_index = index - 1 if index != 0 else index
+			tab = self._tabs.tabs.pop(index)
+			if tab is self._shown:
+				self._shown = None
+			self._recent.pop(tab, None)
+			tab.close()
+			self._unwatch(tab)
+			self._events.publish('tab_closed', tab)
+			self._show_active()
+			self.update()
+
+	def _on_tab_change(self, e):
+		self._show_active()
+		self._tabs.update()
+
+	def _show_active(self):
+		# hidden tabs drop their view so the client only holds the selected one
+		tab = self.active_tab()
+		if tab is self._shown:
 			return
-		index = self._tabs.selected_index
-		self._tabs.selected_index = index - 1 if index != 0 else index
-		self._tabs.tabs.pop(index)
-		self.update()
+		if self._shown is not None:
+			self._shown.hide()
+		if tab is not None:
+			tab.show()
+			if tab.loaded:
+				self._touch(tab)
+			else:
+				self._load_tab(tab)
+		self._shown = tab
+		self._refresh_status()
+		self._save_session()
+
+	# tab memory
+	def _touch(self, tab):
+		self._recent[tab] = None
+		self._recent.move_to_end(tab)
+		if self._watcher is not None and tab._path:
+			self._watcher.watch(tab._path)
+		self._events.publish('tab_shown', tab)
+
+	def _load_tab(self, tab):
+		# restored unsaved content comes from the session copy and stays modified
+		restored = tab._source is not None
+		path = tab._source if restored else tab._path
+		with self._lock:
+			if path in self._opening:
+				return
+			self._opening.add(path)
+		stat = _stat(path)
+		size = stat[0] if stat is not None else 0
+
+		def on_done(result):
+			if not restored:
+				tab._format, result = result
+			with self._lock:
+				if restored:
+					tab._disk_stat = None
+				elif tab._disk_stat is not None and tab._disk_stat != stat:
+					tab._history.clear()  # changed on disk, the old offsets mean nothing
+				if not restored:
+					tab._disk_stat = stat
+				tab.load(result)
+				if restored:
+					tab._source = None
+					tab._dirty.add(0, len(tab._buffer))
+				self._touch(tab)
+				if tab is self._shown and self.page is not None:
+					self.update()
+				self._opening.discard(path)
+				# written to while it was read, the watcher skipped it because it was not loaded
+				stale = not restored and _stat(path) != stat
+			if stale:
+				self._reload_tab(tab)
+			self._refresh_status()
+			self._evict_tabs()
+
+		def on_error(exception):
+			self._set_status(self._open_error(tab._title, exception))
+
+		if restored:
+			job = self._io.read(path, on_done=on_done, on_error=on_error, encoding='utf-8', newline='')
+		else:
+			job = self._io.load(path, large=size>=self._large_file_threshold, on_done=on_done, on_error=on_error)
+		job.future.add_done_callback(lambda future: self._opening.discard(path))
+
+	# session
+	def restore_session(self):
+		# tabs come back as metadata, only the selected one is read once the editor is mounted
+		if self._session is None:
+			return
+		states, selected = self._session.load()
+		for state in states:
+			if state.path or state.buffer:
+				tab = self.new_tab(title=state.title, filename=state.title, path=state.path, lazy=True)
+			else:
+				tab = self.new_tab(title=state.title, filename=state.title)
+			if state.buffer:
+				tab._session_id = state.buffer
+				tab._source = self._session.buffer_path(state.buffer)
+			if state.file_format is not None:
+				tab._format = state.file_format
+			if state.text_size:
+				tab.set_text_size(state.text_size)
+			tab._highlight = state.highlight
+			if state.line or state.column:
+				tab.go_to_line(state.line, state.column)
+		if selected >= 0:
+			self._tabs.selected_index = selected
+
+	def _save_session(self):
+		if self._session is not None:
+			self._session.schedule(self._session_state)
+
+	def _session_state(self):
+		# runs on the session thread, the buffers are captured under the lock and joined after it
+		pending = []
+		with self._lock:
+			tabs = list(self._tabs.tabs) + list(self._wait_to_mount)
+			selected = self._tabs.selected_index
+			states = []
+			for tab in tabs:
+				state = TabState(tab._path, tab._title, text_size=int(tab.get_text_size() or 0), file_format=tab._format)
+				if tab.loaded:
+					state.line, state.column = tab.position()
+					state.highlight = tab._highlighter is not None
+					if tab.modified or (not tab._path and len(tab._buffer) > 0):
+						if not tab._session_id:
+							tab._session_id = self._session.new_id()
+						state.buffer = tab._session_id
+						state.generation = tab._generation
+						if self._session.needs(state.buffer, state.generation):
+							pending.append((state, tab._buffer.snapshot()))
+				else:
+					state.line = tab._pending_line or 0
+					state.column = tab._pending_column
+					state.highlight = tab._highlight
+					if tab._source is not None:
+						state.buffer = tab._session_id
+				states.append(state)
+		for state, snapshot in pending:
+			state.data = ''.join(snapshot)
+		return states, selected
+
+	def close(self):
+		# write the last snapshot before the window goes away
+		subscriptions, self._subscriptions = self._subscriptions, []
+		for unsubscribe in subscriptions:
+			unsubscribe()
+		if self._session is not None:
+			self._session.schedule(self._session_state)
+			self._session.flush()
+		if self._watcher is not None:
+			self._watcher.stop()
+		self._performance = False
+		if self._performance_timer is not None:
+			self._performance_timer.cancel()
+		self._io.shutdown()
+
+	# file watching
+	def _unwatch(self, tab):
+		if self._watcher is not None and tab._path:
+			self._watcher.unwatch(tab._path)
+
+	def _on_file_changed(self, path: str):
+		# runs on the watcher thread
+		with self._lock:
+			tab = next((tab for tab in self._tabs.tabs if tab.loaded and tab._path and os.path.abspath(tab._path) == path), None)
+		if tab is None:
+			return
+		if any(job.kind == 'save' and job.path == tab._path for job in self._io.jobs()):
+			return  # our own write, on_done records the new stat
+		stat = _stat(path)
+		old = tab._disk_stat
+		if stat is None or stat == old:
+			return
+		if tab.modified:
+			self._set_status(f'{tab._title} changed on disk')
+		elif old is not None and stat[0] > old[0]:
+			self._append_from_disk(tab, old[0], stat)
+		else:
+			self._reload_tab(tab)
+
+	def _append_from_disk(self, tab, start: int, stat: tuple):
+		# only the bytes past the old size are read, a tail that does not match means a rewrite
+		path = tab._path
+		if tab._read_only:
+			with self._lock:
+				tab.append()
+				tab._disk_stat = stat
+			return
+		if stat[0] >= self._large_file_threshold:
+			self._reload_tab(tab)  # grew past the threshold, opens again as a read only large file
+			return
+
+		def run(progress):
+			with open(path, 'rb') as file:
+				sample_start = max(0, start - APPEND_SAMPLE)
+				file.seek(sample_start)
+				sample = file.read(start - sample_start)
+				progress(0, stat[0] - start)
+				data = file.read(stat[0] - start)
+			return sample, data
+
+		def on_done(result):
+			sample, data = result
+			with self._lock:
+				if not tab.loaded or tab.modified:
+					self._reload_tab(tab)
+					return
+				if tab._decoder is None:
+					tab._decoder = codecs.getincrementaldecoder(tab._format.encoding)(errors='replace')
+				# a split character and a \r that may start a \r\n wait for the next append, they are not in the buffer yet
+				sample = sample[:len(sample) - len(tab._decoder.getstate()[0])].decode(tab._format.encoding, errors='replace')
+				sample = newlines(sample[:len(sample) - len(tab._held)])[1:]
+				if not tab._buffer.get_text(max(0, len(tab._buffer) - len(sample))).endswith(sample):
+					self._reload_tab(tab)
+					return
+				text = tab._held + tab._decoder.decode(data)
+				tab._held = '\r' if text.endswith('\r') else ''
+				text = newlines(text[:len(text) - len(tab._held)])
+				if text:
+					tab.append(text)
+				tab._disk_stat = stat
+
+		self._io.submit('reload', path, run, on_done=on_done, on_error=lambda exception: self._reload_tab(tab))
+
+	def _reload_tab(self, tab):
+		with self._lock:
+			if not tab.unload():
+				return
+			self._recent.pop(tab, None)
+			self._events.publish('tab_unloaded', tab)
+			if tab is self._shown:
+				self._load_tab(tab)
+
+	def _evict_tabs(self):
+		# unload unmodified background tabs, least recently shown first, until the budget fits
+		with self._lock:
+			total = self.memory()
+			for tab in list(self._recent):
+				if total <= self._memory_budget:
+					break
+				if tab is self._shown:
+					continue
+				memory = tab.memory()
+				if tab.unload():
+					del self._recent[tab]
+					total -= memory
+					self._unwatch(tab)
+					self._events.publish('tab_unloaded', tab)
 	
+	def memory(self):
+		# rough chars held by the loaded tabs
+		return sum(tab.memory() for tab in list(self._recent))
+
 	def active_tab(self):
 		if len(self._tabs.tabs)>0:
 			return self._tabs.tabs[self._tabs.selected_index]
@@ -283,8 +799,9 @@ class Editor(flet.UserControl):
 		tabs = len(self._tabs.tabs)
 		if index>=0 and index<tabs:
 			self._tabs.selected_index = index
+			self._show_active()
 			self._tabs.update()
-			self.active_tab()._textfield.focus()
+			self.active_tab().focus()
 	
 	def go_first_tab(self):
 		self.go_tab(0)
@@ -292,47 +809,175 @@ class Editor(flet.UserControl):
 	def go_last_tab(self):
 		self.go_tab(len(self._tabs.tabs) - 1)
 
+	# status
+	def bind_status(self, text: flet.Text):
+		self._status = text
+
+	def bind_pluggins(self, pluggins: PlugginManager):
+		# pluggins follow editable tabs through the bus and get deltas, never the whole text
+		self._pluggins = pluggins
+
+		def on_shown(tab):
+			if not tab._read_only:
+				pluggins.open_document(id(tab), tab.get_data)
+		self._subscriptions += [
+			self._events.subscribe('tab_shown', on_shown),
+			self._events.subscribe('buffer_changed', lambda tab, delta: pluggins.edit(id(tab), *delta)),
+			self._events.subscribe('tab_unloaded', lambda tab: pluggins.close_document(id(tab))),
+			self._events.subscribe('tab_closed', lambda tab: pluggins.close_document(id(tab))),
+		]
+		if self._shown is not None:
+			on_shown(self._shown)
+
+	def _set_status(self, message: str=''):
+		self._status_message = message
+		self._refresh_status()
+
+	def _on_io_progress(self, jobs):
+		self._refresh_status()
+
+	def _on_tab_delta(self, tab, delta):
+		self._events.publish('buffer_changed', tab, delta)
+
+	def _on_tab_edit(self, tab):
+		if tab is self.active_tab():
+			self._refresh_status()
+		self._save_session()
+
+	def _refresh_status(self):
+		if self._status is not None:
+			UPDATES.schedule(self._status, self._render_status)
+
+	def _render_status(self):
+		jobs = self._io.jobs()
+		running = ', '.join(f'{job.kind} {job.name} {job.percent()}%' for job in jobs)
+		tab = self.active_tab()
+		position = ''
+		if tab is not None:
+			if tab.loaded and tab.hex:
+				position = f'  Offset {tab.offset():#x} of {tab._size:#x}  hex'
+			else:
+				line, column = tab.position()
+				position = f'  Ln {line + 1}, Col {column + 1} of {tab.line_count()} lines  {tab._format.describe()}'
+		performance = f'  |  {METRICS.status(size_fmt)}' if self._performance else ''
+		self._status.value = f'status bar: {running or self._status_message}{position}{performance}'
+
+	def view_performance(self):
+		# rolling latency, update and io rates in the status bar
+		# every toggle starts a new chain of ticks, a tick already running for an older one stops there
+		with self._lock:
+			self._performance = not self._performance
+			self._performance_chain += 1
+			if self._performance_timer is not None:
+				self._performance_timer.cancel()
+				self._performance_timer = None
+			chain = self._performance_chain
+		self._tick_performance(chain)
+
+	def _tick_performance(self, chain: int):
+		self._refresh_status()
+		with self._lock:
+			if self._performance and chain == self._performance_chain:
+				self._performance_timer = threading.Timer(PERFORMANCE_INTERVAL, self._tick_performance, args=(chain,))
+				self._performance_timer.daemon = True
+				self._performance_timer.start()
+
+	def view_trace(self):
+		# first call starts recording, the second writes a chrome trace file
+		if not METRICS.tracing:
+			METRICS.start_trace()
+			self._set_status('recording trace')
+			return
+		try:
+			path = METRICS.stop_trace()
+		except OSError as exception:
+			self._set_status(f'can not write trace: {exception}')
+			return
+		self._set_status(f'trace written to {path}')
+
+	def cancel_io(self):
+		# saves, replace all and indexing run to the end
+		self._io.cancel_all(kinds=CANCELLABLE_JOBS)
+
 	# file operations
 	def file_open(self):
 		def on_result(result: flet.FilePickerResultEvent):
 			if result.files:
-				for file in result.files:
-					self._file_to_tab(file)
+				# only the last picked file is read now, the others wait until they are shown
+				for index, file in enumerate(result.files):
+					self._file_to_tab(file, lazy=index < len(result.files) - 1)
 		dialog = flet.FilePicker(on_result=on_result)
 		self.page.overlay.append(dialog)
 		self.page.update()
 		dialog.pick_files(allow_multiple=True)
 
-	def _file_to_tab(self, picker):
-		name = picker.name
-		path = picker.path
-		size = picker.size
+	def _file_to_tab(self, picker, lazy: bool=False):
+		self.open_file(picker.path, name=picker.name, size=picker.size, lazy=lazy)
+
+	def open_file(self, path: str, *w, name: str=None, size: int=None, line: int=None, lazy: bool=False, **kw):
+		name = name if name is not None else os.path.basename(path)
+		if size is None:
+			stat = _stat(path)
+			size = stat[0] if stat is not None else 0
 		# before read or open check if path is not already in tabs
-		for tab in self._tabs.tabs:
-			if path==tab._path:
+		with self._lock:
+			if path in self._opening:
 				return
+			for index, tab in enumerate(self._tabs.tabs):
+				if path==tab._path:
+					if line is not None:
+						self.go_tab(index)
+						tab.go_to_line(line)
+					return
+			if lazy:
+				return self.new_tab(title=name,filename=name,path=path,size=size,lazy=True)
+			self._opening.add(path)
 
 		title = name
-		data = None
-		with open(path,'r') as f:
-			data = f.read()
-		self.new_tab(title=title,filename=name,data=data,path=path,size=size)
+
+		def on_done(result):
+			file_format, result = result
+			if isinstance(result, LargeFile):
+				tab = self.new_tab(title=title,filename=name,path=path,size=size,large_file=result)
+			else:
+				tab = self.new_tab(title=title,filename=name,data=result,path=path,size=size)
+			tab._format = file_format
+			tab._disk_stat = _stat(path)
+			if line is not None:
+				tab.go_to_line(line)
+			self._evict_tabs()
+			if self._pluggins is not None:
+				self._pluggins.trigger(f'open:{os.path.splitext(name)[1].lower()}', editor=self, tab=tab)
+
+		def on_error(exception):
+			self._set_status(self._open_error(name, exception))
+
+		job = self._io.load(path, large=size>=self._large_file_threshold, on_done=on_done, on_error=on_error)
+		job.future.add_done_callback(lambda future: self._opening.discard(path))
+
+	@staticmethod
+	def _open_error(name: str, exception: Exception):
+		if isinstance(exception, BinaryFile):
+			return f'{name} is a binary file'
+		return f'can not open {name}: {exception}'
 
 	def file_save(self, after_save: callable=None):
 		tab = self.active_tab()
 		if tab is None:
 			return 
 		if tab._path == '':
-			if tab._size>0:
+			if not tab.loaded and tab._source is not None:
+				self._set_status(f'{tab._title} is still loading')  # restored unsaved content, nothing to write yet
+			elif tab.modified or tab._chars > 0:
 				self.file_save_as(after_save=after_save)
 			else:
 				if after_save is not None:
 					after_save()
-		else:
-			with open(tab._path,'w') as file:
-				file.write(tab.get_data())
+		elif tab._read_only or not tab.loaded:
 			if after_save is not None:
 				after_save()
+		else:
+			self._write_to_file(tab, tab._path, after_save=after_save)
 
 	def file_save_as(self,after_save: callable=None):
 		tab = self.active_tab()
@@ -350,18 +995,66 @@ class Editor(flet.UserControl):
 				name = os.path.basename(path)
 				tab.set_filename(name)
 				tab.set_path(path)
-				with open(path,'w') as file:
-					file.write(tab.get_data())
-				if after_save is not None:
-					after_save()
+				self._write_to_file(tab, path, after_save=after_save)
 		dialog = flet.FilePicker(on_result=on_result)
 		self.page.overlay.append(dialog)
 		self.page.update()
 		dialog.save_file()
 
-	def _write_to_file(self, path, data):
-		with open(path,'w') as file:
-			file.write(data)
+	def _write_to_file(self, tab, path, after_save: callable=None):
+		dirty, tab._dirty = tab._dirty, DirtyRanges()
+
+		def on_done(result):
+			tab._disk_stat = _stat(path)
+			self._set_status(f'saved {os.path.basename(path)}')
+			self._save_session()
+			if self._watcher is not None:
+				self._watcher.watch(path)
+			self._events.publish('saved', tab, path)
+			if after_save is not None:
+				after_save()
+
+		def on_error(exception):
+			tab._dirty.add(0, len(tab._buffer))
+			self._set_status(f'can not save {os.path.basename(path)}: {exception}')
+			if isinstance(exception, UnicodeEncodeError) and not tab._read_only:
+				self._encoding_dialog(tab, path, after_save=after_save)
+
+		if tab._read_only:
+			# large and hex tabs copy the mapped bytes, decoded text or a hex dump would not give the file back
+			return self._io.write(path, tab._large_file.iter_bytes(), on_done=on_done, on_error=on_error, total=tab._size, binary=True)
+		start = self._incremental_start(tab, path, dirty)
+		if start is not None:
+			return self._io.write_tail(path, tab.get_data(), start, on_done=on_done, on_error=on_error, file_format=tab._format)
+		return self._io.write(path, tab.iter_data(), on_done=on_done, on_error=on_error, total=tab._chars, file_format=tab._format)
+
+	def _encoding_dialog(self, tab, path: str, after_save: callable=None):
+		# typed characters the file encoding can not hold, the tab switches to utf-8 only when asked
+		def on_close(e):
+			dialog.open = False
+			self.page.update()
+			if e.control.text == 'save as utf-8':
+				tab._format = Format('utf-8', newline=tab._format.newline, exact=False)  # the bytes on disk are not the ones read anymore
+				self._write_to_file(tab, path, after_save=after_save)
+
+		dialog = flet.AlertDialog(modal=True, title=flet.Text('can not save', text_align=flet.TextAlign.CENTER),
+			content=flet.Text(f'{os.path.basename(path)} has characters {tab._format.encoding} can not hold'),
+			actions=[flet.ElevatedButton('save as utf-8', on_click=on_close), flet.ElevatedButton('cancel', on_click=on_close)])
+		self.page.dialog = dialog
+		dialog.open = True
+		self.page.update()
+
+	def _incremental_start(self, tab, path, dirty):
+		# only the tail after the first dirty offset is rewritten, when the file on disk is still the one we loaded
+		start = dirty.first()
+		if tab._read_only or start is None or not tab._format.exact:
+			return None  # the kept bytes are only known when the text read encodes back to them
+		if path != tab._path or tab._disk_stat is None or tab._disk_stat != _stat(path):
+			return None
+		chars = len(tab._buffer)
+		if chars < INCREMENTAL_SAVE_SIZE or chars - start > chars * INCREMENTAL_SAVE_RATIO:
+			return None
+		return start
 
 	def _save_as_android(self,tab,after_save: callable=None):
 		def on_result(e):
@@ -372,10 +1065,7 @@ class Editor(flet.UserControl):
 				print('path:',path,'filename:',filename,'folder:',folder)
 				tab.set_filename(filename)
 				tab.set_path(path)
-				with open(path,'w') as file:
-					file.write(tab._textfield.value)
-				if after_save is not None:
-					after_save()
+				self._write_to_file(tab, path, after_save=after_save)
 		picker = AndroidFilePicker(tab,on_result=on_result)
 
 	# edit menu
@@ -387,25 +1077,250 @@ class Editor(flet.UserControl):
 	
 	def edit_paste(self):
 		pass
+
+	def edit_undo(self, native: bool=False):
+		# native: the key the field already handled when it has the focus
+		tab = self.active_tab()
+		if tab is None or (native and tab.focused):
+			return
+		if not tab.undo():
+			self._set_status('nothing to undo')
+
+	def edit_redo(self, native: bool=False):
+		tab = self.active_tab()
+		if tab is None or (native and tab.focused):
+			return
+		if not tab.redo():
+			self._set_status('nothing to redo')
 	
 	def edit_find(self):
-		pass
+		self._find_dialog()
 	
 	def edit_replace(self):
-		pass
+		self._find_dialog(replace=True)
+
+	def _find_dialog(self, replace: bool=False):
+		tab = self.active_tab()
+		if tab is None:
+			return
+
+		# large files are searched in their mapping, the query is encoded like the file
+		encoding = tab._format.encoding if tab._read_only and not tab.hex else 'utf-8'
+		confirmed = None  # (query, replacement, case, regex) a replace all on disk was confirmed for
+
+		def searcher():
+			try:
+				return Searcher(query.value, case=case.value, regex=regex.value, encoding=encoding)
+			except re.error as exception:
+				show(f'invalid regex: {exception}')
+			except UnicodeEncodeError:
+				show(f'not found, the file is {encoding}')
+
+		def show(message: str):
+			result.value = message
+			if result.page is not None:
+				result.update()
+
+		def show_match():
+			matches = tab._matches
+			if matches is None or len(matches) == 0:
+				show('no matches')
+				return
+			start, end = matches[tab._match_index]
+			show(f'{tab._match_index + 1}/{len(matches)} line {tab.line_of(start) + 1}')
+			tab.reveal(start)
+
+		def search(then: callable):
+			_searcher = searcher()
+			if _searcher is None or not _searcher.query:
+				return
+
+			def on_done(matches):
+				tab._matches = MatchSet(_searcher, matches)
+				tab._match_index = -1
+				then()
+			self._io.submit('find', tab._title, lambda progress: tab.find(_searcher, progress), on_done=on_done,
+				on_error=lambda exception: show(f'{exception}'))
+
+		def is_current():
+			matches = tab._matches
+			return matches is not None and (matches.searcher.query, matches.searcher.case, matches.searcher.regex) == (query.value, case.value, regex.value)
+
+		def on_next(event=None):
+			if not is_current():
+				search(on_next)
+				return
+			if len(tab._matches) > 0:
+				tab._match_index = (tab._match_index + 1) % len(tab._matches)
+			show_match()
+
+		def on_replace(event):
+			if tab._read_only:
+				show('read only, use replace all')
+				return
+			if not is_current() or tab._match_index < 0:
+				on_next()
+				return
+			start, end = tab._matches[tab._match_index]
+			data = tab.get_data()
+			tab.replace(start, end - start, tab._matches.searcher.expand(data, start, replacement.value))
+			tab._match_index -= 1
+			on_next()
+
+		def on_replace_all(event):
+			nonlocal confirmed
+			_searcher = searcher()
+			if _searcher is None or not _searcher.query:
+				return
+			text = replacement.value or ''
+
+			if tab.hex:
+				show('hex view is read only')
+				return
+			if tab._read_only:
+				# the file on disk is rewritten at once, without save or undo, so the first click only asks
+				request = (query.value, text, case.value, regex.value)
+				if confirmed != request:
+					confirmed = request
+					show(f'this rewrites {tab._title} on disk and can not be undone, press all again to replace')
+					return
+				confirmed = None
+				# stream the file through the replacer into a temp file, nothing is held in memory
+				# encoded with the format it was read with, bom and line endings included
+				def run(progress):
+					progress(0, tab._large_file.size)
+					chunks = _searcher.replace_stream(tab._large_file.iter_text(), text)
+					atomic_write(tab._path, tab._format.encode(chunks), progress=progress, binary=True)
+					return LargeFile(tab._path, encoding=tab._format.encoding)
+
+				def on_done(large_file):
+					tab.set_large_file(large_file)
+					show('replaced')
+			else:
+				data = tab.get_data()
+
+				def run(progress):
+					return ''.join(_searcher.replace_stream(chunked(data), text))
+
+				def on_done(data):
+					tab.set_data(data)
+					show('replaced')
+			self._io.submit('replace', tab._title, run, on_done=on_done, on_error=lambda exception: show(f'{exception}'))
+
+		def close(event=None):
+			dialog.open = False
+			self.page.update()
+
+		query = flet.TextField(label='find', keyboard_type=flet.KeyboardType.TEXT, on_submit=on_next)
+		replacement = flet.TextField(label='replace', keyboard_type=flet.KeyboardType.TEXT, visible=replace)
+		case = flet.Checkbox(label='match case', value=True)
+		regex = flet.Checkbox(label='regex', value=False)
+		result = flet.Text(text_align=flet.TextAlign.CENTER)
+		view = flet.Column([query, replacement, flet.Row([case, regex]), result], tight=True)
+		actions = [flet.IconButton(icon=flet.icons.SEARCH, on_click=on_next)]
+		if replace:
+			actions.append(flet.IconButton(icon=flet.icons.FIND_REPLACE, on_click=on_replace))
+			actions.append(flet.ElevatedButton('all', on_click=on_replace_all))
+		dialog = flet.AlertDialog(modal=False, title=flet.Text('replace' if replace else 'find', text_align=flet.TextAlign.CENTER),
+			content=view, actions=actions, actions_alignment=flet.MainAxisAlignment.CENTER)
+		self.page.dialog = dialog
+		dialog.open = True
+		self.page.update()
+		query.focus()
+
+	def edit_find_in_folder(self):
+		def on_result(e):
+			if e.path:
+				self._find_in_folder_dialog(e.path)
+		picker = flet.FilePicker(on_result=on_result)
+		self.page.overlay.append(picker)
+		self.page.update()
+		picker.get_directory_path()
+
+	def _folder_index(self, folder: str):
+		# searched folders get a trigram index, refreshed in the background from mtimes and sizes
+		index = self._indexes.get(folder)
+		if index is None:
+			index = self._indexes[folder] = TrigramIndex(folder)
+		self._io.submit('index', folder, index.update, on_error=lambda exception: self._set_status(f'can not index {folder}: {exception}'))
+		return index
+
+	def _find_in_folder_dialog(self, folder: str):
+		job = None
+		shown = 0
+		index = self._folder_index(folder)
+
+		def show(message: str):
+			result.value = message
+			if result.page is not None:
+				result.update()
+
+		def on_hit(path, hits):
+			# results stream in while the pool keeps scanning, the list stays bounded
+			nonlocal shown
+			controls = []
+			for line, column, preview in hits[:max(0, MAX_FOLDER_HITS - shown)]:
+				controls.append(flet.ListTile(dense=True, title=flet.Text(f'{os.path.relpath(path, folder)}:{line + 1}'),
+					subtitle=flet.Text(preview, no_wrap=True), on_click=lambda e, path=path, line=line: open_hit(path, line)))
+			shown += len(controls)
+			hits_view.controls.extend(controls)
+			if controls and hits_view.page is not None:
+				hits_view.update()
+
+		def open_hit(path: str, line: int):
+			close()
+			self.open_file(path, line=line)
+
+		def on_search(event=None):
+			nonlocal job, shown
+			if job is not None:
+				job.cancel()
+			try:
+				searcher = Searcher(query.value, case=case.value, regex=regex.value)
+			except re.error as exception:
+				show(f'invalid regex: {exception}')
+				return
+			if not searcher.query:
+				return
+			shown = 0
+			hits_view.controls.clear()
+			hits_view.update()
+			show('searching...')
+			paths = index.candidates(searcher.query, case=searcher.case, regex=searcher.regex)
+			job = self._io.submit('find', folder, lambda progress: find_in_folder(folder, searcher, on_hit, progress=progress, paths=paths),
+				on_done=lambda scanned: show(f'{shown} hits in {scanned} files'), on_error=lambda exception: show(f'{exception}'))
+
+		def close(event=None):
+			if job is not None:
+				job.cancel()
+			dialog.open = False
+			self.page.update()
+
+		query = flet.TextField(label=f'find in {folder}', keyboard_type=flet.KeyboardType.TEXT, on_submit=on_search)
+		case = flet.Checkbox(label='match case', value=True)
+		regex = flet.Checkbox(label='regex', value=False)
+		result = flet.Text(text_align=flet.TextAlign.CENTER)
+		hits_view = flet.ListView(expand=True, height=400, width=600)
+		view = flet.Column([query, flet.Row([case, regex]), result, hits_view], tight=True)
+		dialog = flet.AlertDialog(modal=False, title=flet.Text('find in folder', text_align=flet.TextAlign.CENTER),
+			content=view, actions=[flet.IconButton(icon=flet.icons.SEARCH, on_click=on_search)],
+			actions_alignment=flet.MainAxisAlignment.CENTER, on_dismiss=close)
+		self.page.dialog = dialog
+		dialog.open = True
+		self.page.update()
+		query.focus()
 
 	# view
 	def _view_zoom(self, var:int=0):
 		tab = self.active_tab()
 		if tab is None:
 			return
-		size = tab._textfield.text_size
+		size = tab.get_text_size()
 		if size is None or var == 0:
-			tab._textfield.text_size = 16
+			tab.set_text_size(16)
 		else:
-			tab._textfield.text_size += var
-
-		tab._textfield.update()
+			tab.set_text_size(size + var)
+		self._save_session()
 
 	def view_zoom_in(self):
 		self._view_zoom(2)
@@ -420,7 +1335,9 @@ class Editor(flet.UserControl):
 		pass
 
 	def view_line_number(self):
-		pass
+		self._line_numbers = not self._line_numbers
+		for tab in self._tabs.tabs + self._wait_to_mount:
+			tab.set_line_numbers(self._line_numbers)
 	
 	def view_go_to(self):
 		tab = self.active_tab()
@@ -432,22 +1349,38 @@ class Editor(flet.UserControl):
 			go_button.update()
 		
 		def on_submit(event):
+			if not textfield.value:
+				return
+			if hex_view:
+				# hex views go to a byte offset, 0x for hexadecimal
+				value = textfield.value.lower()
+				try:
+					offset = int(value[2:], 16) if value.startswith('0x') else int(value)
+				except ValueError:
+					return
+				if offset < tab._size:
+					tab.go_to_offset(offset)
+					self._refresh_status()
+				close()
+				return
 			_input=int(textfield.value)
-			if _input>=0 and _input<=len(tab._data):
-				# do scroll thing
-				pass
+			if _input>=1 and _input<=tab.line_count():
+				tab.go_to_line(_input - 1)
+				self._refresh_status()
 			close()
 		
 		def close():
 			dialog.open = False
 			self.page.update()
 		
-		only_filter = flet.InputFilter('^[0-9]*')
+		hex_view = tab.loaded and tab.hex
+		only_filter = flet.InputFilter('^(0x[0-9a-fA-F]*|[0-9]*)' if hex_view else '^[0-9]*')
+		title = f'go to offset (0-{tab._size - 1:#x})' if hex_view else f'go to line (1-{tab.line_count()})'
 		textfield = flet.TextField(on_submit=on_submit,keyboard_type=flet.KeyboardType.TEXT,input_filter=only_filter,on_change=on_change)
 		view = flet.SafeArea(expand=True,content=textfield)
 
 		go_button = flet.IconButton(icon=flet.icons.FOLLOW_THE_SIGNS,on_click=on_submit,disabled=True)
-		dialog = flet.AlertDialog(modal=False,title=flet.Text(text_align=flet.TextAlign.CENTER,value='go to line'),
+		dialog = flet.AlertDialog(modal=False,title=flet.Text(text_align=flet.TextAlign.CENTER,value=title),
 			content=view,actions=[go_button],actions_alignment=flet.MainAxisAlignment.CENTER)
 		self.page.dialog = dialog
 		dialog.open = True
@@ -465,13 +1398,41 @@ class Editor(flet.UserControl):
 		pass
 	
 	def preference_syntax_highlight(self):
-		pass
+		tab = self.active_tab()
+		if tab is None:
+			return
+		if not tab.toggle_highlight():
+			self._set_status(f'no syntax highlight for {tab._title}')
+			return
+		self._tabs.update()
+		self._save_session()
 	
 	def preference_font(self):
 		pass
 	
 	def preference_pluggin(self):
-		pass
+		if self._pluggins is None:
+			return
+
+		def close(event=None):
+			dialog.open = False
+			self.page.update()
+
+		rows = []
+		for name, loaded, load_time, error in self._pluggins.report():
+			if error is not None:
+				state = f'error: {error}'
+			elif loaded:
+				state = f'loaded in {load_time * 1000:.1f} ms'
+			else:
+				state = 'waiting for its activation event'
+			rows.append(flet.Text(f'{name}: {state}'))
+		dialog = flet.AlertDialog(modal=False, title=flet.Text('pluggins', text_align=flet.TextAlign.CENTER),
+			content=flet.Column(rows or [flet.Text('no pluggins')], tight=True, scroll=flet.ScrollMode.AUTO),
+			actions=[flet.ElevatedButton('close', on_click=close)])
+		self.page.dialog = dialog
+		dialog.open = True
+		self.page.update()
 
 
 class AndroidFilePickerResult:
@@ -492,6 +1453,7 @@ class AndroidFilePicker:
 		self._dismiss_dialog = flet.Ref[flet.AlertDialog]()
 		self._filename_dialog = flet.Ref[flet.AlertDialog]()
 		self._overwrite_dialog = flet.Ref[flet.AlertDialog]()
+		self._names = None  # files in the chosen folder, listed once so typing a name does not hit the disk
 
 		self.__get_folder()
 
@@ -508,6 +1470,7 @@ class AndroidFilePicker:
 		def on_result(e):
 			if e.path:
 				self._folder = e.path
+				self._names = self.__list_folder()
 				self.__get_filename()
 
 		picker = flet.FilePicker(on_result=on_result)
@@ -528,24 +1491,36 @@ class AndroidFilePicker:
 		self._page.update()
 
 	def __get_filename(self):
-		title = flet.Text(value='filename',text_align=flet.TextAlign.CENTER)
-		textfield = flet.TextField(ref=self._filename_textfield,keyboard_type=flet.KeyboardType.TEXT,
-			on_change=self.__on_change_filename,on_submit=self.__on_submit_filename)
-		button = flet.IconButton(icon=flet.icons.SAVE,on_click=self.__on_submit_filename)
-		dialog = flet.AlertDialog(ref=self._filename_dialog,title=title,content=textfield,
-			actions=[button],actions_alignment=flet.MainAxisAlignment.CENTER,on_dismiss=self.__on_dismiss_filename)
+		# the dialog is built once and opened again after a refused overwrite
+		dialog = self._filename_dialog.current
+		if dialog is None:
+			title = flet.Text(value='filename',text_align=flet.TextAlign.CENTER)
+			textfield = flet.TextField(ref=self._filename_textfield,keyboard_type=flet.KeyboardType.TEXT,
+				on_change=self.__on_change_filename,on_submit=self.__on_submit_filename)
+			button = flet.IconButton(icon=flet.icons.SAVE,on_click=self.__on_submit_filename)
+			dialog = flet.AlertDialog(ref=self._filename_dialog,title=title,content=textfield,
+				actions=[button],actions_alignment=flet.MainAxisAlignment.CENTER,on_dismiss=self.__on_dismiss_filename)
 		self.__open_dialog(dialog)
-		textfield.focus()
+		self._filename_textfield.current.focus()
 
 	def __on_change_filename(self, event):
-		if self.__file_exists(event.data):
-			event.control.error_text = 'file already exists!'
-		else:
-			event.control.error_text = None
-		event.control.update()
+		error_text = 'file already exists!' if self.__file_exists(event.data) else None
+		if event.control.error_text != error_text:
+			event.control.error_text = error_text
+			event.control.update()
+
+	def __list_folder(self):
+		try:
+			with os.scandir(self._folder) as entries:
+				return {entry.name for entry in entries if entry.is_file()}
+		except OSError:
+			return None
 
-	def __file_exists(self, filename:str):
-		return os.path.isfile(f'{self._folder}/{filename}')
+	def __file_exists(self, filename:str, fresh: bool=False):
+		# fresh: ask the disk, the listing may be older than the file
+		if fresh or self._names is None:
+			return os.path.isfile(f'{self._folder}/{filename}')
+		return filename in self._names
 	
 	def __on_dismiss_filename(self, event):
 		self.__close_dialog(self._filename_dialog.current)
@@ -573,7 +1548,7 @@ class AndroidFilePicker:
 	def __on_submit_filename(self, event):
 		self._filename = self._filename_textfield.current.value
 		self.__close_dialog(self._filename_dialog.current)
-		if self.__file_exists(self._filename):
+		if self.__file_exists(self._filename, fresh=True):
 			self.__get_overwrite()
 		else:
 			self.__on_result()
@@ -601,34 +1576,605 @@ class AndroidFilePicker:
 		self.__on_result()
 
 
+class Viewport(flet.UserControl):
+	def __init__(self, source, *w, visible_lines: int=60, overscan: int=30, text_size: int=None, highlighter: Highlighter=None, **kw):
+		super(Viewport, self).__init__(*w, **kw)
+		# source: any object with get_lines(first, count) and line_count()
+		self._source = source
+		self._highlighter = highlighter
+		self._visible_lines = visible_lines
+		self._overscan = overscan
+		self._text_size = text_size
+		self._first_line = 0
+		self._window_first = 0
+		self._window = []
+		self._scroll_rest = 0.0
+		self.expand = True
+		self._rows = [flet.Text(no_wrap=True, selectable=True, font_family='monospace', size=text_size) for _ in range(visible_lines)]
+		self._numbers = [flet.Text(font_family='monospace', size=text_size, color='grey', text_align=flet.TextAlign.RIGHT) for _ in range(visible_lines)]
+		self._gutter = flet.Column(self._numbers, spacing=0, visible=False)
+		self._render()
+
+	def build(self):
+		column = flet.Column(self._rows, spacing=0, expand=True)
+		row = flet.Row([self._gutter, column], expand=True, vertical_alignment=flet.CrossAxisAlignment.START)
+		return flet.GestureDetector(content=row, expand=True, on_scroll=self._on_scroll, on_vertical_drag_update=self._on_drag)
+
+	def set_line_numbers(self, value: bool):
+		self._gutter.visible = value
+		self._render()
+		if self.page is not None:
+			self.update()
+
+	@property
+	def first_line(self):
+		return self._first_line
+
+	def at_end(self):
+		return self._first_line + self._visible_lines >= self._source.line_count()
+
+	def follow(self):
+		# keep the last lines in view, like tail -f
+		self.scroll_to(max(0, self._source.line_count() - self._visible_lines))
+
+	@property
+	def text_size(self):
+		return self._text_size
+
+	@text_size.setter
+	def text_size(self, value: int):
+		self._text_size = value
+		for row in self._rows + self._numbers:
+			row.size = value
+
+	def _line_height(self):
+		return (self._text_size or 14) * 1.4
+
+	def _on_scroll(self, e):
+		self._scroll_by(e.scroll_delta_y)
+
+	def _on_drag(self, e):
+		self._scroll_by(-e.delta_y)
+
+	def _scroll_by(self, pixels: float):
+		self._scroll_rest += pixels
+		lines = int(self._scroll_rest / self._line_height())
+		if lines != 0:
+			self._scroll_rest -= lines * self._line_height()
+			self.scroll_to(self._first_line + lines)
+
+	def scroll_to(self, line: int):
+		line = max(0, min(line, self._source.line_count() - 1))
+		if line == self._first_line:
+			return
+		self._first_line = line
+		self._render()
+		if self.page is not None:
+			self.update()
+
+	def set_highlighter(self, highlighter: Highlighter=None):
+		self._highlighter = highlighter
+		self._render()
+		if self.page is not None:
+			self.update()
+
+	def refresh(self, source=None):
+		# the source changed, drop the cached window
+		if source is not None:
+			self._source = source
+			if self._highlighter is not None:
+				self._highlighter.set_source(source)
+		self._window = []
+		self._window_first = 0
+		self._render()
+
+	def _render(self):
+		first = self._first_line
+		end = min(first + self._visible_lines, self._source.line_count())
+		if first < self._window_first or end > self._window_first + len(self._window):
+			# outside the overscan margin, decode a new window around the visible lines
+			self._window_first = max(0, first - self._overscan)
+			self._window = self._source.get_lines(self._window_first, self._visible_lines + 2 * self._overscan)
+		texts = self._window[first - self._window_first:first - self._window_first + len(self._rows)]
+		if self._gutter.visible:
+			# the gutter is just the visible line numbers
+			for index, number in enumerate(self._numbers):
+				number.value = str(first + index + 1) if index < len(texts) else ''
+		texts += [''] * (len(self._rows) - len(texts))
+		if self._highlighter is None:
+			for row, text in zip(self._rows, texts):
+				row.spans = None
+				row.value = text
+			return
+		# only the visible lines are highlighted
+		for row, text, spans in zip(self._rows, texts, self._highlighter.highlight(first, texts)):
+			row.value = None
+			row.spans = self._spans(text, spans)
+
+	@staticmethod
+	def _spans(text: str, spans: list):
+		result = []
+		position = 0
+		for start, end, kind in spans:
+			if start > position:
+				result.append(flet.TextSpan(text[position:start]))
+			result.append(flet.TextSpan(text[start:end], style=flet.TextStyle(color=THEME.get(kind))))
+			position = end
+		if position < len(text):
+			result.append(flet.TextSpan(text[position:]))
+		return result
+
+
 class Tab(flet.Tab):
-	def __init__(self, *w, title: str='', data: str='', filename: str='', path:str='', size: int=0, **kw):
+	def __init__(self, *w, title: str='', data: str='', filename: str='', path:str='', size: int=0, large_file: LargeFile=None, lazy: bool=False, **kw):
+		# lazy: only the metadata is kept until load() gets the content of path
 		super(Tab, self).__init__(*w, **kw)
 		self._title = title
-		self._data = data
-		self._chars = len(data)
+		self._dirty = DirtyRanges()  # edits since the last save
+		self._history = History(spill=True)
+		self._disk_stat = None  # (size, mtime) of the file when it was loaded or saved
+		self._format = Format()  # encoding and line ending the file is saved with
+		self._matches = None  # MatchSet of the last find, kept up to date while typing
+		self._highlighter = None
+		self._line_total = 0  # line count seen by the highlighter
+		self._match_index = -1
 		self._filename = filename
 		self._path = path
-		self._size = size if size>0 else len(data)
+		self._size = size if size>0 else (len(data) if large_file is None else large_file.size)
 		# flet
 		
-		self._textfield = flet.TextField(keyboard_type=flet.KeyboardType.TEXT,multiline=True,min_lines=1000,expand=True,value=data, on_change=self._on_textfield_change)
-		self._tab_content = flet.Tooltip(message=f'size: {size_fmt(self._size)}\npath: {path}\nchars: {self._size}', content=flet.Text(self._title))
+		self._cursor = 0  # end of the last edit, flet does not report the caret
+		self._line_numbers = False
+		self._gutter_lines = 0
+		self._text_size = None  # kept while unloaded
+		self._highlight = False  # restored on load
+		self._pending_line = None  # go to line asked before the content arrived
+		self._pending_column = 0
+		self._focused = False  # the field has the keyboard focus
+		self._generation = 0  # bumped on every edit, the session rewrites a buffer only when it moved
+		self._session_id = 0  # id of the unsaved content kept by the session
+		self._source = None  # session copy of unsaved content, loaded instead of path
+		self.on_edit = None  # called with the tab after every edit
+		self.on_delta = None  # called with the tab and (offset, removed, inserted) of every buffer edit
+		self._placeholder = flet.Container()
+		self._loading = flet.Container(content=flet.Text('loading...', color='grey'), alignment=flet.alignment.center, expand=True)
+		self._loaded = not lazy
+		if lazy:
+			self._clear()
+		else:
+			self._build(data, large_file)
+		self._tab_content = flet.Tooltip(message=self._tooltip(), content=flet.Text(self._title))
 		self.tab_content=self._tab_content
-		self.content=self._textfield
+		self.content=self._view
+
+	def _build(self, data: str, large_file: LargeFile):
+		self._focused = False
+		self._large_file = large_file
+		self._decoder = None  # incremental decoder of what is appended on disk
+		self._held = ''  # trailing \r of the last append
+		self._read_only = large_file is not None
+		self._buffer = PieceTable(data)
+		self._chars = len(self._buffer)
+		self._size = large_file.size if self._read_only else self._chars
+		if self._read_only:
+			self._textfield = None
+			self._edit_view = None
+			self._view = Viewport(large_file, text_size=self._text_size)
+		else:
+			self._textfield = flet.TextField(keyboard_type=flet.KeyboardType.TEXT,multiline=True,min_lines=1,value=data,
+				text_size=self._text_size, text_style=flet.TextStyle(height=EDIT_LINE_HEIGHT), content_padding=0, border=flet.InputBorder.NONE,
+				on_change=self._on_textfield_change, on_focus=self._on_textfield_focus, on_blur=self._on_textfield_focus)
+			# like the colors, the gutter only holds the numbers of the drawn window, pushed down to their lines
+			self._gutter = flet.Container(flet.Text(color='grey', text_align=flet.TextAlign.RIGHT, font_family='monospace',
+				style=flet.TextStyle(height=EDIT_LINE_HEIGHT)), visible=False)
+			# highlighting draws the visible lines in color under the field and makes the field's own text transparent
+			self._color_rows = []
+			self._colors = flet.Container(flet.Column(spacing=0), visible=False)
+			self._window = (0, 0)  # first line and line count drawn under the field
+			self._scroll = (0.0, 0.0)  # pixels scrolled and height of the edit view, from its last scroll event
+			# the column scrolls instead of the field, so go to line can scroll to an offset
+			self._edit_row = flet.Row([self._gutter, flet.Stack([self._colors, self._textfield], expand=True)],
+				vertical_alignment=flet.CrossAxisAlignment.START)
+			self._edit_view = flet.Column([self._edit_row], scroll=flet.ScrollMode.AUTO, expand=True,
+				on_scroll=self._on_edit_scroll, on_scroll_interval=EDIT_SCROLL_INTERVAL)
+			self._view = self._edit_view
+		if self._line_numbers:
+			self.set_line_numbers(True)
+
+	def _clear(self):
+		self._focused = False
+		self._large_file = None
+		self._read_only = False
+		self._buffer = PieceTable()
+		self._chars = 0
+		self._textfield = None
+		self._edit_view = None
+		self._view = self._loading
+		self._matches = None
+		self._highlighter = None
+
+	@property
+	def loaded(self):
+		return self._loaded
+
+	@property
+	def modified(self):
+		return bool(self._dirty)
+
+	@property
+	def focused(self):
+		return self._focused
+
+	@property
+	def hex(self):
+		return isinstance(self._large_file, HexFile)
+
+	def memory(self):
+		# rough chars held in memory, a large file only holds its line index
+		if not self._loaded:
+			return 0
+		if self._read_only:
+			return self._large_file.memory()
+		return self._buffer.memory() + self._history.size
+
+	def load(self, content):
+		# content: the text of path or a LargeFile
+		if isinstance(content, LargeFile):
+			self._build('', content)
+		else:
+			self._build(content, None)
+		self._loaded = True
+		if self._highlight:
+			self.toggle_highlight()
+		if self._pending_line is not None:
+			self.go_to_line(self._pending_line, self._pending_column)
+			self._pending_line = None
+			self._pending_column = 0
+		if self.content is not self._placeholder:
+			self.show()
+		self._update_tooltip()
+
+	def unload(self):
+		# back to metadata only, the content is read again from path when the tab is shown
+		if not self._loaded or self.modified or not self._path:
+			return False
+		self._text_size = self.get_text_size()
+		self._highlight = self._highlighter is not None
+		if self._large_file is not None:
+			self._large_file.close()
+		self._clear()
+		self._loaded = False
+		if self.content is not self._placeholder:
+			self.show()
+		return True
 	
 	def _on_textfield_change(self, e):
-		self._size = len(e.data)
-		self._data = e.data
+		start = time.perf_counter()
+		delta = self._buffer.diff(e.data)
+		if delta is not None:
+			offset, removed, inserted = delta
+			self._history.record(offset, self._buffer.get_text(offset, offset + removed), inserted)
+			self._buffer.replace(*delta)
+		self._apply(delta, e.data)
 		self._update_tooltip()
+		if self.on_edit is not None:
+			self.on_edit(self)
+		METRICS.record('change', start)
+
+	def _on_textfield_focus(self, e):
+		self._focused = e.name == 'focus'
+
+	def _replay(self, edits: list):
+		# undo / redo steps, the field is sent once for the whole transaction
+		if not edits:
+			return False
+		for offset, length, text in edits:
+			self._buffer.replace(offset, length, text)
+			self._apply((offset, length, text), None)
+		data = self._buffer.get_data()
+		if self._matches is not None:
+			self._matches = None  # offsets of the last find no longer match
+		self._textfield.value = data
+		if self._textfield.page is not None:
+			self._textfield.update()
+		self._update_tooltip()
+		if self.on_edit is not None:
+			self.on_edit(self)
+		return True
+
+	def undo(self):
+		if self._read_only:
+			return False
+		return self._replay(self._history.undo())
+
+	def redo(self):
+		if self._read_only:
+			return False
+		return self._replay(self._history.redo())
+
+	def _apply(self, delta, data: str):
+		if delta is not None:
+			self._dirty.edit(*delta)
+			if self._matches is not None and data is not None:
+				self._matches.edit(*delta, data)
+			if self._highlighter is not None:
+				offset, removed, inserted = delta
+				total = self._buffer.line_count()
+				inserted_lines = inserted.count('\n')
+				self._highlighter.edit(self._buffer.line_of(offset), inserted_lines - (total - self._line_total), inserted_lines)
+				self._line_total = total
+			self._cursor = delta[0] + len(delta[2])
+			self._generation += 1
+			if self.on_delta is not None:
+				self.on_delta(self, delta)
+			if self._highlighter is not None or (self._line_numbers and self._gutter_lines != self._buffer.line_count()):
+				self._refresh_window()
+		self._chars = len(self._buffer)
+		self._size = self._chars
+
+	def _line_height(self):
+		return (self._textfield.text_size or EDIT_TEXT_SIZE) * EDIT_LINE_HEIGHT
+
+	def _edit_window(self, force: bool=False):
+		# lines to draw around the visible ones, None while the drawn window still covers them
+		height = self._line_height()
+		pixels, viewport = self._scroll
+		top = int(pixels / height)
+		visible = int(viewport / height) + 1 if viewport > 0 else EDIT_VISIBLE_LINES
+		first, count = self._window
+		total = self._buffer.line_count()
+		if not force and count > 0 and first <= top and (top + visible <= first + count or first + count >= total):
+			return None
+		first = max(0, top - EDIT_OVERSCAN)
+		return first, min(visible + 2 * EDIT_OVERSCAN, total - first)
+
+	def _on_edit_scroll(self, e):
+		self._scroll = (e.pixels, e.viewport_dimension)
+		if (self._highlighter is not None or self._line_numbers) and self._edit_window() is not None:
+			self._refresh_window()
+
+	def _refresh_window(self):
+		UPDATES.schedule(self._edit_row, self._render_window)
+
+	def _render_window(self):
+		# gutter and colors only cover the window around the visible lines, whatever the document size
+		if self._textfield is None:
+			return
+		first, count = self._window = self._edit_window(force=True)
+		size = self._textfield.text_size or EDIT_TEXT_SIZE
+		top = flet.padding.only(top=first * self._line_height())
+		self._gutter.visible = self._line_numbers
+		if self._line_numbers:
+			self._gutter_lines = self._buffer.line_count()
+			numbers = self._gutter.content
+			numbers.value = '\n'.join(map(str, range(first + 1, first + count + 1)))
+			numbers.size = size
+			self._gutter.width = len(str(self._gutter_lines)) * size * GUTTER_DIGIT_WIDTH
+			self._gutter.padding = top
+		self._render_colors(first, size, top, self._buffer.get_lines(first, count) if self._highlighter is not None else [])
+
+	def _render_colors(self, first: int, size: int, top: flet.Padding, texts: list):
+		# the lines highlighted from the highlighter's checkpoints
+		self._colors.visible = self._highlighter is not None
+		if self._highlighter is None:
+			self._color_rows.clear()
+			self._colors.content.controls = self._color_rows
+			return
+		while len(self._color_rows) < len(texts):
+			self._color_rows.append(flet.Text(style=flet.TextStyle(height=EDIT_LINE_HEIGHT)))
+		for row, text, spans in zip(self._color_rows, texts, self._highlighter.highlight(first, texts)):
+			row.spans = Viewport._spans(text, spans) or None
+			row.value = None if row.spans else ''
+			row.size = size
+			row.visible = True
+		for row in self._color_rows[len(texts):]:
+			row.spans = None
+			row.visible = False
+		self._colors.content.controls = self._color_rows
+		self._colors.padding = top
+
+	def _tooltip(self):
+		message = f'size: {size_fmt(self._size)}\npath: {self._path}\nchars: {self._size}'
+		if self.hex:
+			message += f'\nrows: {self._large_file.line_count()}\nmode: hex, read only'
+		elif self._read_only:
+			message += f'\nlines: {self._large_file.line_count()}\nmode: read only'
+		return message
 
 	def _update_tooltip(self):
-		self._tab_content.message = f'size: {size_fmt(self._size)}\npath: {self._path}\nchars: {self._size}'
+		UPDATES.schedule(self._tab_content, self._render_tooltip)
+
+	def _render_tooltip(self):
+		self._tab_content.message = self._tooltip()
 		self._tab_content.content.value=self._title
-		self._tab_content.update()
+
+	def show(self):
+		self.content = self._view
+
+	def set_line_numbers(self, value: bool):
+		self._line_numbers = value
+		if isinstance(self._view, Viewport):
+			self._view.set_line_numbers(value)
+		if self._textfield is not None:
+			self._refresh_window()
+
+	def toggle_highlight(self):
+		# large files color their viewport, editable tabs stay editable with the colors drawn under the field
+		if not self._loaded or self.hex:
+			return False
+		if self._highlighter is None:
+			lexer = lexer_for(self._filename or self._title)
+			if lexer is None:
+				return False
+			source = self._large_file if self._read_only else self._buffer
+			self._highlighter = Highlighter(source, lexer)
+			self._line_total = self._buffer.line_count()
+		else:
+			self._highlighter = None
+		if self._read_only:
+			self._view.set_highlighter(self._highlighter)
+			return True
+		self._textfield.color = None if self._highlighter is None else flet.colors.TRANSPARENT
+		self._render_window()
+		if self._edit_view.page is not None:
+			self._edit_view.update()
+		return True
+
+	def hide(self):
+		self.content = self._placeholder
+
+	def close(self):
+		self._history.close()
+		if self._large_file is not None:
+			self._large_file.close()
+
+	def focus(self):
+		if self._textfield is not None and self._textfield.page is not None:
+			self._textfield.focus()
+
+	def get_text_size(self):
+		if not self._loaded:
+			return self._text_size
+		if self._view is self._edit_view:
+			return self._textfield.text_size
+		return self._view.text_size
+
+	def set_text_size(self, value: int):
+		if not self._loaded:
+			self._text_size = value
+			return
+		if self._view is self._edit_view:
+			self._textfield.text_size = value
+			self._render_window()
+		else:
+			self._view.text_size = value
+		if self._view.page is not None:
+			self._view.update()
 
 	def get_data(self):
-		return self._textfield.value
+		if self._read_only:
+			return ''.join(self._large_file.iter_text())
+		return self._buffer.get_data()
+
+	def set_data(self, data: str):
+		delta = self._buffer.diff(data)
+		if delta is not None:
+			offset, removed, inserted = delta
+			self._history.begin()
+			self._history.record(offset, self._buffer.get_text(offset, offset + removed), inserted)
+			self._history.end()
+			self._buffer.replace(*delta)
+		self._apply(delta, data)
+		self._textfield.value = data
+		if self._textfield.page is not None:
+			self._textfield.update()
+		self._update_tooltip()
+
+	def replace(self, offset: int, length: int, text: str):
+		self._history.begin()
+		self._history.record(offset, self._buffer.get_text(offset, offset + length), text)
+		self._history.end()
+		self._buffer.replace(offset, length, text)
+		data = self._buffer.get_data()
+		self._apply((offset, length, text), data)
+		self._textfield.value = data
+		if self._textfield.page is not None:
+			self._textfield.update()
+		self._update_tooltip()
+
+	def append(self, text: str=None):
+		# data appended to the file on disk, the tab stays unmodified and its history valid
+		if self._read_only:
+			following = self._view.at_end()
+			if self._large_file.extend() is None:
+				return
+			self._size = self._large_file.size
+			self._view.refresh()
+			if following:
+				self._view.follow()
+			if self._view.page is not None:
+				self._view.update()
+			self._update_tooltip()
+			return
+		clean = not self.modified
+		offset = len(self._buffer)
+		self._buffer.insert(offset, text)
+		data = self._buffer.get_data()
+		self._apply((offset, 0, text), data)
+		if clean:
+			self._dirty.clear()
+		self._textfield.value = data
+		if self._textfield.page is not None:
+			self._textfield.update()
+		self._update_tooltip()
+		if self.on_edit is not None:
+			self.on_edit(self)
+
+	def set_large_file(self, large_file: LargeFile):
+		old, self._large_file = self._large_file, large_file
+		self._view.refresh(large_file)
+		if self._view.page is not None:
+			self._view.update()
+		self._size = large_file.size
+		self._matches = None
+		self._update_tooltip()
+		old.close()
+
+	def find(self, searcher: Searcher, progress: callable=None):
+		# offsets are bytes for large files (searched in the mapping) and chars otherwise
+		if self._read_only:
+			return searcher.find(self._large_file.mapping, progress=progress)
+		return searcher.find(self._buffer.get_data(), progress=progress)
+
+	def line_of(self, offset: int):
+		if self._read_only:
+			return self._large_file.line_of(offset)
+		return self._buffer.line_of(offset)
+
+	def reveal(self, offset: int):
+		self.go_to_line(self.line_of(offset))
+
+	def line_count(self):
+		if self._read_only:
+			return self._large_file.line_count()
+		return self._buffer.line_count()
+
+	def position(self):
+		# (line, column) of the caret, the first visible line for viewports
+		if not self._loaded:
+			return 0, 0
+		if self._view is not self._edit_view:
+			return self._view.first_line, 0
+		return self._buffer.position(self._cursor)
+
+	def go_to_line(self, line: int, column: int=0):
+		# column: caret column in the edit view, past the end of the line it stops at the end
+		if not self._loaded:
+			self._pending_line = line
+			self._pending_column = column
+			return
+		line = max(0, min(line, self.line_count() - 1))
+		if self._view is not self._edit_view:
+			self._view.scroll_to(line)
+			return
+		start = self._buffer.line_start(line)
+		end = self._buffer.line_start(line + 1) - 1 if line + 1 < self.line_count() else len(self._buffer)
+		self._cursor = start + max(0, min(column, end - start))
+		if self._edit_view.page is not None:
+			self._edit_view.scroll_to(offset=line * self._line_height(), duration=0)
+
+	def go_to_offset(self, offset: int):
+		# hex view, the row holding offset becomes the first visible one
+		self.go_to_line(self._large_file.line_of(max(0, min(offset, self._size - 1))))
+
+	def offset(self):
+		return self._view.first_line * self._large_file.width
+
+	def iter_data(self):
+		# safe to consume from an io worker while the user keeps typing, chunks keep the encoded copy small
+		if self._read_only:
+			return self._large_file.iter_text()
+		return self._buffer.snapshot()
 	
 	def set_path(self, value: str):
 		self._path = value
@@ -648,16 +2194,17 @@ class TextField(flet.TextField):
 
 
 class Menu(flet.SubmenuButton):
-	def __init__(self, text: str, *w, icon=None, **kw):
+	def __init__(self, text: str, *w, icon=None, events: EventBus=None, **kw):
 		super().__init__()
+		self._events = EVENTS if events is None else events
 		self.content = flet.Text(text)
 		self.leading = flet.Icon(icon) or None
-		self.buttons = {}  # name: (ref,icon,callback)
+		self.buttons = {}  # name: (ref,icon,command)
 
-	def add_button(self, text: str, icon, on_click: callable = None):
+	def add_button(self, text: str, icon, command: str):
 		bt = flet.Ref[flet.MenuItemButton]()
-		self.buttons[text] = (bt, icon, on_click)
-		self.controls.append(flet.MenuItemButton(ref=bt, content=flet.Text(text), leading=flet.Icon(icon), on_click=on_click.call))
+		self.buttons[text] = (bt, icon, command)
+		self.controls.append(flet.MenuItemButton(ref=bt, content=flet.Text(text), leading=flet.Icon(icon), on_click=lambda event: self._events.publish(command)))
 		return bt
 
 	def del_button(self, name: str):
@@ -666,84 +2213,63 @@ class Menu(flet.SubmenuButton):
 
 
 class MenuFile(Menu):
-	def __init__(self, ):
-		super().__init__(text='File', icon=flet.icons.FILE_PRESENT)
+	def __init__(self, events: EventBus=None):
+		super().__init__(text='File', icon=flet.icons.FILE_PRESENT, events=events)
 		self.__ref = flet.Ref[flet.SubmenuButton]()
 		# file
-		self._on_new = Callback()
-		self._on_open = Callback()
-		self._on_save = Callback()
-		self._on_save_as = Callback()
-		self._on_close = Callback()
-
-		self.add_button('New', flet.icons.CREATE, self._on_new)
-		self.add_button('Open', flet.icons.FILE_OPEN, self._on_open)
-		self.add_button('Save', flet.icons.SAVE, self._on_save)
-		self.add_button('Save as', flet.icons.SAVE_AS, self._on_save_as)
-		self.add_button('Close', flet.icons.CLOSE, self._on_close)
+		self.add_button('New', flet.icons.CREATE, 'file_new')
+		self.add_button('Open', flet.icons.FILE_OPEN, 'file_open')
+		self.add_button('Save', flet.icons.SAVE, 'file_save')
+		self.add_button('Save as', flet.icons.SAVE_AS, 'file_save_as')
+		self.add_button('Close', flet.icons.CLOSE, 'file_close')
 
 
 class MenuEdit(Menu):
 
-	def __init__(self, ):
-		super().__init__(text='Edit', icon=flet.icons.EDIT)
+	def __init__(self, events: EventBus=None):
+		super().__init__(text='Edit', icon=flet.icons.EDIT, events=events)
 		self.__ref = flet.Ref[flet.SubmenuButton]()
 		# edit
-		self._on_copy = Callback()
-		self._on_cut = Callback()
-		self._on_paste = Callback()
-		self._on_find = Callback()
-		self._on_replace = Callback()
-
-		self.add_button('Copy', flet.icons.COPY, self._on_copy)
-		self.add_button('Cut', flet.icons.CUT, self._on_cut)
-		self.add_button('Paste', flet.icons.PASTE, self._on_paste)
-		self.add_button('Find', flet.icons.FIND_IN_PAGE, self._on_find)
-		self.add_button('Replace', flet.icons.FIND_REPLACE, self._on_replace)
+		self.add_button('Copy', flet.icons.COPY, 'edit_copy')
+		self.add_button('Cut', flet.icons.CUT, 'edit_cut')
+		self.add_button('Paste', flet.icons.PASTE, 'edit_paste')
+		self.add_button('Undo', flet.icons.UNDO, 'edit_undo')
+		self.add_button('Redo', flet.icons.REDO, 'edit_redo')
+		self.add_button('Find', flet.icons.FIND_IN_PAGE, 'edit_find')
+		self.add_button('Replace', flet.icons.FIND_REPLACE, 'edit_replace')
+		self.add_button('Find in folder', flet.icons.MANAGE_SEARCH, 'edit_find_in_folder')
 
 
 class MenuView(Menu):
 
-	def __init__(self, ):
-		super().__init__(text='View', icon=flet.icons.PAGEVIEW)
+	def __init__(self, events: EventBus=None):
+		super().__init__(text='View', icon=flet.icons.PAGEVIEW, events=events)
 		self.__ref = flet.Ref[flet.SubmenuButton]()
 		# view
-		self._on_zoom_in = Callback()
-		self._on_zoom_out = Callback()
-		self._on_zoom_reset = Callback()		
-		self._on_word_wrap = Callback()
-		self._on_line_number = Callback()
-		self._on_go_to = Callback()
-
-		self.add_button('Zoom in', flet.icons.ZOOM_IN, self._on_zoom_in)
-		self.add_button('Zoom out', flet.icons.ZOOM_OUT, self._on_zoom_out)
-		self.add_button('Zoom reset', flet.icons.RESET_TV, self._on_zoom_reset)
-		self.add_button('Word wrap', flet.icons.WRAP_TEXT, self._on_word_wrap)
-		self.add_button('Line number', flet.icons.NUMBERS, self._on_line_number)
-		self.add_button('Go to', flet.icons.REMOVE_RED_EYE, self._on_go_to)
+		self.add_button('Zoom in', flet.icons.ZOOM_IN, 'view_zoom_in')
+		self.add_button('Zoom out', flet.icons.ZOOM_OUT, 'view_zoom_out')
+		self.add_button('Zoom reset', flet.icons.RESET_TV, 'view_zoom_reset')
+		self.add_button('Word wrap', flet.icons.WRAP_TEXT, 'view_word_wrap')
+		self.add_button('Line number', flet.icons.NUMBERS, 'view_line_number')
+		self.add_button('Go to', flet.icons.REMOVE_RED_EYE, 'view_go_to')
+		self.add_button('Performance', flet.icons.SPEED, 'view_performance')
+		self.add_button('Record trace', flet.icons.TIMELINE, 'view_trace')
 
 
 class MenuPreference(Menu):
 	
-	def __init__(self):
-		super().__init__(text='Preference', icon=flet.icons.ROOM_PREFERENCES)
+	def __init__(self, events: EventBus=None):
+		super().__init__(text='Preference', icon=flet.icons.ROOM_PREFERENCES, events=events)
 		self.__ref = flet.Ref[flet.SubmenuButton]()
 		# preferences
-		self._on_settings = Callback()
-		self._on_shortcuts = Callback()
-		self._on_themes = Callback()
-		self._on_syntax_hightlight = Callback()
-		self._on_fonts = Callback()
-		self._on_pluggins = Callback()
-
-		self.add_button('Settings', flet.icons.SETTINGS, self._on_settings)
-		self.add_button('Shortcuts', flet.icons.SHORTCUT, self._on_shortcuts)
-		self.add_button('Themes', flet.icons.COLOR_LENS, self._on_themes)
-		self.add_button('Syntax highlight', flet.icons.HIGHLIGHT, self._on_syntax_hightlight)
-		self.add_button('Fonts', flet.icons.FONT_DOWNLOAD, self._on_fonts)
-		self.add_button('Pluggins', flet.icons.POWER, self._on_pluggins)
+		self.add_button('Settings', flet.icons.SETTINGS, 'preference_setting')
+		self.add_button('Shortcuts', flet.icons.SHORTCUT, 'preference_shortcut')
+		self.add_button('Themes', flet.icons.COLOR_LENS, 'preference_theme')
+		self.add_button('Syntax highlight', flet.icons.HIGHLIGHT, 'preference_syntax_highlight')
+		self.add_button('Fonts', flet.icons.FONT_DOWNLOAD, 'preference_font')
+		self.add_button('Pluggins', flet.icons.POWER, 'preference_pluggin')
 
 
 if __name__ == '__main__':
-	app = App()
+	app = App(trace='--trace-startup' in sys.argv[1:])
 	flet.app(target=app.target)
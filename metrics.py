@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+
+
+WINDOW = 5.0  # seconds of samples behind the rolling summary
+MAX_SAMPLES = 4096  # per timer or counter, the oldest go first
+TRACE_LIMIT = 1000000  # events kept while tracing, later ones are dropped
+TRACE_FOLDER = os.path.join(os.path.expanduser('~'), '.pyeditor')
+
+
+def _percentile(ordered: list, share: float):
+	return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+class Metrics:
+	def __init__(self, *w, window: float=WINDOW, max_samples: int=MAX_SAMPLES, **kw):
+		# timers and counters are deques of (end, value), appends need no lock, the totals do
+		self._window = window
+		self._max_samples = max_samples
+		self._lock = threading.Lock()
+		self._timers = {}  # name -> deque of (end, seconds)
+		self._counters = {}  # name -> deque of (time, amount)
+		self._totals = {}  # name -> amount since start
+		self._gauges = {}  # name -> callable, read when the summary is made
+		self._trace = None  # chrome trace events while tracing
+		self._trace_start = 0.0
+
+	def _series(self, table: dict, name: str):
+		series = table.get(name)
+		if series is None:
+			with self._lock:
+				series = table.setdefault(name, deque(maxlen=self._max_samples))
+		return series
+
+	def record(self, name: str, start: float, end: float=None):
+		# start and end are time.perf_counter() values around the measured code
+		end = time.perf_counter() if end is None else end
+		self._series(self._timers, name).append((end, end - start))
+		trace = self._trace
+		if trace is not None and len(trace) < TRACE_LIMIT:
+			trace.append({'name': name, 'ph': 'X', 'ts': (start - self._trace_start) * 1e6, 'dur': (end - start) * 1e6,
+				'pid': os.getpid(), 'tid': threading.get_ident()})
+
+	def timed(self, name: str, func: callable):
+		# func wrapped so every call is recorded under name
+		def call(*w, **kw):
+			start = time.perf_counter()
+			try:
+				return func(*w, **kw)
+			finally:
+				self.record(name, start)
+		return call
+
+	def count(self, name: str, amount: int=1):
+		now = time.perf_counter()
+		self._series(self._counters, name).append((now, amount))
+		with self._lock:
+			# read, add and store, io workers count at the same time
+			total = self._totals[name] = self._totals.get(name, 0) + amount
+		trace = self._trace
+		if trace is not None and len(trace) < TRACE_LIMIT:
+			trace.append({'name': name, 'ph': 'C', 'ts': (now - self._trace_start) * 1e6, 'args': {name: total},
+				'pid': os.getpid(), 'tid': 0})
+
+	def gauge(self, name: str, read: callable):
+		self._gauges[name] = read
+
+	def summary(self):
+		# {name: {...}} over the last window seconds
+		now = time.perf_counter()
+		since = now - self._window
+		result = {}
+		for name, series in list(self._timers.items()):
+			samples = sorted(seconds for end, seconds in list(series) if end >= since)
+			if samples:
+				result[name] = {'count': len(samples), 'per_s': len(samples) / self._window,
+					'p50_ms': _percentile(samples, 0.5) * 1000, 'p99_ms': _percentile(samples, 0.99) * 1000}
+		for name, series in list(self._counters.items()):
+			amount = sum(value for when, value in list(series) if when >= since)
+			result[name] = {'per_s': amount / self._window, 'total': self._totals.get(name, 0)}
+		for name, read in list(self._gauges.items()):
+			result[name] = {'value': read()}
+		return result
+
+	def status(self, size_format: callable=str):
+		# one line for the status bar: timers as p50/p99 and calls per second, counters (bytes) and gauges through size_format
+		parts = []
+		for name, values in self.summary().items():
+			if 'p50_ms' in values:
+				parts.append(f'{name} {values["p50_ms"]:.2f}/{values["p99_ms"]:.2f}ms {values["per_s"]:.1f}/s')
+			elif 'per_s' in values:
+				parts.append(f'{name} {size_format(values["per_s"])}/s')
+			else:
+				parts.append(f'{name} {size_format(values["value"])}')
+		return '  '.join(parts)
+
+	@property
+	def tracing(self):
+		return self._trace is not None
+
+	def start_trace(self):
+		self._trace_start = time.perf_counter()
+		self._trace = []
+
+	def stop_trace(self, path: str=None):
+		# writes the events in the chrome trace format (chrome://tracing, perfetto), returns the path
+		trace, self._trace = self._trace, None
+		if trace is None:
+			return None
+		if path is None:
+			path = os.path.join(TRACE_FOLDER, time.strftime('trace-%Y%m%d-%H%M%S.json'))
+		os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+		with open(path, 'w') as file:
+			json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, file)
+		return path
+
+
+METRICS = Metrics()
@@ -1,13 +1,525 @@
 import os
-import importlib
+import ast
+import json
+import time
+import pickle
+import threading
+import importlib.util
+from concurrent.futures import Future
+try:
+	import multiprocessing
+except ImportError:  # not every python build has it (android)
+	multiprocessing = None
 
-def load(*w, folder: str='pluggins', **kw):
-	pluggins = []
-	pluggins_files = [pluggin for pluggin in os.listdir(folder) if pluggin.endswith('.py') and not pluggin.startswith('template')] # list of .py files
-	for plug in pluggins_files:
-		path=f'{folder}.{plug[:-3]}'
-		module=importlib.import_module(f'{path}')
-		pluggin = module.Pluggin()
-		pluggins.append(pluggin)
-	return pluggins
+CACHE_PATH = os.path.join(os.path.expanduser('~'), '.pyeditor', 'pluggins.json')
+START_BUDGET = 10.0  # seconds a host process gets to start and import its pluggin
+CALL_BUDGET = 1.0  # seconds an isolated pluggin gets for init and each command
+UPDATE_BUDGET = 0.1  # seconds it gets for each buffer delta
+BATCH_INTERVAL = 0.05  # seconds, deltas are sent to a pluggin host together at most this often
+POLL_INTERVAL = 0.05  # seconds between deadline checks of a pluggin host
+MAX_RESTARTS = 3  # a host that keeps dying after this many restarts stays down
+# a pluggin without MANIFEST is loaded at startup, like before manifests existed
+DEFAULT_MANIFEST = {'activation': ['startup'], 'commands': []}
+
+
+class PlugginInfo:
+	def __init__(self, name: str, path: str, mtime: int, *w, activation: list=(), commands: list=(), error: str=None, **kw):
+		self.name = name
+		self.path = path
+		self.mtime = mtime
+		self.activation = list(activation)  # 'startup', 'open:.py', 'command:<name>' or '*'
+		self.commands = list(commands)
+		self.error = error  # manifest or import error, the pluggin is skipped
+		self.instance = None
+		self.load_time = None  # seconds spent importing and initializing
+
+	@property
+	def loaded(self):
+		return self.instance is not None
+
+	def wants(self, event: str):
+		return '*' in self.activation or event in self.activation
+
+	def to_cache(self):
+		return {'name': self.name, 'path': self.path, 'mtime': self.mtime, 'activation': self.activation, 'commands': self.commands, 'error': self.error}
+
+
+def _load_module(name: str, path: str):
+	spec = importlib.util.spec_from_file_location(f'pluggins.{name}', path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+
+def _picklable(kw: dict):
+	# editor objects stay in the editor process
+	result = {}
+	for key, value in kw.items():
+		try:
+			pickle.dumps(value)
+		except Exception:
+			continue
+		result[key] = value
+	return result
+
+
+def _host_main(connection, name: str, path: str):
+	# pluggin host process: runs batches of ('init', id, w, kw), ('update', document, delta) and ('call', id, method, w, kw)
+	# the import is answered first as (0, None or error), so the start is not counted against init
+	instance = None
+	try:
+		module = _load_module(name, path)
+	except Exception as exception:
+		connection.send((0, f'{type(exception).__name__}: {exception}'))
+		return
+	connection.send((0, None))
+	while True:
+		try:
+			seq, batch = connection.recv()
+		except (EOFError, OSError):
+			break
+		results = []
+		for message in batch:
+			kind = message[0]
+			if kind == 'close':
+				if instance is not None:
+					instance.close()
+				connection.send((seq, results))
+				return
+			try:
+				if kind == 'init':
+					instance = module.Pluggin()
+					results.append((message[1], True, instance.init(*message[2], **message[3])))
+				elif kind == 'update':
+					instance.update(document=message[1], delta=message[2])
+				elif kind == 'call':
+					results.append((message[1], True, getattr(instance, message[2])(*message[3], **message[4])))
+			except Exception as exception:
+				if kind != 'update':
+					results.append((message[1], False, f'{type(exception).__name__}: {exception}'))
+		try:
+			connection.send((seq, results))
+		except Exception as exception:
+			# a result that does not pickle
+			connection.send((seq, [(result[0], False, f'{type(exception).__name__}: {exception}') for result in results]))
+
+
+class PlugginHost:
+	def __init__(self, info: PlugginInfo, *w, budget: float=CALL_BUDGET, on_restart: callable=None, **kw):
+		# proxy with the Pluggin api, the pluggin itself runs in a child process
+		self._info = info
+		self._budget = budget
+		self._on_restart = on_restart  # called with the host after a restart, to send the documents again
+		self._context = multiprocessing.get_context('spawn')
+		self._lock = threading.RLock()
+		self._queue = []
+		self._timer = None
+		self._seq = 0
+		self._ids = 0
+		self._pending = None  # (deadline, seq) of the batch sent and not answered yet, one at a time
+		self._futures = {}  # call id -> Future
+		self._init = None
+		self._init_id = None  # call id of init(), nothing else is sent before it is answered
+		self._started = None  # deadline of the process start and import, None once the host answered it
+		self._acked = False  # init() returned
+		self._failed = None  # why the host stopped for good, nothing is sent anymore
+		self._process = None
+		self._connection = None
+		self._reader = None
+		self.restarts = 0
+
+	@property
+	def failed(self):
+		return self._failed
+
+	def start(self, *w, **kw):
+		# returns the future of init(), the process start is not waited for
+		with self._lock:
+			self._init = (w, _picklable(kw))
+			return self._spawn()
+
+	def _spawn(self):
+		parent, child = self._context.Pipe()
+		self._process = self._context.Process(target=_host_main, args=(child, self._info.name, self._info.path), daemon=True)
+		self._process.start()
+		child.close()
+		self._connection = parent
+		self._started = time.monotonic() + START_BUDGET
+		self._acked = False
+		self._reader = threading.Thread(target=self._read, args=(parent, self._process), daemon=True)
+		self._reader.start()
+		w, kw = self._init
+		future = Future()
+		self._ids += 1
+		self._init_id = self._ids
+		self._futures[self._ids] = future
+		self._queue.insert(0, ('init', self._ids, w, kw))
+		return future
+
+	def _call(self, method: str, w: tuple, kw: dict):
+		future = Future()
+		with self._lock:
+			if self._failed is not None:
+				future.set_exception(RuntimeError(self._failed))
+				return future
+			self._ids += 1
+			self._futures[self._ids] = future
+			self._queue.append(('call', self._ids, method, w, kw))
+		self.flush()
+		return future
+
+	def init(self, *w, **kw):
+		return self.start(*w, **kw)
+
+	def update(self, document=None, delta=None):
+		with self._lock:
+			if self._failed is not None:
+				return
+			self._queue.append(('update', document, delta))
+			if self._timer is None:
+				self._timer = threading.Timer(BATCH_INTERVAL, self.flush)
+				self._timer.daemon = True
+				self._timer.start()
+
+	def call(self, method: str, *w, **kw):
+		return self._call(method, w, kw)
+
+	def flush(self):
+		# the deadline of a batch starts when it is sent, and it is sent once the previous one is answered
+		with self._lock:
+			if self._timer is not None:
+				self._timer.cancel()
+				self._timer = None
+			if not self._queue or self._connection is None or self._started is not None or self._pending is not None:
+				return
+			if self._acked:
+				batch, self._queue = self._queue, []
+			else:
+				batch, self._queue = self._queue[:1], self._queue[1:]  # init alone, the updates wait for its answer
+			self._seq += 1
+			budget = sum(UPDATE_BUDGET if message[0] == 'update' else self._budget for message in batch)
+			self._pending = (time.monotonic() + budget, self._seq)
+			try:
+				self._connection.send((self._seq, batch))
+			except (OSError, ValueError):
+				pass  # the reader notices the dead host and restarts it
+
+	def _read(self, connection, process):
+		# results and deadlines of one host process, a late or dead host is killed and started again
+		while True:
+			try:
+				ready = connection.poll(POLL_INTERVAL)
+				if ready:
+					seq, results = connection.recv()
+			except (EOFError, OSError):
+				if self._process is process:
+					self.restart('host exited')
+				return
+			if self._process is not process:
+				return
+			if ready:
+				failed = None
+				with self._lock:
+					if seq == 0:
+						# the process is up and imported the pluggin, or could not
+						self._started = None
+						if results is not None:
+							failed = self._failed = results
+							self._futures.pop(self._init_id).set_exception(RuntimeError(results))
+					else:
+						self._pending = None
+						for call_id, ok, value in results:
+							future = self._futures.pop(call_id, None)
+							if future is None:
+								continue
+							if call_id == self._init_id:
+								self._acked = ok
+								if not ok:
+									failed = self._failed = value
+							if ok:
+								future.set_result(value)
+							else:
+								future.set_exception(RuntimeError(value))
+				if failed is not None:
+					self.stop(failed)
+					return
+				self.flush()
+				continue
+			with self._lock:
+				deadline = self._started if self._started is not None else (self._pending[0] if self._pending is not None else None)
+			if deadline is not None and deadline < time.monotonic():
+				self.restart('time budget exceeded')
+				return
+
+	def stop(self, reason: str):
+		# a pluggin that can not start stays down, restarting it would fail the same way
+		with self._lock:
+			self._failed = reason
+			if self._timer is not None:
+				self._timer.cancel()
+				self._timer = None
+			self._queue = []
+			process, self._process = self._process, None
+			connection, self._connection = self._connection, None
+			for future in self._futures.values():
+				future.set_exception(RuntimeError(reason))
+			self._futures.clear()
+			self._pending = None
+		if process is not None:
+			process.kill()
+		if connection is not None:
+			connection.close()
+
+	def restart(self, reason: str='restart'):
+		with self._lock:
+			if self._failed is not None:
+				return None
+			process, self._process = self._process, None
+			if process is not None:
+				process.kill()
+			if self._connection is not None:
+				self._connection.close()
+				self._connection = None
+			for future in self._futures.values():
+				future.set_exception(TimeoutError(f'{self._info.name}: {reason}'))
+			self._futures.clear()
+			self._pending = None
+			self._queue = [message for message in self._queue if message[0] == 'update']
+			if self.restarts >= MAX_RESTARTS:
+				self._info.error = self._failed = f'stopped after {self.restarts} restarts: {reason}'
+				self._queue = []
+				return None
+			self.restarts += 1
+			init = self._spawn()
+		if self._on_restart is not None:
+			self._on_restart(self)
+		return init
 
+	def close(self):
+		with self._lock:
+			if self._timer is not None:
+				self._timer.cancel()
+				self._timer = None
+			process, self._process = self._process, None
+			connection, self._connection = self._connection, None
+		if process is None:
+			return
+		try:
+			connection.send((0, [('close',)]))
+		except (OSError, ValueError):
+			pass
+		process.join(self._budget)
+		if process.is_alive():
+			process.kill()
+		connection.close()
+
+
+def read_manifest(path: str):
+	# MANIFEST = {...} is read with ast, the pluggin code itself does not run
+	with open(path, 'rb') as file:
+		tree = ast.parse(file.read(), path)
+	for node in tree.body:
+		if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == 'MANIFEST' for target in node.targets):
+			manifest = ast.literal_eval(node.value)
+			if not isinstance(manifest, dict):
+				raise ValueError('MANIFEST is not a dict')
+			return {**DEFAULT_MANIFEST, **manifest}
+	return dict(DEFAULT_MANIFEST)
+
+
+class PlugginManager:
+	def __init__(self, *w, folder: str='pluggins', cache: str=CACHE_PATH, isolate: bool=False, budget: float=CALL_BUDGET, **kw):
+		# isolate: every pluggin runs in its own host process, when the platform can start one
+		self._folder = os.path.abspath(folder)
+		self._cache = cache
+		self._lock = threading.RLock()
+		self._pluggins = None  # name -> PlugginInfo, filled by discover()
+		self._isolate = isolate and multiprocessing is not None
+		self._budget = budget
+		self._documents = {}  # document -> callable returning its text
+
+	def _load_cache(self):
+		try:
+			with open(self._cache, 'r', encoding='utf-8') as file:
+				data = json.load(file)
+		except (OSError, ValueError):
+			return None
+		return data.get(self._folder)
+
+	def _save_cache(self, mtime: int, pluggins: list):
+		try:
+			with open(self._cache, 'r', encoding='utf-8') as file:
+				data = json.load(file)
+		except (OSError, ValueError):
+			data = {}
+		data[self._folder] = {'mtime': mtime, 'pluggins': [info.to_cache() for info in pluggins]}
+		try:
+			os.makedirs(os.path.dirname(self._cache), exist_ok=True)
+			with open(self._cache, 'w', encoding='utf-8') as file:
+				json.dump(data, file)
+		except OSError:
+			pass
+
+	def discover(self):
+		# listing is skipped while the folder mtime is unchanged, manifests are parsed again only for edited files
+		with self._lock:
+			if self._pluggins is not None:
+				return list(self._pluggins.values())
+			try:
+				mtime = os.stat(self._folder).st_mtime_ns
+			except OSError:
+				self._pluggins = {}
+				return []
+			cached = self._load_cache()
+			known = {entry['name']: entry for entry in cached['pluggins']} if cached is not None else {}
+			if cached is not None and cached['mtime'] == mtime:
+				names = list(known)
+			else:
+				names = sorted(name[:-3] for name in os.listdir(self._folder) if name.endswith('.py') and not name.startswith(('template', '_')))
+			pluggins = []
+			changed = cached is None or cached['mtime'] != mtime
+			for name in names:
+				path = os.path.join(self._folder, f'{name}.py')
+				try:
+					file_mtime = os.stat(path).st_mtime_ns
+				except OSError:
+					changed = True
+					continue
+				entry = known.get(name)
+				if entry is not None and entry['mtime'] == file_mtime:
+					pluggins.append(PlugginInfo(name, path, file_mtime, activation=entry['activation'], commands=entry['commands'], error=entry['error']))
+					continue
+				changed = True
+				try:
+					manifest = read_manifest(path)
+					pluggins.append(PlugginInfo(name, path, file_mtime, activation=manifest['activation'], commands=manifest['commands']))
+				except (OSError, SyntaxError, ValueError) as exception:
+					pluggins.append(PlugginInfo(name, path, file_mtime, error=f'manifest: {exception}'))
+			if changed:
+				self._save_cache(mtime, pluggins)
+			self._pluggins = {info.name: info for info in pluggins}
+			return pluggins
+
+	def activate(self, info: PlugginInfo, *w, **kw):
+		# import and init one pluggin, a failing pluggin only disables itself
+		with self._lock:
+			if info.loaded or info.error is not None:
+				return info.instance
+			started = time.perf_counter()
+			if self._isolate:
+				instance = self._host(info, started, *w, **kw)
+				if instance is not None:
+					return instance
+			try:
+				instance = _load_module(info.name, info.path).Pluggin()
+				instance.init(*w, **kw)
+			except Exception as exception:
+				info.error = f'{type(exception).__name__}: {exception}'
+				return None
+			finally:
+				info.load_time = time.perf_counter() - started
+			info.instance = instance
+			self._sync(instance)
+			return instance
+
+	def _host(self, info: PlugginInfo, started: float, *w, **kw):
+		try:
+			host = PlugginHost(info, budget=self._budget, on_restart=self._sync)
+			init = host.start(*w, **kw)
+		except (OSError, ImportError, NotImplementedError):
+			return None  # no process support, the pluggin runs in process
+
+		def on_init(future):
+			info.load_time = time.perf_counter() - started
+			if future.exception() is not None and host.failed is not None:
+				# init or the import failed, the host stopped itself
+				info.error = f'{future.exception()}'
+				info.instance = None
+		init.add_done_callback(on_init)
+		info.instance = host
+		self._sync(host)
+		return host
+
+	# documents, pluggins get update(document=..., delta=(offset, removed length, inserted text)), delta None on close
+	def _sync(self, instance):
+		for document, text in list(self._documents.items()):
+			self._update(instance, document, (0, 0, text()))
+
+	def _update(self, instance, document, delta):
+		try:
+			instance.update(document=document, delta=delta)
+		except Exception:
+			pass
+
+	def _loaded(self):
+		return [info.instance for info in (self._pluggins or {}).values() if info.loaded]
+
+	def open_document(self, document, text: callable):
+		# text() is called again when a pluggin starts or its host is restarted
+		if document in self._documents:
+			return
+		self._documents[document] = text
+		for instance in self._loaded():
+			self._update(instance, document, (0, 0, text()))
+
+	def edit(self, document, offset: int, removed: int, inserted: str):
+		if document not in self._documents:
+			return
+		for instance in self._loaded():
+			self._update(instance, document, (offset, removed, inserted))
+
+	def close_document(self, document):
+		if self._documents.pop(document, None) is None:
+			return
+		for instance in self._loaded():
+			self._update(instance, document, None)
+
+	def trigger(self, event: str, *w, **kw):
+		# activate every pluggin waiting for event, the arguments go to their init()
+		instances = []
+		for info in self.discover():
+			if info.wants(event):
+				instance = self.activate(info, *w, **kw)
+				if instance is not None:
+					instances.append(instance)
+		return instances
+
+	def commands(self):
+		return {command: info for info in self.discover() for command in info.commands}
+
+	def run(self, command: str, *w, **kw):
+		info = self.commands().get(command)
+		if info is None:
+			raise KeyError(command)
+		instance = self.activate(info)
+		if instance is None:
+			raise RuntimeError(info.error)
+		if isinstance(instance, PlugginHost):
+			# the host answers, restarts on its own deadline or stops, the future always completes
+			return instance.call(command, *w, **kw).result()
+		return getattr(instance, command)(*w, **kw)
+
+	def report(self):
+		# (name, loaded, load time in seconds or None, error)
+		return [(info.name, info.loaded, info.load_time, info.error) for info in self.discover()]
+
+	def close(self):
+		with self._lock:
+			for info in (self._pluggins or {}).values():
+				if info.loaded:
+					try:
+						info.instance.close()
+					except Exception:
+						pass
+					info.instance = None
+
+
+def load(*w, folder: str='pluggins', **kw):
+	# every pluggin of folder, activated right away
+	manager = PlugginManager(folder=folder, **kw)
+	instances = []
+	for info in manager.discover():
+		instance = manager.activate(info)
+		if instance is not None:
+			instances.append(instance)
+	return instances
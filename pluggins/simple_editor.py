@@ -1,3 +1,6 @@
+MANIFEST = {'activation': ['startup'], 'commands': []}
+
+
 class Pluggin:
 	def __init__(self, *w, **kw):
 		pass
@@ -0,0 +1,291 @@
+import os
+import re
+import bisect
+import fnmatch
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+CHUNK_SIZE = 1024 * 1024
+REGEX_OVERLAP = 4096  # longest regex match that is still found across a chunk boundary
+SNIFF_SIZE = 8192  # a null byte in the first bytes marks a file as binary
+MAX_LINE_PREVIEW = 200
+
+
+def chunked(text: str, chunk_size: int=CHUNK_SIZE):
+	for position in range(0, len(text), chunk_size):
+		yield text[position:position + chunk_size]
+
+
+class Searcher:
+	def __init__(self, query: str, *w, case: bool=True, regex: bool=False, encoding: str='utf-8', **kw):
+		self.query = query
+		self.case = case
+		self.regex = regex
+		self._encoding = encoding
+		self._flags = re.MULTILINE | (0 if case else re.IGNORECASE)
+		self._pattern = re.compile(query if regex else re.escape(query), self._flags)
+		self._bytes_pattern = None
+		# how far a window has to look past its end to see every match starting inside it
+		self.overlap = REGEX_OVERLAP if regex else max(0, len(query.encode(encoding)) - 1)
+
+	def pattern(self, text):
+		if isinstance(text, str):
+			return self._pattern
+		if self._bytes_pattern is None:
+			query = self.query.encode(self._encoding)
+			self._bytes_pattern = re.compile(query if self.regex else re.escape(query), self._flags)
+		return self._bytes_pattern
+
+	def expand(self, text: str, start: int, replacement: str):
+		# replacement text for the match at start, group references expanded for regex searches
+		if not self.regex:
+			return replacement
+		match = self._pattern.match(text, start)
+		return match.expand(replacement) if match is not None else replacement
+
+	def find(self, text, start: int=0, end: int=None, progress: callable=None, chunk_size: int=CHUNK_SIZE):
+		# text: str, bytes or mmap; scanned window by window so progress can cancel between them
+		end = len(text) if end is None else min(end, len(text))
+		pattern = self.pattern(text)
+		matches = []
+		position = start
+		if progress is not None:
+			progress(0, end - start)
+		while position < end:
+			window = min(position + chunk_size, end)
+			for match in pattern.finditer(text, position, min(window + self.overlap, len(text))):
+				if match.start() >= window or match.start() >= end:
+					break
+				if match.end() == match.start():
+					continue
+				matches.append((match.start(), match.end()))
+			position = max(window, matches[-1][1] if matches else window)
+			if progress is not None:
+				progress(position - start)
+		return matches
+
+	def replace_stream(self, chunks, replacement: str):
+		# yields the replaced text chunk by chunk, memory stays around one chunk plus the overlap
+		pattern = self._pattern
+		expand = self.regex
+		context = ''  # last char before the carry, keeps ^ and \b right
+		carry = ''
+		for chunk in chunks:
+			text = context + carry + chunk
+			safe = max(len(context), len(text) - max(self.overlap, 1))
+			output, keep = self._replace(pattern, text, len(context), safe, replacement, expand)
+			context, carry = text[keep - 1:keep] if keep > 0 else '', text[keep:]
+			if output:
+				yield output
+		text = context + carry
+		output, keep = self._replace(pattern, text, len(context), len(text) + 1, replacement, expand)
+		if output:
+			yield output
+
+	@staticmethod
+	def _replace(pattern, text: str, start: int, safe: int, replacement: str, expand: bool):
+		output = []
+		position = start
+		for match in pattern.finditer(text, start):
+			if match.start() >= safe:
+				break
+			if match.end() == match.start():
+				continue
+			output.append(text[position:match.start()])
+			output.append(match.expand(replacement) if expand else replacement)
+			position = match.end()
+		keep = max(position, min(safe, len(text)))
+		output.append(text[position:keep])
+		return ''.join(output), keep
+
+
+class MatchSet:
+	def __init__(self, searcher: Searcher, matches: list=None):
+		self.searcher = searcher
+		self._matches = matches or []  # sorted (start, end)
+		self._starts = [start for start, end in self._matches]
+
+	def __len__(self):
+		return len(self._matches)
+
+	def __getitem__(self, index: int):
+		return self._matches[index]
+
+	def index_after(self, offset: int):
+		# first match starting at or after offset, wrapping around
+		index = bisect.bisect_left(self._starts, offset)
+		return index if index < len(self._matches) else 0
+
+	def edit(self, offset: int, removed: int, inserted, text: str):
+		# re-search only around the edited region of the new text
+		inserted = inserted if isinstance(inserted, int) else len(inserted)
+		delta = inserted - removed
+		margin = self.searcher.overlap + 1
+		low = offset - margin
+		high = offset + removed + margin
+		first = bisect.bisect_left(self._starts, low)
+		while first > 0 and self._matches[first - 1][1] > low:
+			first -= 1
+		last = bisect.bisect_left(self._starts, high)
+		before = self._matches[:first]
+		after = [(start + delta, end + delta) for start, end in self._matches[last:]]
+		dropped = self._matches[first][0] if first < last else low
+		scan_start = max(0, before[-1][1] if before else 0, min(low, dropped))
+		scan_end = offset + inserted + margin
+		# rescan until the new matches line up with the old ones again
+		found = []
+		index = 0
+		for match in self.searcher.pattern(text).finditer(text, scan_start):
+			if match.end() == match.start():
+				continue
+			while index < len(after) and after[index][0] < match.start():
+				index += 1
+			if match.start() >= scan_end and index < len(after) and after[index] == match.span():
+				break
+			found.append(match.span())
+		else:
+			index = len(after)
+		self._matches = before + found + after[index:]
+		self._starts = [start for start, end in self._matches]
+
+
+def is_binary(path: str, sniff: int=SNIFF_SIZE):
+	try:
+		with open(path, 'rb') as file:
+			return b'\0' in file.read(sniff)
+	except OSError:
+		return True
+
+
+class Ignore:
+	def __init__(self, root: str, parent=None):
+		# .gitignore rules of root, checked after the ones of the parent folders
+		self._root = root
+		self._parent = parent
+		self._rules = []  # (pattern, negate, only_dirs, anchored)
+		try:
+			with open(os.path.join(root, '.gitignore'), 'r', errors='replace') as file:
+				lines = file.read().splitlines()
+		except OSError:
+			lines = []
+		for line in lines:
+			line = line.strip()
+			if not line or line.startswith('#'):
+				continue
+			negate = line.startswith('!')
+			line = line.lstrip('!')
+			only_dirs = line.endswith('/')
+			line = line.rstrip('/')
+			anchored = '/' in line
+			self._rules.append((line.lstrip('/'), negate, only_dirs, anchored))
+
+	def child(self, folder: str):
+		ignore = Ignore(folder, parent=self)
+		return ignore if ignore._rules else self
+
+	def ignored(self, path: str, is_dir: bool):
+		name = os.path.basename(path)
+		if name == '.git':
+			return True
+		ignored = self._parent.ignored(path, is_dir) if self._parent is not None else False
+		relative = os.path.relpath(path, self._root).replace(os.sep, '/')
+		for pattern, negate, only_dirs, anchored in self._rules:
+			if only_dirs and not is_dir:
+				continue
+			if fnmatch.fnmatchcase(relative if anchored else name, pattern):
+				ignored = not negate
+		return ignored
+
+
+def walk(root: str):
+	# yields files lazily, folders are only held while they are being listed
+	stack = [(root, Ignore(root))]
+	while stack:
+		folder, ignore = stack.pop()
+		try:
+			entries = os.scandir(folder)
+		except OSError:
+			continue
+		with entries:
+			for entry in entries:
+				try:
+					is_dir = entry.is_dir(follow_symlinks=False)
+					if ignore.ignored(entry.path, is_dir):
+						continue
+					if is_dir:
+						stack.append((entry.path, ignore.child(entry.path)))
+					elif entry.is_file(follow_symlinks=False):
+						yield entry.path
+				except OSError:
+					continue
+
+
+_SEARCHERS = {}
+
+
+def _scan_files(paths: list, query: str, case: bool, regex: bool):
+	# runs in a worker process: [(path, [(line, column, preview)])] for the files with hits
+	key = (query, case, regex)
+	searcher = _SEARCHERS.get(key)
+	if searcher is None:
+		searcher = _SEARCHERS[key] = Searcher(query, case=case, regex=regex)
+	results = []
+	for path in paths:
+		if is_binary(path):
+			continue
+		hits = []
+		try:
+			with open(path, 'r', encoding='utf-8', errors='replace') as file:
+				for number, line in enumerate(file):
+					match = searcher.pattern(line).search(line)
+					if match is not None:
+						hits.append((number, match.start(), line[:MAX_LINE_PREVIEW].rstrip('\r\n')))
+		except OSError:
+			continue
+		if hits:
+			results.append((path, hits))
+	return results
+
+
+def find_in_folder(root: str, searcher: Searcher, on_result: callable, progress: callable=None, workers: int=None, batch: int=64, paths=None):
+	# on_result(path, hits) is called as soon as a batch of files comes back
+	# paths: candidate files (e.g. from a TrigramIndex), every file under root when None
+	workers = workers or os.cpu_count() or 1
+	try:
+		pool = ProcessPoolExecutor(max_workers=workers)
+	except (ImportError, NotImplementedError, OSError):
+		pool = ThreadPoolExecutor(max_workers=workers)  # no process support (android)
+	pending = {}  # future -> files in its batch
+	scanned = 0
+
+	def submit(block: list):
+		pending[pool.submit(_scan_files, block, searcher.query, searcher.case, searcher.regex)] = len(block)
+
+	def collect():
+		nonlocal scanned
+		done, _ = wait(pending, return_when=FIRST_COMPLETED)
+		for future in done:
+			scanned += pending.pop(future)
+			for path, hits in future.result():
+				on_result(path, hits)
+		if progress is not None:
+			progress(scanned)
+
+	try:
+		block = []
+		for path in walk(root) if paths is None else paths:
+			block.append(path)
+			if len(block) >= batch:
+				submit(block)
+				block = []
+				while len(pending) >= workers * 2:
+					collect()
+		if block:
+			submit(block)
+		while pending:
+			collect()
+	finally:
+		for future in pending:
+			future.cancel()
+		pool.shutdown(wait=False, cancel_futures=True)
+	return scanned
@@ -0,0 +1,164 @@
+import os
+import struct
+import threading
+
+from fileio import Format, BOMS, atomic_write
+
+
+SESSION_FOLDER = os.path.join(os.path.expanduser('~'), '.pyeditor', 'session')
+SESSION_INTERVAL = 2.0  # seconds between a change and the snapshot it triggers
+MAGIC = b'PYSS'
+VERSION = 2
+# header: magic, version, tabs, selected index
+HEADER = struct.Struct('<4sIIi')
+# tab: flags, text size (0 default), line, column, buffer id (0 none), line ending, path, title and encoding lengths (followed by the utf-8 strings)
+TAB = struct.Struct('<BHIIIBHHB')
+FLAG_HIGHLIGHT = 1
+FLAG_BOM = 2
+NEWLINES = (None, '\n', '\r\n', '\r')  # line ending codes, 0 is the platform one
+
+
+def _format(flags: int, encoding: str, newline: int):
+	if not encoding:
+		return None
+	bom = next((bom for bom, name in BOMS if name == encoding), b'') if flags & FLAG_BOM else b''
+	return Format(encoding, bom=bom, newline=NEWLINES[newline])
+
+
+class TabState:
+	__slots__ = ('path', 'title', 'text_size', 'line', 'column', 'highlight', 'buffer', 'generation', 'data', 'file_format')
+
+	def __init__(self, path: str='', title: str='', *w, text_size: int=None, line: int=0, column: int=0, highlight: bool=False,
+			buffer: int=0, generation: int=0, data: str=None, file_format: Format=None, **kw):
+		# buffer: id of the unsaved content kept by the session, data: that content when it has to be written again
+		# file_format: encoding and line ending the content is saved with, None when the tab never had a file
+		self.path = path
+		self.title = title
+		self.text_size = text_size
+		self.line = line
+		self.column = column
+		self.highlight = highlight
+		self.buffer = buffer
+		self.generation = generation
+		self.data = data
+		self.file_format = file_format
+
+
+class Session:
+	def __init__(self, *w, folder: str=SESSION_FOLDER, interval: float=SESSION_INTERVAL, **kw):
+		self._folder = folder
+		self._path = os.path.join(folder, 'session.bin')
+		self._buffers = os.path.join(folder, 'buffers')
+		self._interval = interval
+		self._lock = threading.Lock()
+		self._write_lock = threading.Lock()
+		self._timer = None
+		self._collect = None
+		self._written = {}  # buffer id -> generation on disk
+		self._next_id = 1
+
+	def buffer_path(self, buffer: int):
+		return os.path.join(self._buffers, f'{buffer}.txt')
+
+	def new_id(self):
+		with self._lock:
+			buffer = self._next_id
+			self._next_id += 1
+			return buffer
+
+	def needs(self, buffer: int, generation: int):
+		# False when the buffer file already holds this generation
+		return self._written.get(buffer) != generation
+
+	def mark(self, buffer: int, generation: int):
+		self._written[buffer] = generation
+
+	def load(self):
+		# ([TabState], selected index), nothing but the small metadata file is read
+		try:
+			with open(self._path, 'rb') as file:
+				data = file.read()
+		except OSError:
+			return [], -1
+		if len(data) < HEADER.size:
+			return [], -1
+		magic, version, count, selected = HEADER.unpack_from(data, 0)
+		if magic != MAGIC or version != VERSION:
+			return [], -1
+		states = []
+		position = HEADER.size
+		try:
+			for _ in range(count):
+				flags, text_size, line, column, buffer, newline, path_length, title_length, encoding_length = TAB.unpack_from(data, position)
+				position += TAB.size
+				path = data[position:position + path_length].decode('utf-8')
+				position += path_length
+				title = data[position:position + title_length].decode('utf-8')
+				position += title_length
+				encoding = data[position:position + encoding_length].decode('utf-8')
+				position += encoding_length
+				if buffer and not os.path.exists(self.buffer_path(buffer)):
+					buffer = 0
+					if not path:
+						continue
+				states.append(TabState(path, title, text_size=text_size or None, line=line, column=column,
+					highlight=bool(flags & FLAG_HIGHLIGHT), buffer=buffer, file_format=_format(flags, encoding, newline)))
+				if buffer:
+					self._written[buffer] = 0
+					self._next_id = max(self._next_id, buffer + 1)
+		except (struct.error, UnicodeDecodeError, IndexError):
+			return [], -1
+		return states, min(selected, len(states) - 1)
+
+	def schedule(self, collect: callable):
+		# collect() -> ([TabState], selected) runs once when the interval is over, however many changes came in
+		with self._lock:
+			self._collect = collect
+			if self._timer is None:
+				self._timer = threading.Timer(self._interval, self.flush)
+				self._timer.daemon = True
+				self._timer.start()
+
+	def flush(self):
+		with self._lock:
+			collect, self._collect = self._collect, None
+			timer, self._timer = self._timer, None
+		if timer is not None:
+			timer.cancel()
+		if collect is not None:
+			self.write(*collect())
+
+	def write(self, states: list, selected: int):
+		# only buffers whose generation moved are written, the metadata file is small and rewritten whole
+		with self._write_lock:
+			os.makedirs(self._buffers, exist_ok=True)
+			for state in states:
+				if state.buffer and state.data is not None:
+					atomic_write(self.buffer_path(state.buffer), [state.data.encode('utf-8', 'surrogatepass')], binary=True)
+					self._written[state.buffer] = state.generation
+			parts = [HEADER.pack(MAGIC, VERSION, len(states), selected)]
+			for state in states:
+				path = state.path.encode('utf-8')
+				title = state.title.encode('utf-8')
+				file_format = state.file_format
+				encoding = file_format.encoding.encode('utf-8') if file_format is not None else b''
+				newline = NEWLINES.index(file_format.newline) if file_format is not None else 0
+				flags = FLAG_HIGHLIGHT if state.highlight else 0
+				if file_format is not None and file_format.bom:
+					flags |= FLAG_BOM
+				parts.append(TAB.pack(flags, state.text_size or 0, state.line, state.column, state.buffer, newline,
+					len(path), len(title), len(encoding)))
+				parts.append(path)
+				parts.append(title)
+				parts.append(encoding)
+			atomic_write(self._path, [b''.join(parts)], binary=True)
+			# buffers of closed or saved tabs
+			used = {state.buffer for state in states if state.buffer}
+			self._written = {buffer: generation for buffer, generation in self._written.items() if buffer in used}
+			names = {f'{buffer}.txt' for buffer in used}
+			for name in os.listdir(self._buffers):
+				if name not in names:
+					try:
+						os.unlink(os.path.join(self._buffers, name))
+					except OSError:
+						pass
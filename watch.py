@@ -0,0 +1,179 @@
+import os
+import select
+import struct
+import threading
+import ctypes
+import ctypes.util
+
+
+POLL_INTERVAL = 1.0  # seconds between stats when inotify is not available, also how fast stop() is noticed
+# inotify_event: watch descriptor, mask, cookie, name length (followed by the name)
+EVENT = struct.Struct('iIII')
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+class Inotify:
+	def __init__(self):
+		# raises OSError where the kernel or the libc has no inotify
+		try:
+			self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+			init = self._libc.inotify_init1
+		except (OSError, AttributeError) as exception:
+			raise OSError(f'no inotify: {exception}')
+		self.fd = init(IN_NONBLOCK | IN_CLOEXEC)
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), 'inotify_init1')
+
+	def add(self, folder: str):
+		wd = self._libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+		if wd < 0:
+			raise OSError(ctypes.get_errno(), 'inotify_add_watch', folder)
+		return wd
+
+	def remove(self, wd: int):
+		self._libc.inotify_rm_watch(self.fd, wd)
+
+	def read(self):
+		# [(wd, mask, name)] of everything queued
+		try:
+			data = os.read(self.fd, 64 * 1024)
+		except BlockingIOError:
+			return []
+		events = []
+		position = 0
+		while position + EVENT.size <= len(data):
+			wd, mask, cookie, length = EVENT.unpack_from(data, position)
+			position += EVENT.size
+			name = os.fsdecode(data[position:position + length].rstrip(b'\0'))
+			position += length
+			events.append((wd, mask, name))
+		return events
+
+	def close(self):
+		os.close(self.fd)
+
+
+class FileWatcher:
+	def __init__(self, on_change: callable, *w, poll_interval: float=POLL_INTERVAL, inotify: bool=True, **kw):
+		# on_change(path) runs on the watcher thread, once per path for every burst of events
+		self._on_change = on_change
+		self._poll_interval = poll_interval
+		self._lock = threading.Lock()
+		self._paths = {}  # path -> (size, mtime_ns) seen last, used when polling
+		self._folders = {}  # folder -> [wd, set of watched names]
+		self._wds = {}  # wd -> folder
+		self._stop = threading.Event()
+		self._thread = None
+		self._inotify = None
+		if inotify:
+			try:
+				self._inotify = Inotify()
+			except OSError:
+				self._inotify = None  # polling
+
+	@property
+	def polling(self):
+		return self._inotify is None
+
+	@staticmethod
+	def _stat(path: str):
+		try:
+			stat = os.stat(path)
+		except OSError:
+			return None
+		return stat.st_size, stat.st_mtime_ns
+
+	def watch(self, path: str):
+		path = os.path.abspath(path)
+		folder, name = os.path.split(path)
+		with self._lock:
+			if path in self._paths:
+				return
+			self._paths[path] = self._stat(path)
+			if self._inotify is not None:
+				entry = self._folders.get(folder)
+				if entry is None:
+					try:
+						wd = self._inotify.add(folder)
+					except OSError:
+						return  # this one is polled
+					entry = self._folders[folder] = [wd, set()]
+					self._wds[wd] = folder
+				entry[1].add(name)
+		self.start()
+
+	def unwatch(self, path: str):
+		path = os.path.abspath(path)
+		folder, name = os.path.split(path)
+		with self._lock:
+			self._paths.pop(path, None)
+			entry = self._folders.get(folder)
+			if entry is not None:
+				entry[1].discard(name)
+				if not entry[1]:
+					del self._folders[folder]
+					del self._wds[entry[0]]
+					if self._inotify is not None:  # closed by stop()
+						self._inotify.remove(entry[0])
+
+	def start(self):
+		with self._lock:
+			if self._thread is not None:
+				return
+			self._thread = threading.Thread(target=self._run, name='watcher', daemon=True)
+			self._thread.start()
+
+	def stop(self):
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join(self._poll_interval * 2)
+		if self._inotify is not None:
+			self._inotify.close()
+			self._inotify = None
+
+	def _run(self):
+		while not self._stop.is_set():
+			if self._inotify is not None:
+				changed = self._wait_inotify()
+			else:
+				self._stop.wait(self._poll_interval)
+				changed = set()
+			changed |= self._poll()
+			for path in changed:
+				self._on_change(path)
+
+	def _wait_inotify(self):
+		ready, _, _ = select.select([self._inotify.fd], [], [], self._poll_interval)
+		if not ready:
+			return set()
+		changed = set()
+		for wd, mask, name in self._inotify.read():
+			with self._lock:
+				if mask & IN_Q_OVERFLOW:
+					return set(self._paths)  # events were lost, let every path be checked
+				folder = self._wds.get(wd)
+				if folder is not None and name in self._folders[folder][1]:
+					changed.add(os.path.join(folder, name))
+		return changed
+
+	def _poll(self):
+		# stat the paths inotify does not cover, all of them when polling
+		with self._lock:
+			paths = [path for path in self._paths if self._inotify is None or os.path.dirname(path) not in self._folders]
+		changed = set()
+		for path in paths:
+			stat = self._stat(path)
+			with self._lock:
+				if path in self._paths and self._paths[path] != stat:
+					self._paths[path] = stat
+					changed.add(path)
+		return changed